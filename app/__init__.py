@@ -10,8 +10,16 @@ from dotenv import load_dotenv
 load_dotenv()
 from flask_dance.contrib.google import make_google_blueprint, google
 from flask_dance.consumer.storage import BaseStorage
-from pymemcache.client.base import PooledClient
-from bson import json_util
+from pymemcache.client.retrying import RetryingClient
+from pymemcache.exceptions import MemcacheUnexpectedCloseError
+from .cache import KEY_PREFIX, LocalCache, TieredCache, CacheManager
+from .memcached import ChunkingClient, ReplicatingClient, make_memcached_client, parse_servers
+from .serde import make_serde
+from .circuit_breaker import CircuitBreakerClient
+from .instrumentation import RequestInstrumentation, InstrumentedClient
+from .identity import get_identity_stats
+from .jobs import DEFAULT_JOBS_MODE, JobQueue, JobWorker, load_handlers
+from . import metrics as prometheus_metrics
 from flask_paginate import Pagination, get_page_args
 # No additional navigation library needed - using Bootstrap CSS in templates
 from .constants import (
@@ -22,6 +30,7 @@ from .constants import (
     LOCATION_OPTIONS as location,
     HIGHLIGHTED_ETHNICITIES as e
 )
+from .stats import STATS_BACKENDS, DEFAULT_STATS_BACKEND
 
 def create_app():
     app = Flask(__name__)
@@ -30,6 +39,50 @@ def create_app():
     app.config['MONGO_DBNAME'] = os.environ.get('MONGO_DBNAME', 'choosytable')
     app.config['MONGO_URI'] = os.environ.get('MONGO_URI', 'mongodb://localhost:27017/choosytable')
     
+    # MongoDB pool, timeouts and retries, passed to MongoClient. A bounded wait
+    # for a pooled connection turns pool exhaustion into a fast error
+    app.config['MONGO_CLIENT_OPTIONS'] = {
+        'maxPoolSize': int(os.environ.get('MONGO_MAX_POOL_SIZE', 100)),
+        'minPoolSize': int(os.environ.get('MONGO_MIN_POOL_SIZE', 0)),
+        'maxIdleTimeMS': int(os.environ.get('MONGO_MAX_IDLE_TIME_MS', 300000)),
+        'waitQueueTimeoutMS': int(os.environ.get('MONGO_WAIT_QUEUE_TIMEOUT_MS', 2000)),
+        'connectTimeoutMS': int(os.environ.get('MONGO_CONNECT_TIMEOUT_MS', 5000)),
+        'socketTimeoutMS': int(os.environ.get('MONGO_SOCKET_TIMEOUT_MS', 30000)),
+        'serverSelectionTimeoutMS': int(os.environ.get('MONGO_SERVER_SELECTION_TIMEOUT_MS', 5000)),
+        'retryReads': os.environ.get('MONGO_RETRY_READS', 'true').lower() == 'true',
+        'retryWrites': os.environ.get('MONGO_RETRY_WRITES', 'true').lower() == 'true'
+    }
+    
+    # memcached servers: one host[:port] or a comma-separated list, hashed over by HashClient
+    app.config['MEMCACHED_SERVERS'] = parse_servers(os.environ.get('MEMCACHED_HOST', 'localhost'))
+    # memcached pool and timeouts (seconds), and when HashClient gives up on a node
+    app.config['MEMCACHED_CLIENT_OPTIONS'] = {
+        'max_pool_size': int(os.environ.get('MEMCACHED_MAX_POOL_SIZE', 64)),
+        'pool_idle_timeout': int(os.environ.get('MEMCACHED_POOL_IDLE_TIMEOUT', 60)),
+        'connect_timeout': float(os.environ.get('MEMCACHED_CONNECT_TIMEOUT', 0.25)),
+        'timeout': float(os.environ.get('MEMCACHED_TIMEOUT', 0.5)),
+        'no_delay': True,
+        'dead_retry_attempts': int(os.environ.get('MEMCACHED_DEAD_RETRY_ATTEMPTS', 2)),
+        'dead_retry_timeout': float(os.environ.get('MEMCACHED_DEAD_RETRY_TIMEOUT', 1)),
+        'dead_timeout': float(os.environ.get('MEMCACHED_DEAD_TIMEOUT', 60))
+    }
+    # Key spaces read by nearly every request, stored on several nodes (1 = no replication)
+    app.config['MEMCACHED_HOT_KEYS'] = [
+        name.strip() for name in os.environ.get('MEMCACHED_HOT_KEYS', 'companies_count,companies_page').split(',')
+        if name.strip()
+    ]
+    app.config['MEMCACHED_HOT_KEY_REPLICAS'] = int(os.environ.get('MEMCACHED_HOT_KEY_REPLICAS', 1))
+    # Encoded values above CACHE_CHUNK_SIZE bytes are split to fit memcached's
+    # 1MB item limit (0 disables chunking); values from CACHE_LARGE_VALUE_WARN
+    # bytes are logged and counted per key space
+    app.config['CACHE_CHUNK_SIZE'] = int(os.environ.get('CACHE_CHUNK_SIZE', 1000000))
+    app.config['CACHE_LARGE_VALUE_WARN'] = int(os.environ.get('CACHE_LARGE_VALUE_WARN', 524288))
+    # Attempts per memcached call on a dropped connection, and the circuit
+    # breaker that stops calling a dead memcached (0 failures disables it)
+    app.config['MEMCACHED_RETRY_ATTEMPTS'] = int(os.environ.get('MEMCACHED_RETRY_ATTEMPTS', 2))
+    app.config['MEMCACHED_BREAKER_FAILURES'] = int(os.environ.get('MEMCACHED_BREAKER_FAILURES', 5))
+    app.config['MEMCACHED_BREAKER_RESET'] = float(os.environ.get('MEMCACHED_BREAKER_RESET', 30))
+    
     # Security: Use environment variable for secret key to maintain sessions across restarts
     secret_key = os.environ.get('SECRET_KEY')
     if not secret_key:
@@ -39,6 +92,20 @@ def create_app():
         )
     app.secret_key = secret_key
     
+    # Statistics backend: 'python' or 'aggregation' (see app/stats.py)
+    stats_backend = os.environ.get('STATS_BACKEND', DEFAULT_STATS_BACKEND).lower()
+    if stats_backend not in STATS_BACKENDS:
+        raise ValueError(f"STATS_BACKEND must be one of: {', '.join(STATS_BACKENDS)}")
+    app.config['STATS_BACKEND'] = stats_backend
+    
+    # Background jobs: worker threads in this process ('thread'), separate
+    # job_worker.py processes ('worker') or run in the request ('inline')
+    app.config['JOBS_MODE'] = os.environ.get('JOBS_MODE', DEFAULT_JOBS_MODE).lower()
+    app.config['JOBS_THREADS'] = int(os.environ.get('JOBS_THREADS', 1))
+    app.config['JOBS_POLL_INTERVAL'] = float(os.environ.get('JOBS_POLL_INTERVAL', 1.0))
+    app.config['JOBS_LEASE'] = float(os.environ.get('JOBS_LEASE', 300))
+    app.config['JOBS_RETRY_DELAY'] = float(os.environ.get('JOBS_RETRY_DELAY', 5))
+    
     # OAuth configuration
     app.config['GOOGLE_OAUTH_CLIENT_ID'] = os.environ.get("GOOGLE_CLIENT_ID")
     app.config['GOOGLE_OAUTH_CLIENT_SECRET'] = os.environ.get("GOOGLE_CLIENT_SECRET")
@@ -52,31 +119,53 @@ def create_app():
 
 # Initialize global objects
 mongo = None
-ct = None 
+db = None
 blueprint = None
 login_manager = None
 client = None
-
-class JsonSerde(object):
-    def serialize(self, key, value):
-        if isinstance(value, str):
-            return value, 1
-        return json_util.dumps(value), 2
-
-    def deserialize(self, key, value, flags):
-       if flags == 1:
-           return value
-       if flags == 2:
-           return json_util.loads(value)
-       raise Exception("Unknown serialization format")
+cache = None
+cache_manager = None
+instrumentation = None
+metrics = None
+job_queue = None
 
 def init_app_components(app):
     """Initialize app components after app creation"""
-    global mongo, ct, blueprint, login_manager, client
+    global mongo, db, blueprint, login_manager, client, cache, cache_manager, instrumentation, metrics, job_queue
+    
+    # Per-request Mongo, cache and render timings (see app/instrumentation.py)
+    event_listeners = []
+    if os.environ.get('INSTRUMENTATION_ENABLED', 'true').lower() == 'true':
+        instrumentation = RequestInstrumentation(
+            server_timing=os.environ.get('SERVER_TIMING_HEADER', 'true').lower() == 'true',
+            slow_request_ms=float(os.environ.get('SLOW_REQUEST_MS', 500)),
+            slow_sample_rate=float(os.environ.get('SLOW_REQUEST_SAMPLE_RATE', 0))
+        )
+        # Registered first so its after_request hook runs last and sees all the work
+        instrumentation.init_app(app)
+        event_listeners.append(instrumentation.command_listener)
+    
+    # Aggregate Prometheus metrics served at /metrics (see app/metrics.py)
+    if os.environ.get('METRICS_ENABLED', 'true').lower() == 'true':
+        if prometheus_metrics.available():
+            metrics = prometheus_metrics.PrometheusMetrics()
+            metrics.init_app(app)
+            metrics.identity_stats = get_identity_stats
+            event_listeners.extend([metrics.command_listener, metrics.pool_listener])
+        else:
+            print("⚠️  prometheus_client is not installed; /metrics is disabled")
+    
+    # MongoDB setup; collections are accessed through app.repository
+    mongo = PyMongo(app, event_listeners=event_listeners, **app.config['MONGO_CLIENT_OPTIONS'])
+    db = mongo.db
     
-    # MongoDB setup
-    mongo = PyMongo(app)
-    ct = mongo.db.choosytable
+    # Post-write work queued in MongoDB (see app/jobs.py)
+    job_queue = JobQueue(
+        db.jobs,
+        mode=app.config['JOBS_MODE'],
+        lease=app.config['JOBS_LEASE'],
+        retry_delay=app.config['JOBS_RETRY_DELAY']
+    )
     
     # Check if we're in development mode with mock auth
     use_mock_auth = os.environ.get('USE_MOCK_AUTH', '').lower() == 'true'
@@ -144,16 +233,97 @@ def init_app_components(app):
         login_manager.login_view = "google.login"
     
     # Cache client setup
-    cache_host = os.environ.get('MEMCACHED_HOST', 'localhost')
-    client = PooledClient(cache_host, serde=JsonSerde())
+    serde = make_serde(
+        os.environ.get('CACHE_SERDE', 'bson').lower(),
+        compress_threshold=int(os.environ.get('CACHE_COMPRESS_THRESHOLD', 16384))
+    )
+    client = make_memcached_client(
+        app.config['MEMCACHED_SERVERS'], serde, **app.config['MEMCACHED_CLIENT_OPTIONS']
+    )
+    if metrics:
+        metrics.memcached_client = client
+    if app.config['MEMCACHED_RETRY_ATTEMPTS'] > 1:
+        # Only a connection that dropped mid-call is worth retrying at once
+        client = RetryingClient(
+            client,
+            attempts=app.config['MEMCACHED_RETRY_ATTEMPTS'],
+            retry_for=[MemcacheUnexpectedCloseError, ConnectionResetError, BrokenPipeError]
+        )
+    if app.config['CACHE_CHUNK_SIZE'] > 0:
+        client = ChunkingClient(
+            client, serde,
+            chunk_size=app.config['CACHE_CHUNK_SIZE'],
+            warn_size=app.config['CACHE_LARGE_VALUE_WARN'],
+            observers=[metrics.large_value] if metrics else []
+        )
+    if len(app.config['MEMCACHED_SERVERS']) > 1 and app.config['MEMCACHED_HOT_KEY_REPLICAS'] > 1:
+        client = ReplicatingClient(
+            client,
+            [KEY_PREFIX + name for name in app.config['MEMCACHED_HOT_KEYS']],
+            replicas=app.config['MEMCACHED_HOT_KEY_REPLICAS']
+        )
+    if app.config['MEMCACHED_BREAKER_FAILURES'] > 0:
+        client = CircuitBreakerClient(
+            client,
+            failure_threshold=app.config['MEMCACHED_BREAKER_FAILURES'],
+            reset_timeout=app.config['MEMCACHED_BREAKER_RESET']
+        )
+        if metrics:
+            metrics.memcached_breaker = client
+    if instrumentation or metrics:
+        client = InstrumentedClient(client, observers=[metrics.cache_call] if metrics else [])
+    
+    # In-process tier in front of memcached, kept coherent by version counters
+    cache = TieredCache(
+        client,
+        LocalCache(
+            max_entries=int(os.environ.get('LOCAL_CACHE_MAX_ENTRIES', 1024)),
+            ttl=int(os.environ.get('LOCAL_CACHE_TTL', 60))
+        ),
+        stale_ttl=int(os.environ.get('CACHE_STALE_TTL', 300)),
+        lock_ttl=int(os.environ.get('CACHE_LOCK_TTL', 10)),
+        lock_wait=float(os.environ.get('CACHE_LOCK_WAIT', 0.5)),
+        early_expiry_beta=float(os.environ.get('CACHE_EARLY_EXPIRY_BETA', 1.0))
+    )
+    if metrics:
+        metrics.local_cache = cache.local
+    # Key spaces and invalidation for every cached read (see app/cache.py)
+    cache_manager = CacheManager(cache)
+    cache_manager.init_app(app)
     
     # Register blueprints
     from app.main import bp as main_blueprint
     app.register_blueprint(main_blueprint)
     
+    # Job handlers, and the cache warmer's write hook (see app/warming.py).
+    # The worker threads are started by the web entrypoints, not on import
+    load_handlers()
+    
     return app
 
 app = init_app_components(create_app())
 
+# Job worker threads of this process, once start_job_workers has run
+job_workers = []
+
+def start_job_workers():
+    """
+    Start JOBS_THREADS job worker threads in this process if JOBS_MODE=thread.
+    
+    Called by the processes that serve requests (run.py, gunicorn.conf.py);
+    scripts importing the app only queue jobs and never run them half-way.
+    """
+    if job_queue.mode != 'thread' or job_workers:
+        return job_workers
+    for index in range(app.config['JOBS_THREADS']):
+        worker = JobWorker(
+            job_queue,
+            poll_interval=app.config['JOBS_POLL_INTERVAL'],
+            observers=[metrics.job_finished] if metrics else []
+        )
+        worker.start(f"job-worker-{index}")
+        job_workers.append(worker)
+    return job_workers
+
 # Import models after everything is set up
 from . import models
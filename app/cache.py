@@ -5,167 +5,751 @@ Provides better cache key management, race condition handling, and invalidation
 
 import hashlib
 import logging
+import math
+import random
+import re
+import threading
+import time
+from collections import OrderedDict
+import inspect
 from functools import wraps
-from typing import Any, Optional, List, Dict
+from typing import Any, Callable, Iterable, Optional, List, Dict, Tuple, Union
+from flask import g, has_app_context, has_request_context
 from pymemcache.client.base import PooledClient
-from bson import json_util
+from .circuit_breaker import CircuitOpenError
 
 logger = logging.getLogger(__name__)
 
-class CacheManager:
-    """Enhanced cache manager with better key management and error handling"""
+# Namespace of every key the app writes to memcached
+KEY_PREFIX = "choosytable:"
+
+# Characters memcached accepts in a key: printable ASCII without spaces
+SAFE_KEY = re.compile(r'[!-~]+')
+
+class LocalCache:
+    """Bounded in-process LRU cache with per-entry TTL, holding deserialized objects"""
+    
+    def __init__(self, max_entries: int = 1024, ttl: int = 60):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self._entries = OrderedDict()  # key -> (value, version, expires_at)
+        self._lock = threading.Lock()
+        self._stats = {'hits': 0, 'misses': 0, 'stale': 0, 'expired': 0, 'evictions': 0}
+    
+    def get(self, key: str, version: Any = None) -> Tuple[bool, Any]:
+        """Return (found, value); entries stored under another version count as stale"""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self._stats['misses'] += 1
+                return False, None
+            value, entry_version, expires_at = entry
+            if expires_at <= time.monotonic():
+                del self._entries[key]
+                self._stats['expired'] += 1
+                return False, None
+            if entry_version != version:
+                del self._entries[key]
+                self._stats['stale'] += 1
+                return False, None
+            self._entries.move_to_end(key)
+            self._stats['hits'] += 1
+            return True, value
+    
+    def set(self, key: str, value: Any, version: Any = None, ttl: Optional[int] = None) -> None:
+        """Store a value, evicting the least recently used entries when full"""
+        ttl = self.ttl if ttl is None else min(ttl, self.ttl)
+        with self._lock:
+            self._entries[key] = (value, version, time.monotonic() + ttl)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+                self._stats['evictions'] += 1
+    
+    def delete(self, key: str) -> None:
+        with self._lock:
+            self._entries.pop(key, None)
+    
+    def stats(self) -> Dict[str, int]:
+        with self._lock:
+            return dict(self._stats, size=len(self._entries))
+
+class TieredCache:
+    """
+    Two-tier cache: an in-process LocalCache in front of memcached.
     
-    def __init__(self, client: PooledClient):
+    Coherence across worker processes comes from per-entity version counters
+    kept in memcached. Local entries remember the version they were stored
+    under and are discarded once another worker bumps it. Version lookups are
+    memoized for the duration of a request, so several reads of the same
+    entity cost a single tiny memcached get.
+    
+    Values served from the local tier are shared objects and must be treated
+    as read-only.
+    
+    ``fetch`` adds stampede protection for computed values: entries carry a
+    soft expiry inside a longer hard memcached TTL, one worker recomputes
+    under a memcached ``add`` lock while the others keep serving the stale
+    value, and hot keys are refreshed slightly early with probability growing
+    as the soft expiry approaches (XFetch).
+    """
+    
+    VERSION_PREFIX = "ver:"
+    LOCK_PREFIX = "lock:"
+    
+    # Envelope fields of values written by fetch()
+    ENVELOPE_VALUE = '_v'
+    ENVELOPE_SOFT_EXPIRY = '_soft'
+    ENVELOPE_DELTA = '_delta'
+    
+    def __init__(self, client: PooledClient, local: LocalCache, stale_ttl: int = 300,
+                 lock_ttl: int = 10, lock_wait: float = 0.5, early_expiry_beta: float = 1.0):
         self.client = client
-        self.key_prefix = "choosytable:"
+        self.local = local
+        # Seconds a value may be served stale while one worker refreshes it
+        self.stale_ttl = stale_ttl
+        # Upper bound on a single recomputation before another worker may retry
+        self.lock_ttl = lock_ttl
+        # How long a worker without the lock waits for a missing value to appear
+        self.lock_wait = lock_wait
+        # XFetch aggressiveness; 0 disables early expiration
+        self.early_expiry_beta = early_expiry_beta
+        self._lock = threading.Lock()
+        self._stats = {
+            'hits': 0, 'misses': 0, 'errors': 0,
+            'stale_served': 0, 'early_refreshes': 0, 'recomputes': 0, 'lock_waits': 0
+        }
+    
+    def _count(self, stat: str) -> None:
+        with self._lock:
+            self._stats[stat] += 1
+    
+    def _log_failure(self, message: str, error: Exception) -> None:
+        # An open circuit breaker has already reported the outage once
+        if isinstance(error, CircuitOpenError):
+            logger.debug(f"{message}: {error}")
+        else:
+            logger.warning(f"{message}: {error}")
+    
+    def _request_versions(self) -> Optional[Dict]:
+        if not has_app_context():
+            return None
+        if 'cache_versions' not in g:
+            g.cache_versions = {}
+        return g.cache_versions
+    
+    def version(self, entity: str) -> Optional[int]:
+        """Current version of an entity, creating the counter if it is missing"""
+        memo = self._request_versions()
+        if memo is not None and entity in memo:
+            return memo[entity]
         
-    def _generate_key(self, base_key: str, *args, **kwargs) -> str:
-        """Generate a consistent cache key with optional parameters"""
-        key_parts = [self.key_prefix, base_key]
+        key = self.VERSION_PREFIX + entity
+        try:
+            version = self.client.get(key)
+            if version is None:
+                # Seed from the clock so a recreated counter never matches old entries
+                self.client.add(key, str(time.time_ns()), noreply=False)
+                version = self.client.get(key)
+            version = int(version) if version is not None else None
+        except Exception as e:
+            self._log_failure(f"Cache version lookup failed for {entity}", e)
+            version = None
         
-        # Add positional arguments
-        for arg in args:
-            key_parts.append(str(arg))
-            
-        # Add keyword arguments in sorted order for consistency
-        for k, v in sorted(kwargs.items()):
-            key_parts.append(f"{k}:{v}")
-            
-        full_key = "_".join(key_parts)
+        if memo is not None:
+            memo[entity] = version
+        return version
+    
+    def bump_version(self, entity: str) -> None:
+        """Invalidate every local copy of an entity in every worker"""
+        key = self.VERSION_PREFIX + entity
+        try:
+            if self.client.incr(key, 1) is None:
+                self.client.set(key, str(time.time_ns()))
+        except Exception as e:
+            self._log_failure(f"Cache version bump failed for {entity}", e)
+        memo = self._request_versions()
+        if memo is not None:
+            memo.pop(entity, None)
+    
+    def get(self, key: str, entity: Optional[str] = None) -> Optional[Any]:
+        """Read through the local tier, then memcached"""
+        version = self.version(entity) if entity else None
+        # Without a version counter the local tier can't be kept coherent
+        use_local = entity is None or version is not None
         
-        # Hash very long keys to avoid memcached key length limits
-        if len(full_key) > 200:
-            key_hash = hashlib.md5(full_key.encode()).hexdigest()
-            full_key = f"{self.key_prefix}hashed:{key_hash}"
+        if use_local:
+            found, value = self.local.get(key, version)
+            if found:
+                return value
+        
+        try:
+            value = self.client.get(key)
+        except Exception as e:
+            self._log_failure(f"Cache get failed for key {key}", e)
+            self._count('errors')
+            return None
+        
+        if value is None:
+            self._count('misses')
+            return None
+        self._count('hits')
+        if use_local:
+            self.local.set(key, value, version)
+        return value
+    
+    def set(self, key: str, value: Any, ttl: int = 0, entity: Optional[str] = None) -> bool:
+        """Write to memcached and the local tier"""
+        version = self.version(entity) if entity else None
+        if entity is None or version is not None:
+            self.local.set(key, value, version, ttl or None)
+        try:
+            return self.client.set(key, value, ttl)
+        except Exception as e:
+            self._log_failure(f"Cache set failed for key {key}", e)
+            self._count('errors')
+            return False
+    
+    def delete(self, key: str) -> bool:
+        """Remove a key from both tiers"""
+        self.local.delete(key)
+        try:
+            return self.client.delete(key)
+        except Exception as e:
+            self._log_failure(f"Cache delete failed for key {key}", e)
+            self._count('errors')
+            return False
+    
+    def get_many(self, keys: List[str], entities: Optional[Dict[str, Optional[str]]] = None) -> Dict[str, Any]:
+        """
+        Read several keys, fetching local-tier misses from memcached in one round-trip.
+        
+        Args:
+            keys: Cache keys
+            entities: Optional version entity per key, as in ``get``
             
-        return full_key
+        Returns:
+            dict: Values of the keys that were found
+        """
+        entities = entities or {}
+        found, remote, versions = {}, [], {}
+        for key in keys:
+            entity = entities.get(key)
+            version = self.version(entity) if entity else None
+            if entity is None or version is not None:
+                versions[key] = version
+                hit, value = self.local.get(key, version)
+                if hit:
+                    found[key] = value
+                    continue
+            remote.append(key)
+        
+        if remote:
+            try:
+                values = self.client.get_many(remote)
+            except Exception as e:
+                self._log_failure(f"Cache get_many failed for {len(remote)} keys", e)
+                self._count('errors')
+                values = {}
+            for key in remote:
+                if key not in values:
+                    self._count('misses')
+                    continue
+                self._count('hits')
+                found[key] = values[key]
+                if key in versions:
+                    self.local.set(key, values[key], versions[key])
+        return found
     
-    def get(self, base_key: str, *args, **kwargs) -> Optional[Any]:
-        """Safely get a cached value"""
+    def delete_many(self, keys: List[str]) -> bool:
+        """Remove several keys from both tiers in one memcached round-trip"""
+        if not keys:
+            return True
+        for key in keys:
+            self.local.delete(key)
         try:
-            cache_key = self._generate_key(base_key, *args, **kwargs)
-            return self.client.get(cache_key)
+            return self.client.delete_many(keys)
         except Exception as e:
-            logger.warning(f"Cache get failed for key {base_key}: {e}")
-            return None
+            self._log_failure(f"Cache delete_many failed for {len(keys)} keys", e)
+            self._count('errors')
+            return False
     
-    def set(self, base_key: str, value: Any, ttl: int = 3600, *args, **kwargs) -> bool:
-        """Safely set a cached value with TTL"""
+    def _acquire(self, key: str) -> bool:
         try:
-            cache_key = self._generate_key(base_key, *args, **kwargs)
-            return self.client.set(cache_key, value, expire=ttl)
+            return bool(self.client.add(self.LOCK_PREFIX + key, "1", self.lock_ttl, noreply=False))
         except Exception as e:
-            logger.warning(f"Cache set failed for key {base_key}: {e}")
+            self._log_failure(f"Cache lock failed for key {key}", e)
+            self._count('errors')
+            # Without memcached there is nothing to protect; compute locally
+            return True
+    
+    def _release(self, key: str) -> None:
+        try:
+            self.client.delete(self.LOCK_PREFIX + key)
+        except Exception as e:
+            self._log_failure(f"Cache unlock failed for key {key}", e)
+    
+    def is_envelope(self, cached: Any) -> bool:
+        return isinstance(cached, dict) and self.ENVELOPE_SOFT_EXPIRY in cached
+    
+    def _should_refresh(self, envelope: Dict) -> bool:
+        now = time.time()
+        soft_expiry = envelope[self.ENVELOPE_SOFT_EXPIRY]
+        if now >= soft_expiry:
+            return True
+        if self.early_expiry_beta <= 0:
             return False
+        # XFetch: -log(U) is exponentially distributed, so refreshes start
+        # roughly one recompute time before expiry and rarely much earlier
+        jitter = -envelope.get(self.ENVELOPE_DELTA, 0) * self.early_expiry_beta * math.log(1.0 - random.random())
+        if now + jitter >= soft_expiry:
+            self._count('early_refreshes')
+            return True
+        return False
     
-    def delete(self, base_key: str, *args, **kwargs) -> bool:
-        """Safely delete a cached value"""
+    def prime(self, key: str, value: Any, ttl: int, entity: Optional[str] = None,
+              stale_ttl: Optional[int] = None, delta: float = 0.0) -> bool:
+        """Store a freshly computed value in the format read by ``fetch``"""
+        stale_ttl = self.stale_ttl if stale_ttl is None else stale_ttl
+        envelope = {
+            self.ENVELOPE_VALUE: value,
+            self.ENVELOPE_SOFT_EXPIRY: time.time() + ttl,
+            self.ENVELOPE_DELTA: delta
+        }
+        version = self.version(entity) if entity else None
+        if entity is None or version is not None:
+            self.local.set(key, envelope, version, ttl)
         try:
-            cache_key = self._generate_key(base_key, *args, **kwargs)
-            return self.client.delete(cache_key)
+            return self.client.set(key, envelope, ttl + stale_ttl)
         except Exception as e:
-            logger.warning(f"Cache delete failed for key {base_key}: {e}")
+            self._log_failure(f"Cache set failed for key {key}", e)
+            self._count('errors')
+            return False
+    
+    def _recompute(self, key: str, loader: Callable[[], Any], ttl: int, stale_ttl: int,
+                   entity: Optional[str]) -> Any:
+        self._count('recomputes')
+        started = time.time()
+        value = loader()
+        if value is not None:
+            self.prime(key, value, ttl, entity, stale_ttl, delta=time.time() - started)
+        return value
+    
+    def fetch(self, key: str, loader: Callable[[], Any], ttl: int, entity: Optional[str] = None,
+              stale_ttl: Optional[int] = None) -> Any:
+        """
+        Read-through cache with single-flight recomputation.
+        
+        Args:
+            key: Cache key
+            loader: Computes the value on a miss; None results are not cached
+            ttl: Seconds the value is fresh
+            entity: Version entity for the local tier, as in ``get``
+            stale_ttl: Seconds past ``ttl`` the value may be served while refreshing
+            
+        Returns:
+            The cached or freshly computed value
+        """
+        stale_ttl = self.stale_ttl if stale_ttl is None else stale_ttl
+        cached = self.get(key, entity=entity)
+        
+        if self.is_envelope(cached):
+            if not self._should_refresh(cached):
+                return cached[self.ENVELOPE_VALUE]
+            if not self._acquire(key):
+                # Someone else is refreshing; the stale value is good enough
+                self._count('stale_served')
+                return cached[self.ENVELOPE_VALUE]
+            try:
+                return self._recompute(key, loader, ttl, stale_ttl, entity)
+            finally:
+                self._release(key)
+        
+        # Hard miss: only the lock holder queries the database
+        if not self._acquire(key):
+            self._count('lock_waits')
+            deadline = time.monotonic() + self.lock_wait
+            while time.monotonic() < deadline:
+                time.sleep(0.05)
+                cached = self.get(key, entity=entity)
+                if self.is_envelope(cached):
+                    return cached[self.ENVELOPE_VALUE]
+            # The holder is slow or died; fall back to computing ourselves
+            return self._recompute(key, loader, ttl, stale_ttl, entity)
+        try:
+            return self._recompute(key, loader, ttl, stale_ttl, entity)
+        finally:
+            self._release(key)
+    
+    def stats(self) -> Dict[str, Dict[str, int]]:
+        """Hit/miss/eviction counters per tier"""
+        with self._lock:
+            memcached_stats = dict(self._stats)
+        return {'local': self.local.stats(), 'memcached': memcached_stats}
+
+class KeySpace:
+    """Cache settings for one family of keys, e.g. ``company`` or ``user_reviews_page``"""
+    
+    def __init__(self, name: str, ttl: int, key_args: Tuple[str, ...] = (), entity: Optional[str] = None,
+                 versioned: bool = False, invalidated_by: Tuple[str, ...] = ()):
+        self.name = name
+        self.ttl = ttl
+        # Arguments of the cached function that identify an entry
+        self.key_args = tuple(key_args)
+        # Version counter template, formatted with the key arguments
+        self.entity = entity
+        # Versioned key spaces embed the entity version in every key, so one
+        # bump retires all entries without enumerating them (e.g. list pages)
+        self.versioned = versioned
+        # Invalidation events that clear this key space
+        self.invalidated_by = tuple(invalidated_by)
+    
+    def entity_for(self, params: Dict) -> Optional[str]:
+        """Version counter for the given arguments, or None if some are unknown"""
+        if not self.entity:
+            return None
+        try:
+            return self.entity.format(**{key: value for key, value in params.items() if value is not None})
+        except KeyError:
+            return None
+
+class CacheManager:
+    """
+    Single entry point for cached reads and invalidation.
+    
+    Every cached read is declared as a KeySpace (see ``cached_query``), which
+    gives it a namespaced key, its own TTL and the invalidation events that
+    clear it. ``invalidate`` consults those declarations, so one map covers
+    every cached key.
+    """
+    
+    def __init__(self, cache: TieredCache, key_prefix: str = KEY_PREFIX):
+        self.cache = cache
+        self.key_prefix = key_prefix
+        self.keyspaces: Dict[str, KeySpace] = {}
+        self.listeners: List[Callable[[List[str]], None]] = []
+    
+    def register(self, keyspace: KeySpace) -> KeySpace:
+        self.keyspaces[keyspace.name] = keyspace
+        return keyspace
+    
+    def _generate_key(self, base_key: str, *args) -> str:
+        """Generate a consistent cache key with optional parameters"""
+        full_key = self.key_prefix + ":".join([base_key] + [str(arg) for arg in args])
+        
+        # Hash very long keys to avoid memcached key length limits, and keys
+        # with characters memcached rejects (e.g. a search query's spaces)
+        if len(full_key) > 200 or not SAFE_KEY.fullmatch(full_key):
+            key_hash = hashlib.md5(full_key.encode()).hexdigest()
+            full_key = f"{self.key_prefix}hashed:{key_hash}"
+            
+        return full_key
+    
+    def key(self, name: str, **params) -> Optional[str]:
+        """
+        Cache key of one entry of a key space.
+
+        None when the key space is versioned and the version can't be read:
+        an entry stored under a made-up version would never be retired, so
+        callers skip the cache instead.
+        """
+        keyspace = self.keyspaces[name]
+        parts = [params[arg] for arg in keyspace.key_args]
+        if keyspace.versioned:
+            version = self.cache.version(keyspace.entity_for(params))
+            if version is None:
+                return None
+            parts.insert(0, version)
+        return self._generate_key(name, *parts)
+    
+    def _local_entity(self, keyspace: KeySpace, params: Dict) -> Optional[str]:
+        # Versioned keys change with the version, so the local tier needs no check
+        return None if keyspace.versioned else keyspace.entity_for(params)
+    
+    def fetch(self, name: str, loader: Callable[[], Any], **params) -> Any:
+        """Read one entry through the cache, computing it with ``loader`` on a miss"""
+        keyspace = self.keyspaces[name]
+        key = self.key(name, **params)
+        if key is None:
+            return loader()
+        return self.cache.fetch(key, loader, keyspace.ttl, entity=self._local_entity(keyspace, params))
+    
+    def set(self, name: str, value: Any, **params) -> bool:
+        """Store a freshly computed entry"""
+        keyspace = self.keyspaces[name]
+        key = self.key(name, **params)
+        if key is None:
             return False
+        return self.cache.prime(key, value, keyspace.ttl, entity=self._local_entity(keyspace, params))
+    
+    def get_many(self, requests: List[Tuple[str, Dict]]) -> List[Optional[Any]]:
+        """
+        Read several entries in one memcached round-trip.
+        
+        Args:
+            requests: ``(key space, params)`` pairs
+            
+        Returns:
+            list: Cached values in request order, None for misses and for
+            entries whose version can't be read
+        """
+        keys = [self.key(name, **params) for name, params in requests]
+        entities = {
+            key: self._local_entity(self.keyspaces[name], params)
+            for key, (name, params) in zip(keys, requests) if key is not None
+        }
+        found = self.cache.get_many(list(entities), entities)
+        now = time.time()
+        values = []
+        for key in keys:
+            cached = found.get(key)
+            # Expired entries are left for fetch() to refresh under its lock
+            fresh = self.cache.is_envelope(cached) and cached[TieredCache.ENVELOPE_SOFT_EXPIRY] > now
+            values.append(cached[TieredCache.ENVELOPE_VALUE] if fresh else None)
+        return values
+    
+    def delete_many(self, keys: Iterable[str]) -> bool:
+        """Delete several keys in one memcached round-trip"""
+        return self.cache.delete_many(list(keys))
+    
+    def invalidation_plan(self, event: str, **ids) -> Tuple[List[str], List[str]]:
+        """
+        Keys to delete and version counters to bump for an invalidation event.
+        
+        Key spaces whose key arguments are not all known are only retired
+        through their version counter.
+        """
+        keys, entities = [], []
+        for keyspace in self.keyspaces.values():
+            if event not in keyspace.invalidated_by:
+                continue
+            known = {arg: ids.get(arg) for arg in keyspace.key_args}
+            if keyspace.versioned:
+                entity = keyspace.entity_for(ids)
+                if entity:
+                    entities.append(entity)
+                continue
+            if not all(known.values()):
+                continue
+            keys.append(self.key(keyspace.name, **known))
+            if keyspace.entity:
+                entities.append(keyspace.entity_for(known))
+        return keys, list(dict.fromkeys(entities))
+    
+    def invalidate(self, event: str, deferred: bool = False, **ids) -> None:
+        """
+        Clear every entry affected by an event.
+        
+        Inside a request the keys are collected and flushed once, with a
+        single delete_many, when the response is ready. Deferred
+        invalidations wait until the response has been sent; use them only
+        for entries the redirect target doesn't read.
+        
+        Args:
+            event: Event name used in ``invalidated_by``: 'user', 'company',
+                'company_stats' when only a company's statistics changed, or
+                'company_names' when a company was added or renamed
+            deferred: Flush after the response has been sent
+            ids: Identifiers of the changed data, e.g. ``user_id=...``
+        """
+        keys, entities = self.invalidation_plan(event, **ids)
+        if not has_request_context():
+            self._flush(keys, entities)
+            return
+        
+        pending = self._pending()['deferred' if deferred else 'now']
+        pending['keys'].update(keys)
+        pending['entities'].update(entities)
+    
+    def invalidate_many(self, invalidations: Iterable[Tuple[str, Dict]]) -> Tuple[int, int]:
+        """
+        Clear the entries of several events at once, outside any request.
+
+        The keys of all events are deleted with a single delete_many and
+        each version counter is bumped once.
+
+        Args:
+            invalidations: ``(event, ids)`` pairs as passed to ``invalidate``
+
+        Returns:
+            tuple: Number of keys deleted and version counters bumped
+        """
+        keys, entities = {}, {}
+        for event, ids in invalidations:
+            event_keys, event_entities = self.invalidation_plan(event, **ids)
+            keys.update(dict.fromkeys(event_keys))
+            entities.update(dict.fromkeys(event_entities))
+        self._flush(keys, entities)
+        return len(keys), len(entities)
+
+    def _pending(self) -> Dict[str, Dict[str, set]]:
+        if 'cache_invalidations' not in g:
+            g.cache_invalidations = {
+                'now': {'keys': set(), 'entities': set()},
+                'deferred': {'keys': set(), 'entities': set()}
+            }
+        return g.cache_invalidations
+    
+    def subscribe(self, listener: Callable[[List[str]], None]) -> None:
+        """
+        Call ``listener(entities)`` after every flush with the version
+        counters it bumped, e.g. ``company:<id>`` (see app/warming.py).
+        """
+        self.listeners.append(listener)
+    
+    def _flush(self, keys: Iterable[str], entities: Iterable[str]) -> None:
+        self.delete_many(keys)
+        entities = list(entities)
+        for entity in entities:
+            self.cache.bump_version(entity)
+        if not entities:
+            return
+        for listener in self.listeners:
+            try:
+                listener(entities)
+            except Exception as e:
+                logger.warning(f"Cache invalidation listener failed: {e}")
+    
+    def _flush_after_request(self, response):
+        pending = g.pop('cache_invalidations', None)
+        if pending is None:
+            return response
+        
+        now, deferred = pending['now'], pending['deferred']
+        self._flush(now['keys'], now['entities'])
+        
+        keys = deferred['keys'] - now['keys']
+        entities = deferred['entities'] - now['entities']
+        if keys or entities:
+            response.call_on_close(lambda: self._flush(keys, entities))
+        return response
+    
+    def _flush_on_teardown(self, exc=None) -> None:
+        # after_request is skipped when a view raises; never drop invalidations
+        pending = g.pop('cache_invalidations', None)
+        if pending is not None:
+            for bucket in pending.values():
+                self._flush(bucket['keys'], bucket['entities'])
+    
+    def init_app(self, app) -> None:
+        """Flush the invalidations collected during each request"""
+        app.after_request(self._flush_after_request)
+        app.teardown_request(self._flush_on_teardown)
+    
+    def stats(self) -> Dict[str, Dict[str, int]]:
+        return self.cache.stats()
+
+ManagerRef = Union[CacheManager, Callable[[], CacheManager]]
+
+def _resolve(manager: ManagerRef) -> CacheManager:
+    return manager if isinstance(manager, CacheManager) else manager()
+
+def cached_query(manager: ManagerRef, name: str, ttl: int, key_args: Tuple[str, ...] = (),
+                 entity: Optional[str] = None, versioned: bool = False,
+                 invalidated_by: Tuple[str, ...] = ()):
+    """
+    Decorator for caching query results under a declared key space.
+    
+    Args:
+        manager: CacheManager, or a callable returning one so it can be
+            swapped at runtime (e.g. in tests)
+        name: Key space name, the namespace of its keys
+        ttl: Seconds an entry stays fresh
+        key_args: Names of the function arguments that identify an entry
+        entity: Version counter template formatted with the key arguments
+        versioned: Embed the entity version in the key (see KeySpace)
+        invalidated_by: Invalidation events that clear these entries
+        
+    The undecorated function stays available as ``wrapper.uncached``.
+    """
+    keyspace = KeySpace(name, ttl, key_args, entity, versioned, invalidated_by)
+    if isinstance(manager, CacheManager):
+        manager.register(keyspace)
     
-    def delete_multiple(self, keys: List[Dict]) -> bool:
-        """Delete multiple cache keys safely"""
-        success = True
-        for key_info in keys:
-            base_key = key_info.get('base_key')
-            args = key_info.get('args', [])
-            kwargs = key_info.get('kwargs', {})
-            if not self.delete(base_key, *args, **kwargs):
-                success = False
-        return success
-    
-    def invalidate_user_cache(self, user_id: str) -> None:
-        """Invalidate all cache keys related to a specific user"""
-        cache_keys = [
-            {'base_key': 'user_reviews', 'args': [user_id]},
-            {'base_key': 'user_by_email', 'args': [user_id]},
-        ]
-        self.delete_multiple(cache_keys)
-    
-    def invalidate_company_cache(self, company_id: str) -> None:
-        """Invalidate all cache keys related to a specific company"""
-        cache_keys = [
-            {'base_key': 'company_data', 'args': [company_id]},
-            {'base_key': 'company_interviews', 'args': [company_id]},
-            {'base_key': 'all_reviews'},  # This affects the global reviews list
-        ]
-        self.delete_multiple(cache_keys)
-
-def cached_query(cache_manager: CacheManager, base_key: str, ttl: int = 3600):
-    """Decorator for caching query results with automatic key generation"""
     def decorator(func):
+        signature = inspect.signature(func)
+        
         @wraps(func)
         def wrapper(*args, **kwargs):
-            # Try to get from cache first
-            cached_result = cache_manager.get(base_key, *args, **kwargs)
-            if cached_result is not None:
-                return cached_result
-            
-            # Execute function and cache result
-            result = func(*args, **kwargs)
-            if result is not None:
-                cache_manager.set(base_key, result, ttl, *args, **kwargs)
-            
-            return result
+            cache_manager = _resolve(manager)
+            if name not in cache_manager.keyspaces:
+                cache_manager.register(keyspace)
+            bound = signature.bind(*args, **kwargs)
+            bound.apply_defaults()
+            params = {arg: bound.arguments[arg] for arg in key_args}
+            return cache_manager.fetch(name, lambda: func(*args, **kwargs), **params)
+        
+        wrapper.uncached = func
+        wrapper.keyspace = keyspace
         return wrapper
     return decorator
 
 class DatabaseCache:
-    """Database-specific caching utilities"""
+    """
+    Cached read-through access to the repository.
     
-    def __init__(self, cache_manager: CacheManager, collection):
-        self.cache = cache_manager
-        self.collection = collection
+    Each method is the matching repository query wrapped by ``cached_query``;
+    all of them are invalidated through ``CacheManager.invalidate``.
+    """
     
-    @cached_query(cache_manager=None, base_key="user_by_email", ttl=1800)  # 30 minutes
-    def find_user_by_email(self, email: str):
-        """Cached user lookup by email"""
-        self.cache = cache_manager  # Will be set when called
-        return self.collection.find_one({'email': email})
+    LISTING_ENTITY = "companies_listing"
+    NAMES_ENTITY = "company_names"
     
-    @cached_query(cache_manager=None, base_key="user_reviews", ttl=900)  # 15 minutes
-    def find_user_reviews(self, user_id: str):
-        """Cached user reviews lookup"""
+    def __init__(self, cache_manager: ManagerRef, repository, ttl: Dict[str, int]):
         self.cache = cache_manager
-        return list(
-            self.collection.find(
-                {'reviews.user': user_id},
-                {'reviews': 1, '_id': 1, 'company': 1}
-            ).sort('last_modified', -1)
-        )
-    
-    @cached_query(cache_manager=None, base_key="all_reviews", ttl=600)  # 10 minutes
-    def find_all_reviews(self):
-        """Cached lookup of all companies with reviews"""
-        self.cache = cache_manager
-        return list(
-            self.collection.find(
-                {'reviews': {"$exists": True}},
-                {'company': 1, 'reviews': 1, 'last_modified': 1}  # Only fetch needed fields
-            ).sort('last_modified', -1)
-        )
-    
-    @cached_query(cache_manager=None, base_key="company_data", ttl=1800)  # 30 minutes  
-    def find_company_by_id(self, company_id: str):
-        """Cached company lookup by ID"""
-        self.cache = cache_manager
-        from bson import ObjectId
-        return self.collection.find_one({'_id': ObjectId(company_id)})
-
-# Cache invalidation helpers
-def invalidate_on_user_update(cache_manager: CacheManager, user_id: str):
-    """Invalidate caches when user data changes"""
-    cache_manager.invalidate_user_cache(user_id)
-
-def invalidate_on_review_update(cache_manager: CacheManager, user_id: str, company_id: str):
-    """Invalidate caches when reviews are added/updated"""
-    cache_manager.invalidate_user_cache(user_id)
-    cache_manager.invalidate_company_cache(company_id)
-
-def invalidate_on_company_update(cache_manager: CacheManager, company_id: str):
-    """Invalidate caches when company data changes"""
-    cache_manager.invalidate_company_cache(company_id)
\ No newline at end of file
+        self.repository = repository
+        
+        self.find_user_by_email = cached_query(
+            cache_manager, "user_by_email", ttl['medium'], ('email',),
+            entity="user:{email}", invalidated_by=('user',)
+        )(repository.find_user_by_email)
+        
+        self.find_user_reviews_page = cached_query(
+            cache_manager, "user_reviews_page", ttl['medium'], ('user_id', 'offset', 'limit'),
+            entity="user:{user_id}", versioned=True, invalidated_by=('user',)
+        )(repository.find_user_reviews_page)
+        
+        self.count_user_reviews = cached_query(
+            cache_manager, "user_review_count", ttl['medium'], ('user_id',),
+            entity="user:{user_id}", invalidated_by=('user',)
+        )(repository.count_user_reviews)
+        
+        self.find_company = cached_query(
+            cache_manager, "company", ttl['medium'], ('company_id',),
+            entity="company:{company_id}", invalidated_by=('company', 'company_stats')
+        )(repository.find_company)
+        
+        self.find_company_reviews_page = cached_query(
+            cache_manager, "company_reviews_page", ttl['medium'], ('company_id', 'offset', 'limit'),
+            entity="company:{company_id}", versioned=True, invalidated_by=('company',)
+        )(repository.find_company_reviews_page)
+        
+        self.count_reviewed_companies = cached_query(
+            cache_manager, "companies_count", ttl['short'],
+            entity=self.LISTING_ENTITY, versioned=True, invalidated_by=('company',)
+        )(repository.count_reviewed_companies)
+        
+        self.find_companies_page = cached_query(
+            cache_manager, "companies_page", ttl['short'], ('offset', 'limit'),
+            entity=self.LISTING_ENTITY, versioned=True, invalidated_by=('company',)
+        )(repository.find_companies_page)
+        
+        # Search and autocomplete hold only ids and names; review counts are
+        # added from the company entries when they're read
+        self.search_companies = cached_query(
+            cache_manager, "company_search", ttl['short'], ('query', 'limit'),
+            entity=self.NAMES_ENTITY, versioned=True, invalidated_by=('company_names',)
+        )(repository.search_companies)
+        
+        # One entry per prefix
+        self.find_companies_by_prefix = cached_query(
+            cache_manager, "company_prefix", ttl['long'], ('prefix', 'limit'),
+            entity=self.NAMES_ENTITY, versioned=True, invalidated_by=('company_names',)
+        )(repository.find_companies_by_prefix)
+    
+    def cached_statistic(self, name: str, ttl: int, func: Callable) -> Callable:
+        """Cache a per-company statistic ``func(company_id, ...)`` under the company's entity"""
+        return cached_query(
+            self.cache, name, ttl, ('company_id',),
+            entity="company:{company_id}", invalidated_by=('company', 'company_stats')
+        )(func)
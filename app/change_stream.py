@@ -0,0 +1,237 @@
+"""
+Change-stream cache invalidation for ChoosyTable
+Tails a MongoDB change stream over the users, companies, reviews and
+interviews collections and turns every change into the invalidation events
+the routes raise (see CacheManager.invalidate), so writes made outside the
+web app - scripts, migrations, the mongo shell - reach the cache too.
+
+Changes are applied in batches: the counters of every company a batch
+touched are recomputed from its reviews and interviews, the batch's cache
+keys are cleared with one delete_many, and only then is the stream's resume
+token stored in MongoDB. A restarted worker continues after the last applied
+batch, so every change is applied at least once.
+
+Change streams need a replica set; a single node is enough:
+
+    mongod --replSet rs0 --dbpath /tmp/rs0 --port 27017
+    mongosh --eval 'rs.initiate()'
+
+A delete only carries the deleted document's _id. For the user and company
+of a deleted review or interview the worker needs pre-images (MongoDB 6.0+,
+see ``InvalidationWorker.enable_pre_images``); without them the company side
+is still covered when the writer also updates the company's counters, as the
+app does.
+"""
+
+import logging
+import time
+from datetime import datetime
+from typing import Dict, Iterable, List, Optional, Tuple
+
+from pymongo.errors import OperationFailure
+
+from app import cache_manager, db
+from app import repository
+
+logger = logging.getLogger(__name__)
+
+WATCHED_COLLECTIONS = ('users', 'companies', 'reviews', 'interviews')
+
+# Updates touching only these fields change nothing that is cached
+IGNORED_FIELDS = {
+    'users': {'last_login'},
+    # Demographics copied by the profile fan-out; no cached review page shows them
+    'reviews': {'gender', 'ethnicity', 'location'},
+}
+
+# Where each worker keeps its resume token, by worker name
+STATE_COLLECTION = 'change_stream_state'
+
+# The stored token has fallen off the oplog (ChangeStreamFatalError, ChangeStreamHistoryLost)
+HISTORY_LOST_CODES = (280, 286)
+
+# Seconds between token saves while no changes arrive, so the stored token
+# keeps up with the oplog on a quiet database
+IDLE_SAVE_INTERVAL = 60
+
+Invalidation = Tuple[str, Dict]
+
+
+def _changed_fields(change: Dict) -> Optional[set]:
+    """Top-level fields an update touched, or None for other operations"""
+    description = change.get('updateDescription')
+    if description is None:
+        return None
+    fields = list(description.get('updatedFields', {})) + list(description.get('removedFields', []))
+    return {field.split('.', 1)[0] for field in fields}
+
+
+def invalidations_for(change: Dict) -> Tuple[List[Invalidation], List[str]]:
+    """
+    The invalidation events a change calls for, and the companies whose
+    counters it may have moved.
+
+    Returns:
+        tuple: ``(event, ids)`` pairs for CacheManager.invalidate_many and a
+        list of company ids; both empty if the change can't affect the cache
+    """
+    collection = change['ns']['coll']
+    fields = _changed_fields(change)
+    if fields is not None and fields <= IGNORED_FIELDS.get(collection, set()):
+        return [], []
+
+    document = change.get('fullDocument') or change.get('fullDocumentBeforeChange') or {}
+    document_id = change['documentKey']['_id']
+
+    if collection == 'users':
+        return [('user', {'user_id': str(document_id), 'email': document.get('email')})], []
+
+    if collection == 'companies':
+        company_id = str(document_id)
+        # Counter moves of the profile fan-out only change statistics
+        event = 'company_stats' if fields == {'interview_counts'} else 'company'
+        invalidations = [(event, {'company_id': company_id})]
+        if fields is None or 'company' in fields:
+            invalidations.append(('company_names', {}))
+        return invalidations, [company_id]
+
+    company_id = str(document['company_id']) if document.get('company_id') else None
+    if collection == 'reviews':
+        invalidations = []
+        if document.get('user'):
+            invalidations.append(('user', {'user_id': document['user']}))
+        if company_id:
+            invalidations.append(('company', {'company_id': company_id}))
+        return invalidations, [company_id] if company_id else []
+
+    if collection == 'interviews' and company_id:
+        return [('company_stats', {'company_id': company_id})], [company_id]
+    return [], []
+
+
+class InvalidationWorker:
+    """
+    Applies the changes of the watched collections to the cache in batches.
+
+    Args:
+        name: Key of the stored resume token; workers sharing a name share
+            their position in the stream
+        batch_size: Most changes applied at once
+        batch_wait: Seconds a batch collects changes before it is applied
+        recount: Recompute the counters of the companies a batch touched
+        pre_images: Ask for deleted documents (needs enable_pre_images)
+    """
+
+    def __init__(self, name: str = 'cache_invalidation', batch_size: int = 500, batch_wait: float = 1.0,
+                 recount: bool = True, pre_images: bool = False):
+        self.name = name
+        self.batch_size = batch_size
+        self.batch_wait = batch_wait
+        self.recount = recount
+        self.pre_images = pre_images
+        self.state = db[STATE_COLLECTION]
+        self.stats = {'changes': 0, 'batches': 0, 'keys': 0, 'versions': 0, 'recounted': 0, 'unresolved': 0}
+
+    def resume_token(self) -> Optional[Dict]:
+        state = self.state.find_one({'_id': self.name})
+        return state.get('token') if state else None
+
+    def save_token(self, token: Optional[Dict]) -> None:
+        if token is not None:
+            self.state.update_one(
+                {'_id': self.name}, {'$set': {'token': token, 'updated': datetime.now()}}, upsert=True
+            )
+
+    def reset(self) -> None:
+        """Forget the stored position; the next run starts with new changes"""
+        self.state.delete_one({'_id': self.name})
+
+    @staticmethod
+    def enable_pre_images() -> None:
+        """Record pre-images of the watched collections (MongoDB 6.0+)"""
+        for collection in WATCHED_COLLECTIONS:
+            db.command('collMod', collection, changeStreamPreAndPostImages={'enabled': True})
+
+    def open_stream(self):
+        pipeline = [{'$match': {'ns.coll': {'$in': list(WATCHED_COLLECTIONS)}}}]
+        options = {
+            'full_document': 'updateLookup',
+            'max_await_time_ms': max(int(self.batch_wait * 1000), 100)
+        }
+        if self.pre_images:
+            options['full_document_before_change'] = 'whenAvailable'
+
+        token = self.resume_token()
+        try:
+            return db.watch(pipeline, start_after=token, **options)
+        except OperationFailure as e:
+            if token is None or e.code not in HISTORY_LOST_CODES:
+                raise
+            logger.error(
+                f"Change stream '{self.name}' can't resume, its token is no longer in the oplog; "
+                f"changes since the last run are lost and cached entries expire on their TTL: {e}"
+            )
+            return db.watch(pipeline, **options)
+
+    def apply(self, changes: Iterable[Dict]) -> Dict[str, int]:
+        """Recount the touched companies, then clear the cache entries of a batch"""
+        invalidations, company_ids, count = [], set(), 0
+        for change in changes:
+            count += 1
+            events, companies = invalidations_for(change)
+            if not events and change['operationType'] == 'delete':
+                self.stats['unresolved'] += 1
+                logger.debug(f"Delete in {change['ns']['coll']} without a pre-image: {change['documentKey']}")
+            invalidations.extend(events)
+            company_ids.update(companies)
+
+        recounted = repository.recount_company_counters(company_ids) if self.recount else []
+        keys, versions = cache_manager.invalidate_many(invalidations)
+
+        result = {'changes': count, 'keys': keys, 'versions': versions, 'recounted': len(recounted)}
+        for stat, value in result.items():
+            self.stats[stat] += value
+        self.stats['batches'] += 1
+        if recounted:
+            logger.warning(f"Corrected the counters of {len(recounted)} companies: {', '.join(recounted)}")
+        logger.info(
+            f"Applied {count} changes: {keys} keys deleted, {versions} versions bumped, "
+            f"{len(recounted)} companies recounted"
+        )
+        return result
+
+    def run(self, stop_when_idle: bool = False) -> Dict[str, int]:
+        """
+        Tail the change stream, applying a batch every ``batch_size`` changes
+        or ``batch_wait`` seconds.
+
+        Args:
+            stop_when_idle: Return once a wait for changes comes back empty
+                and everything received has been applied
+
+        Returns:
+            dict: Totals of this worker
+        """
+        with self.open_stream() as stream:
+            pending, batch_started, saved = [], None, time.monotonic()
+            while stream.alive:
+                change = stream.try_next()
+                if change is not None:
+                    pending.append(change)
+                    batch_started = batch_started or time.monotonic()
+                    if len(pending) < self.batch_size and time.monotonic() - batch_started < self.batch_wait:
+                        continue
+
+                if pending:
+                    self.apply(pending)
+                    # Everything before this token has been applied
+                    self.save_token(stream.resume_token)
+                    pending, batch_started, saved = [], None, time.monotonic()
+                elif change is None:
+                    if stop_when_idle:
+                        self.save_token(stream.resume_token)
+                        break
+                    if time.monotonic() - saved >= IDLE_SAVE_INTERVAL:
+                        self.save_token(stream.resume_token)
+                        saved = time.monotonic()
+        return dict(self.stats)
@@ -0,0 +1,112 @@
+"""
+Circuit breaker for the memcached client
+After a run of consecutive connection failures the breaker opens and every
+cache call fails immediately with CircuitOpenError, which the cache layer
+treats like any other cache error: reads fall through to MongoDB. Once
+``reset_timeout`` has passed a single trial call is let through; if it
+succeeds the breaker closes again, otherwise it stays open for another period.
+"""
+
+import logging
+import threading
+import time
+from typing import Optional
+
+from pymemcache.exceptions import MemcacheError, MemcacheServerError
+
+logger = logging.getLogger(__name__)
+
+
+class CircuitOpenError(Exception):
+    """Raised instead of calling memcached while the breaker is open"""
+
+
+class CircuitBreakerClient:
+    """
+    Wraps a pymemcache client with a circuit breaker.
+
+    Args:
+        client: The client to protect
+        failure_threshold: Consecutive failures that open the breaker
+        reset_timeout: Seconds the breaker stays open before a trial call
+    """
+
+    # Errors that mean memcached is unreachable or misbehaving; anything else
+    # (e.g. an illegal key) is the caller's fault and doesn't count
+    TRIP_ON = (OSError, MemcacheServerError)
+    
+    # Calls that wait for memcached's answer. Writes sent with noreply (the
+    # pooled client's default) succeed without one, so they prove nothing
+    REPLY_METHODS = frozenset(('get', 'gets', 'get_many', 'get_multi', 'incr', 'decr', 'stats', 'version'))
+
+    def __init__(self, client, failure_threshold: int = 5, reset_timeout: float = 30.0):
+        self.client = client
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self._lock = threading.Lock()
+        self._failures = 0
+        self._opened_at: Optional[float] = None
+        self._trial_in_flight = False
+
+    @property
+    def state(self) -> str:
+        with self._lock:
+            if self._opened_at is None:
+                return 'closed'
+            if time.monotonic() - self._opened_at >= self.reset_timeout:
+                return 'half-open'
+            return 'open'
+
+    def __getattr__(self, name):
+        attribute = getattr(self.client, name)
+        if name.startswith('_') or name == 'close' or not callable(attribute):
+            return attribute
+        return lambda *args, **kwargs: self._call(name, attribute, *args, **kwargs)
+
+    def _call(self, name, method, *args, **kwargs):
+        with self._lock:
+            if self._opened_at is not None:
+                waited = time.monotonic() - self._opened_at
+                if waited < self.reset_timeout or self._trial_in_flight:
+                    raise CircuitOpenError(f"memcached circuit open ({waited:.0f}s)")
+                self._trial_in_flight = True
+
+        try:
+            result = method(*args, **kwargs)
+        except Exception as e:
+            if self.is_outage(e):
+                self._failed(e)
+            else:
+                # memcached answered, so the connection is fine
+                self._succeeded(confirmed=True)
+            raise
+        self._succeeded(confirmed=name in self.REPLY_METHODS or kwargs.get('noreply') is False)
+        return result
+
+    def is_outage(self, error: Exception) -> bool:
+        # HashClient raises a bare MemcacheError once every node is marked dead
+        return isinstance(error, self.TRIP_ON) or type(error) is MemcacheError
+
+    def _failed(self, error: Exception) -> None:
+        with self._lock:
+            self._failures += 1
+            trial_failed = self._trial_in_flight
+            self._trial_in_flight = False
+            if trial_failed or self._failures >= self.failure_threshold:
+                if self._opened_at is None:
+                    logger.error(
+                        f"memcached circuit opened after {self._failures} consecutive failures: {error}"
+                    )
+                self._opened_at = time.monotonic()
+
+    def _succeeded(self, confirmed: bool) -> None:
+        with self._lock:
+            if not confirmed:
+                # Let the next call be the trial instead
+                self._trial_in_flight = False
+                return
+            if self._opened_at is not None:
+                logger.warning("memcached circuit closed, cache is reachable again")
+            self._failures = 0
+            self._opened_at = None
+            self._trial_in_flight = False
@@ -58,14 +58,6 @@ HIGHLIGHTED_ETHNICITIES = [
     'Black', 'Afro-Latino', 'Bahamian', 'Jamaican', 'African'
 ]
 
-# Cache key prefixes for better organization
-CACHE_KEYS = {
-    'USER_REVIEWS': '_reviews',
-    'COMPANY_INTERVIEWS': '_pd_interviews', 
-    'ALL_REVIEWS': 'find_reviews',
-    'USER_BY_EMAIL': 'user_email_'
-}
-
 # Default values
 DEFAULTS = {
     'AGE': '18-24',
@@ -0,0 +1,39 @@
+"""
+Account erasure for ChoosyTable
+"Forget me" deletes the profile right away and queues the rest: removing
+the user's reviews and interviews and recomputing the counters of every
+company they wrote about can touch thousands of documents.
+"""
+
+import logging
+from typing import Dict
+
+from app import cache_manager, job_queue
+from app import repository
+from app.jobs import job_handler
+
+logger = logging.getLogger(__name__)
+
+
+@job_handler('erase_account')
+def erase_account_job(job) -> Dict:
+    user_id = job.payload['user_id']
+    # Once the reviews are gone their companies can't be found again, so a
+    # retry reuses the list taken by the first attempt
+    company_ids = job.progress.get('company_ids')
+    if company_ids is None:
+        company_ids = repository.user_company_ids(user_id)
+        job.save_progress(company_ids=company_ids)
+
+    repository.erase_user(user_id, company_ids)
+    cache_manager.invalidate_many(
+        [('user', {'user_id': user_id})] + [('company', {'company_id': company_id}) for company_id in company_ids]
+    )
+    logger.info(f"Erased the content of user {user_id} from {len(company_ids)} companies")
+    return {'companies': len(company_ids)}
+
+
+def submit_erasure(user_id: str):
+    """Delete the user's profile now and their content in the background"""
+    repository.delete_user(user_id)
+    return job_queue.submit('erase_account', {'user_id': user_id}, key=user_id)
@@ -0,0 +1,134 @@
+"""
+Profile fan-out for ChoosyTable
+A user's gender, ethnicity and location are copied onto every review and
+interview they wrote. After a profile edit the copies are rewritten in
+batches by a background job (see app/jobs.py), so the request returns
+immediately. Progress is kept in memcached where any worker can report it.
+"""
+
+import logging
+import os
+import threading
+import time
+from typing import Callable, Dict, Optional
+
+from app import cache_manager, job_queue
+from app import repository
+from app.jobs import job_handler
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_BATCH_SIZE = 500
+
+# Progress entries outlive the job long enough for the user to see the result
+PROGRESS_TTL = 3600
+
+# One fan-out per user at a time in this process, so counter moves never
+# interleave; across processes the job queue runs one job per user. A fixed
+# set of locks shared out by user id, so the set doesn't grow with the users
+# seen; two users on the same lock just take turns
+USER_LOCK_STRIPES = 64
+_user_locks = [threading.Lock() for _ in range(USER_LOCK_STRIPES)]
+
+
+def _user_lock(user_id: str) -> threading.Lock:
+    return _user_locks[hash(user_id) % USER_LOCK_STRIPES]
+
+
+def progress_key(user_id: str) -> str:
+    return f"{cache_manager.key_prefix}profile_fanout:{user_id}"
+
+
+def _report(user_id: str, progress: Dict) -> None:
+    try:
+        cache_manager.cache.client.set(progress_key(user_id), progress, PROGRESS_TTL)
+    except Exception as e:
+        logger.warning(f"Could not record fan-out progress for {user_id}: {e}")
+
+
+def get_progress(user_id: str) -> Optional[Dict]:
+    """Latest progress of a user's profile fan-out, or None if there is none"""
+    try:
+        return cache_manager.cache.client.get(progress_key(user_id))
+    except Exception as e:
+        logger.warning(f"Could not read fan-out progress for {user_id}: {e}")
+        return None
+
+
+def run_profile_fanout(user_id: str, gender: str, ethnicity: str, location: str,
+                       batch_size: Optional[int] = None,
+                       on_batch: Optional[Callable[[Dict], None]] = None) -> Dict:
+    """
+    Rewrite the user's denormalized demographics and invalidate the
+    statistics of exactly the companies whose counters moved.
+
+    Args:
+        on_batch: Called with the progress after every batch
+
+    Returns:
+        dict: Final progress (state, reviews, interviews, companies)
+
+    Raises:
+        Exception: Whatever stopped the fan-out, after recording it as failed
+    """
+    batch_size = batch_size or int(os.environ.get('PROFILE_FANOUT_BATCH_SIZE', DEFAULT_BATCH_SIZE))
+    progress = {'state': 'running', 'reviews': 0, 'interviews': 0, 'companies': 0, 'started': time.time()}
+    _report(user_id, progress)
+    changed_companies = set()
+
+    with _user_lock(user_id):
+        try:
+            for batch in repository.iter_denormalized_profile_updates(
+                user_id, gender, ethnicity, location, batch_size
+            ):
+                progress[batch['collection']] += batch['updated']
+                for company_id in batch['company_ids']:
+                    cache_manager.invalidate('company_stats', company_id=company_id)
+                changed_companies.update(batch['company_ids'])
+                progress['companies'] = len(changed_companies)
+                _report(user_id, progress)
+                if on_batch is not None:
+                    on_batch(progress)
+            progress['state'] = 'done'
+        except Exception:
+            progress.update(state='failed', finished=time.time())
+            _report(user_id, progress)
+            raise
+
+    progress['finished'] = time.time()
+    _report(user_id, progress)
+    logger.info(
+        f"Profile fan-out for {user_id} {progress['state']}: {progress['reviews']} reviews, "
+        f"{progress['interviews']} interviews, {progress['companies']} companies"
+    )
+    return progress
+
+
+@job_handler('profile_fanout')
+def profile_fanout_job(job) -> Dict:
+    """Copy the user's current profile, so jobs for older edits are harmless"""
+    user_id = job.payload['user_id']
+    user = repository.find_user(user_id)
+    if user is None:
+        return {'state': 'skipped'}
+
+    progress = run_profile_fanout(
+        user_id, user.get('gender'), user.get('ethnicity'), user.get('location'),
+        on_batch=lambda progress: job.save_progress(**progress)
+    )
+    if job.attempts > 1:
+        # An earlier attempt may have moved some counters without rewriting
+        # the interviews they stand for; recount the user's companies
+        repository.recount_company_counters(repository.user_company_ids(user_id))
+    return progress
+
+
+def submit_profile_fanout(user_id: str):
+    """
+    Schedule the fan-out of the user's profile off the request thread.
+
+    With JOBS_MODE=inline it runs right away (e.g. in scripts).
+    """
+    if job_queue.mode != 'inline':
+        _report(user_id, {'state': 'queued', 'reviews': 0, 'interviews': 0, 'companies': 0})
+    return job_queue.submit('profile_fanout', {'user_id': user_id}, key=user_id)
@@ -0,0 +1,91 @@
+"""
+Identity resolution for ChoosyTable
+The Google userinfo lookup is made once at login and kept in the session, so
+routes read the signed-in user's identity without an upstream HTTP round-trip.
+The cached identity is refreshed only when the OAuth token has expired.
+"""
+
+import logging
+import os
+import threading
+import time
+from typing import Dict, Optional
+
+from flask import session
+from flask_dance.contrib.google import google
+
+logger = logging.getLogger(__name__)
+
+SESSION_KEY = 'identity'
+USERINFO_ENDPOINT = "/oauth2/v1/userinfo"
+
+# Tokens without an expiry are re-checked upstream at most this often (seconds)
+DEFAULT_IDENTITY_TTL = 3600
+
+_stats_lock = threading.Lock()
+_stats = {'upstream_calls': 0, 'upstream_calls_avoided': 0}
+
+
+def _count(stat: str) -> None:
+    with _stats_lock:
+        _stats[stat] += 1
+
+
+def get_identity_stats() -> Dict[str, int]:
+    """Upstream identity calls made and avoided by this process"""
+    with _stats_lock:
+        return dict(_stats)
+
+
+def remember_identity(user_info: Dict, token: Optional[Dict] = None) -> Dict:
+    """Store the identity returned by Google in the session until the token expires"""
+    expires_at = (token or {}).get('expires_at') or time.time() + DEFAULT_IDENTITY_TTL
+    identity = {
+        'email': user_info.get('email'),
+        'name': user_info.get('name', ''),
+        'id': user_info.get('id'),
+        'verified_email': user_info.get('verified_email', False),
+        'expires_at': expires_at
+    }
+    session[SESSION_KEY] = identity
+    return identity
+
+
+def forget_identity() -> None:
+    """Drop the cached identity, e.g. on logout"""
+    session.pop(SESSION_KEY, None)
+
+
+def fetch_identity(oauth_session, token: Optional[Dict] = None) -> Optional[Dict]:
+    """Call Google's userinfo endpoint and cache the result in the session"""
+    _count('upstream_calls')
+    resp = oauth_session.get(USERINFO_ENDPOINT)
+    if not resp.ok:
+        logger.error(f"Failed to fetch Google user info: {resp.status_code}")
+        return None
+    return remember_identity(resp.json(), token)
+
+
+def get_current_user_info() -> Dict:
+    """
+    Get the signed-in user's identity, works with both real OAuth and mock auth.
+
+    Returns:
+        dict: User info dictionary with email, name, etc., or {} if signed out
+    """
+    if os.environ.get('USE_MOCK_AUTH', '').lower() == 'true':
+        from app.mock_auth import get_mock_user_info
+        return get_mock_user_info()
+
+    identity = session.get(SESSION_KEY)
+    if identity and identity.get('expires_at', 0) > time.time():
+        _count('upstream_calls_avoided')
+        return identity
+
+    if not google.authorized:
+        return {}
+    try:
+        return fetch_identity(google, google.token) or {}
+    except Exception as e:
+        logger.error(f"Error refreshing Google identity: {e}")
+        return {}
@@ -0,0 +1,299 @@
+"""
+Index specification for ChoosyTable
+The indexes every query in app/repository.py relies on, together with the
+query constants the two share. ``plan_index_changes`` diffs the spec against
+the live ``list_indexes()`` output, ``apply_index_changes`` converges the
+database on it, and ``verify_query_plans`` explains each canonical query and
+reports any that would scan a whole collection.
+
+Only pymongo and bson are imported here, and the database is passed to
+every function, so the spec can be checked against any database.
+"""
+
+from datetime import datetime
+from typing import Any, Dict, Iterator, List
+
+from bson import ObjectId, json_util
+from pymongo import ASCENDING, DESCENDING, TEXT
+
+# Companies shown on the listing page
+REVIEWED_COMPANIES_FILTER = {'review_count': {'$gt': 0}}
+
+# Partial index over exactly those companies
+REVIEWED_LISTING_INDEX = 'reviewed_last_modified'
+
+# Company fields read by the company page; never includes reviews or interviews
+COMPANY_HEADER_PROJECTION = {
+    'company': 1, 'created': 1, 'last_modified': 1,
+    'review_count': 1, 'rating_sum': 1, 'rating_count': 1, 'interview_counts': 1
+}
+
+# Fields of a company in search results; the routes add the current review
+# count, so cached results never hold one
+COMPANY_SEARCH_PROJECTION = {'company': 1}
+
+INDEX_SPECS = [
+    {
+        'collection': 'users',
+        'name': 'email_unique',
+        'keys': [('email', ASCENDING)],
+        'options': {'unique': True},
+        'description': 'Fast user lookup by email for authentication'
+    },
+    {
+        'collection': 'companies',
+        'name': REVIEWED_LISTING_INDEX,
+        'keys': [('last_modified', DESCENDING), ('_id', DESCENDING)],
+        'options': {'partialFilterExpression': REVIEWED_COMPANIES_FILTER},
+        'description': 'Company listing and count: reviewed companies only, most recently modified first'
+    },
+    {
+        'collection': 'companies',
+        'name': 'reviewed_review_count',
+        'keys': [('review_count', DESCENDING), ('_id', DESCENDING)],
+        'options': {'partialFilterExpression': REVIEWED_COMPANIES_FILTER},
+        'description': 'Most reviewed companies, for the cache warmer'
+    },
+    {
+        'collection': 'companies',
+        'name': 'company_name_index',
+        'keys': [('company', ASCENDING)],
+        'options': {},
+        'description': 'Fast company lookup by name'
+    },
+    {
+        'collection': 'companies',
+        'name': 'company_name_prefix',
+        'keys': [('name_lower', ASCENDING)],
+        'options': {},
+        'description': 'Company autocomplete: range scan over normalized names'
+    },
+    {
+        'collection': 'companies',
+        'name': 'company_name_text',
+        'keys': [('company', TEXT)],
+        # No stemming or stop words; company names aren't prose
+        'options': {'default_language': 'none'},
+        'description': 'Company search: full-text match on names'
+    },
+    {
+        'collection': 'reviews',
+        'name': 'company_created',
+        'keys': [('company_id', ASCENDING), ('created', ASCENDING)],
+        'options': {},
+        'description': 'Reviews of a company in the order they were written'
+    },
+    {
+        'collection': 'reviews',
+        'name': 'user_created',
+        'keys': [('user', ASCENDING), ('created', DESCENDING)],
+        'options': {},
+        'description': 'Reviews written by a user, newest first'
+    },
+    {
+        'collection': 'interviews',
+        'name': 'company_position_ethnicity',
+        'keys': [('company_id', ASCENDING), ('position', ASCENDING), ('user_ethnicity', ASCENDING)],
+        'options': {},
+        'description': 'Interview statistics grouped by position and ethnicity'
+    },
+    {
+        'collection': 'interviews',
+        'name': 'user_index',
+        'keys': [('user', ASCENDING)],
+        'options': {},
+        'description': 'Interviews submitted by a user (profile fan-out, erasure)'
+    },
+    {
+        'collection': 'jobs',
+        'name': 'state_run_at',
+        'keys': [('state', ASCENDING), ('run_at', ASCENDING)],
+        'options': {},
+        'description': 'Background jobs due to run, oldest first'
+    },
+    {
+        'collection': 'jobs',
+        'name': 'queued_type_key_unique',
+        'keys': [('type', ASCENDING), ('key', ASCENDING)],
+        'options': {'unique': True, 'partialFilterExpression': {'state': 'queued'}},
+        'description': 'At most one queued job per type and key (deduplication)'
+    },
+    {
+        'collection': 'jobs',
+        'name': 'finished_ttl',
+        'keys': [('expire_at', ASCENDING)],
+        'options': {'expireAfterSeconds': 0},
+        'description': 'Finished and failed jobs are removed once expire_at passes'
+    }
+]
+
+# Index options that change what an index is; anything else (v, ns, background) is ignored
+DEFINING_OPTIONS = ('unique', 'sparse', 'partialFilterExpression', 'expireAfterSeconds', 'collation')
+
+
+def _definition(keys, options: Dict) -> tuple:
+    return (
+        tuple((field, int(direction) if isinstance(direction, float) else direction) for field, direction in keys),
+        tuple(sorted(
+            (option, json_util.dumps(options[option], sort_keys=True))
+            for option in DEFINING_OPTIONS if option in options
+        ))
+    )
+
+
+def _live_keys(index: Dict) -> List:
+    """Keys of a live index as a spec writes them; text indexes list theirs under _fts"""
+    keys = list(index['key'].items())
+    if 'weights' not in index:
+        return keys
+    other = [key for key in keys if key[0] not in ('_fts', '_ftsx')]
+    return [(field, TEXT) for field in sorted(index['weights'])] + other
+
+
+def plan_index_changes(db, specs: List[Dict] = INDEX_SPECS) -> Dict[str, List[Dict]]:
+    """
+    Diff the spec against the indexes that exist.
+
+    An index that matches a spec by definition counts as present even under
+    another name. An index whose name matches but whose definition differs
+    is rebuilt.
+
+    Returns:
+        dict: ``create``, ``rebuild``, ``unchanged`` (specs) and ``extra``
+        (live indexes on spec'd collections that no spec asks for)
+    """
+    plan = {'create': [], 'rebuild': [], 'unchanged': [], 'extra': []}
+
+    for collection_name in sorted({spec['collection'] for spec in specs}):
+        existing = {
+            index['name']: index for index in db[collection_name].list_indexes()
+            if index['name'] != '_id_'
+        }
+        by_definition = {
+            _definition(_live_keys(index), index): name for name, index in existing.items()
+        }
+
+        for spec in (s for s in specs if s['collection'] == collection_name):
+            definition = _definition(spec['keys'], spec['options'])
+            if definition in by_definition:
+                plan['unchanged'].append(spec)
+                existing.pop(by_definition[definition], None)
+            elif spec['name'] in existing:
+                plan['rebuild'].append(spec)
+                existing.pop(spec['name'])
+            else:
+                plan['create'].append(spec)
+
+        plan['extra'].extend(
+            {'collection': collection_name, 'name': name, 'keys': _live_keys(index)}
+            for name, index in existing.items()
+        )
+
+    return plan
+
+
+def apply_index_changes(db, plan: Dict[str, List[Dict]], drop_extra: bool = False) -> None:
+    """Create missing indexes, rebuild changed ones and optionally drop unlisted ones"""
+    for spec in plan['rebuild']:
+        db[spec['collection']].drop_index(spec['name'])
+    for spec in plan['create'] + plan['rebuild']:
+        db[spec['collection']].create_index(spec['keys'], name=spec['name'], **spec['options'])
+    if drop_extra:
+        for index in plan['extra']:
+            db[index['collection']].drop_index(index['name'])
+
+
+def canonical_queries() -> List[Dict[str, Any]]:
+    """
+    The query shapes issued by app/repository.py, as explainable commands.
+
+    Placeholder values stand in for ids and emails; the planner picks the
+    same plan for any value of the same shape.
+    """
+    some_id = ObjectId()
+    some_user = str(ObjectId())
+    stale_profile = {'$or': [{'gender': {'$ne': 'x'}}, {'ethnicity': {'$ne': 'x'}}, {'location': {'$ne': 'x'}}]}
+    stale_interview = {'$or': [{'user_gender': {'$ne': 'x'}}, {'user_ethnicity': {'$ne': 'x'}}]}
+
+    return [
+        {'name': 'find_user_by_email', 'command': {
+            'find': 'users', 'filter': {'email': 'user@example.com'}, 'limit': 1}},
+        {'name': 'count_reviewed_companies', 'command': {
+            'count': 'companies', 'query': REVIEWED_COMPANIES_FILTER, 'hint': REVIEWED_LISTING_INDEX}},
+        {'name': 'find_companies_page', 'command': {
+            'find': 'companies', 'filter': REVIEWED_COMPANIES_FILTER,
+            'projection': {'company': 1, 'last_modified': 1, 'review_count': 1},
+            'sort': {'last_modified': -1, '_id': -1}, 'skip': 0, 'limit': 10}},
+        {'name': 'find_hot_company_ids', 'command': {
+            'find': 'companies', 'filter': REVIEWED_COMPANIES_FILTER, 'projection': {'_id': 1},
+            'sort': {'review_count': -1, '_id': -1}, 'limit': 100}},
+        {'name': 'search_companies', 'command': {
+            'find': 'companies', 'filter': {'$text': {'$search': 'acme'}},
+            'projection': dict(COMPANY_SEARCH_PROJECTION, score={'$meta': 'textScore'}),
+            'sort': {'score': {'$meta': 'textScore'}, 'review_count': -1}, 'limit': 50}},
+        {'name': 'find_companies_by_prefix', 'command': {
+            'find': 'companies', 'filter': {'name_lower': {'$gte': 'ac', '$lt': 'ad'}},
+            'projection': COMPANY_SEARCH_PROJECTION, 'sort': {'name_lower': 1}, 'limit': 10}},
+        {'name': 'find_company', 'command': {
+            'find': 'companies', 'filter': {'_id': some_id}, 'projection': COMPANY_HEADER_PROJECTION, 'limit': 1}},
+        {'name': 'find_company_reviews_page', 'command': {
+            'find': 'reviews', 'filter': {'company_id': some_id},
+            'sort': {'created': 1}, 'skip': 0, 'limit': 10}},
+        {'name': 'find_user_reviews_page', 'command': {
+            'find': 'reviews', 'filter': {'user': some_user},
+            'sort': {'created': -1}, 'skip': 0, 'limit': 10}},
+        {'name': 'count_user_reviews', 'command': {
+            'count': 'reviews', 'query': {'user': some_user}}},
+        {'name': 'stale_user_reviews', 'command': {
+            'find': 'reviews', 'filter': dict({'user': some_user}, **stale_profile)}},
+        {'name': 'stale_user_interviews', 'command': {
+            'find': 'interviews', 'filter': dict({'user': some_user}, **stale_interview)}},
+        {'name': 'aggregate_interview_statistics', 'command': {
+            'aggregate': 'interviews', 'cursor': {}, 'pipeline': [
+                {'$match': {'company_id': some_id}},
+                {'$group': {'_id': {'position': '$position', 'ethnicity': '$user_ethnicity'}, 'total': {'$sum': 1}}}
+            ]}},
+        {'name': 'claim_job', 'command': {
+            'find': 'jobs', 'filter': {'state': {'$in': ['queued', 'running']}, 'run_at': {'$lte': datetime.now()}},
+            'sort': {'run_at': 1}, 'limit': 1}},
+        {'name': 'aggregate_rating_average', 'command': {
+            'aggregate': 'reviews', 'cursor': {}, 'pipeline': [
+                {'$match': {'company_id': some_id, 'rating': {'$gt': 0}}},
+                {'$group': {'_id': None, 'avg': {'$avg': '$rating'}}}
+            ]}}
+    ]
+
+
+def _plan_nodes(explain: Any) -> Iterator[Dict]:
+    """Every plan stage in an explain result, skipping rejected plans"""
+    if isinstance(explain, dict):
+        if 'stage' in explain:
+            yield explain
+        for key, value in explain.items():
+            if key != 'rejectedPlans':
+                yield from _plan_nodes(value)
+    elif isinstance(explain, list):
+        for item in explain:
+            yield from _plan_nodes(item)
+
+
+def verify_query_plans(db, queries: List[Dict[str, Any]] = None) -> List[Dict[str, Any]]:
+    """
+    Explain each canonical query.
+
+    Returns:
+        list: One entry per query with its ``stages``, ``indexes`` and
+        ``collscan`` (True if the winning plan scans the whole collection)
+    """
+    results = []
+    for query in queries or canonical_queries():
+        explain = db.command({'explain': query['command'], 'verbosity': 'queryPlanner'})
+        nodes = list(_plan_nodes(explain))
+        stages = [node['stage'] for node in nodes]
+        results.append({
+            'name': query['name'],
+            'stages': stages,
+            'indexes': sorted({node['indexName'] for node in nodes if 'indexName' in node}),
+            'collscan': 'COLLSCAN' in stages
+        })
+    return results
@@ -0,0 +1,228 @@
+"""
+Per-request performance instrumentation for ChoosyTable
+Counts and times the MongoDB commands, memcached calls and template renders
+made while handling a request. The totals go into a ``Server-Timing``
+response header and one structured log line per request; a sampled share of
+slow requests is also logged with the shape of every query they ran.
+
+Work done outside a request (background fan-out, scripts) is not recorded.
+"""
+
+import json
+import logging
+import random
+import time
+from functools import partial
+from typing import Any, Callable, Dict, Iterable, List, Optional
+
+from flask import before_render_template, g, has_request_context, request, template_rendered
+from pymongo import monitoring
+
+logger = logging.getLogger(__name__)
+
+# Command fields whose shape identifies a query
+SHAPE_FIELDS = ('filter', 'query', 'pipeline', 'sort', 'projection', 'hint', 'updates', 'deletes')
+
+
+def query_shape(value: Any) -> Any:
+    """The structure of a query with every literal replaced by '?'"""
+    if isinstance(value, dict):
+        return {key: query_shape(item) for key, item in value.items()}
+    if isinstance(value, (list, tuple)):
+        return [query_shape(item) for item in value[:1]] + (['...'] if len(value) > 1 else [])
+    return '?'
+
+
+class RequestMetrics:
+    """Counters for a single request, kept on ``g``"""
+
+    def __init__(self, sampled: bool = False):
+        self.started = time.perf_counter()
+        self.mongo_commands = 0
+        self.mongo_time = 0.0
+        self.cache_ops = 0
+        self.cache_hits = 0
+        self.cache_misses = 0
+        self.cache_time = 0.0
+        self.renders = 0
+        self.render_time = 0.0
+        self.render_started: List[float] = []
+        # Query shapes are only collected for requests sampled for the slow log
+        self.queries: Optional[List[Dict]] = [] if sampled else None
+        self.pending_queries: Dict[int, Dict] = {}
+
+    def elapsed(self) -> float:
+        return time.perf_counter() - self.started
+
+    def summary(self) -> Dict[str, Any]:
+        return {
+            'mongo_commands': self.mongo_commands,
+            'mongo_ms': round(self.mongo_time * 1000, 2),
+            'cache_ops': self.cache_ops,
+            'cache_hits': self.cache_hits,
+            'cache_misses': self.cache_misses,
+            'cache_ms': round(self.cache_time * 1000, 2),
+            'renders': self.renders,
+            'render_ms': round(self.render_time * 1000, 2)
+        }
+
+
+def current_metrics() -> Optional[RequestMetrics]:
+    """Metrics of the request being handled on this thread, if any"""
+    return g.get('request_metrics') if has_request_context() else None
+
+
+class MongoCommandTimer(monitoring.CommandListener):
+    """pymongo listener that adds every command to the current request's metrics"""
+
+    def started(self, event):
+        metrics = current_metrics()
+        if metrics is not None and metrics.queries is not None:
+            command = event.command
+            metrics.pending_queries[event.request_id] = {
+                'command': event.command_name,
+                'collection': command.get(event.command_name),
+                'shape': {field: query_shape(command[field]) for field in SHAPE_FIELDS if field in command}
+            }
+
+    def _finished(self, event, failed: bool = False):
+        metrics = current_metrics()
+        if metrics is None:
+            return
+        duration = event.duration_micros / 1e6
+        metrics.mongo_commands += 1
+        metrics.mongo_time += duration
+        query = metrics.pending_queries.pop(event.request_id, None)
+        if query is not None:
+            query['ms'] = round(duration * 1000, 2)
+            if failed:
+                query['failed'] = True
+            metrics.queries.append(query)
+
+    def succeeded(self, event):
+        self._finished(event)
+
+    def failed(self, event):
+        self._finished(event, failed=True)
+
+
+class InstrumentedClient:
+    """
+    Wraps a pymemcache client and records call counts, latency and get
+    hits/misses in the current request's metrics. Everything else is passed
+    through to the wrapped client.
+
+    Observers are called after every timed call, inside or outside a
+    request, with (operation, args, result, duration in seconds).
+    """
+
+    TIMED_METHODS = frozenset((
+        'get', 'gets', 'get_many', 'get_multi', 'set', 'set_many', 'set_multi', 'add', 'replace',
+        'cas', 'delete', 'delete_many', 'delete_multi', 'incr', 'decr', 'touch'
+    ))
+
+    def __init__(self, client, observers: Iterable[Callable] = ()):
+        self.client = client
+        self.observers = list(observers)
+
+    def __getattr__(self, name):
+        attribute = getattr(self.client, name)
+        if name in self.TIMED_METHODS:
+            return partial(self._timed, name, attribute)
+        return attribute
+
+    def _timed(self, name, method, *args, **kwargs):
+        metrics = current_metrics()
+        if metrics is None and not self.observers:
+            return method(*args, **kwargs)
+
+        started = time.perf_counter()
+        try:
+            result = method(*args, **kwargs)
+        finally:
+            elapsed = time.perf_counter() - started
+            if metrics is not None:
+                metrics.cache_ops += 1
+                metrics.cache_time += elapsed
+
+        for observer in self.observers:
+            observer(name, args, result, elapsed)
+
+        if metrics is None:
+            return result
+        if name in ('get', 'gets'):
+            hit = (result[0] if name == 'gets' else result) is not None
+            metrics.cache_hits += hit
+            metrics.cache_misses += not hit
+        elif name in ('get_many', 'get_multi'):
+            requested = len(args[0]) if args else len(kwargs.get('keys', ()))
+            metrics.cache_hits += len(result)
+            metrics.cache_misses += max(requested - len(result), 0)
+        return result
+
+
+class RequestInstrumentation:
+    """
+    Starts the metrics of each request and reports them once it is done.
+
+    Args:
+        server_timing: Add a Server-Timing header to every response
+        slow_request_ms: Requests at least this slow are candidates for the slow log
+        slow_sample_rate: Share of requests (0-1) whose query shapes are
+            collected for the slow log; 0 turns the slow log off
+    """
+
+    def __init__(self, server_timing: bool = True, slow_request_ms: float = 500,
+                 slow_sample_rate: float = 0.0):
+        self.server_timing = server_timing
+        self.slow_request_ms = slow_request_ms
+        self.slow_sample_rate = slow_sample_rate
+        self.command_listener = MongoCommandTimer()
+
+    def init_app(self, app) -> None:
+        app.before_request(self._start)
+        app.after_request(self._finish)
+        before_render_template.connect(self._render_started, app)
+        template_rendered.connect(self._render_finished, app)
+
+    def _start(self):
+        sampled = self.slow_sample_rate > 0 and random.random() < self.slow_sample_rate
+        g.request_metrics = RequestMetrics(sampled=sampled)
+
+    def _render_started(self, sender, **extra):
+        metrics = current_metrics()
+        if metrics is not None:
+            metrics.render_started.append(time.perf_counter())
+
+    def _render_finished(self, sender, **extra):
+        metrics = current_metrics()
+        if metrics is not None and metrics.render_started:
+            metrics.renders += 1
+            metrics.render_time += time.perf_counter() - metrics.render_started.pop()
+
+    def _finish(self, response):
+        metrics = g.pop('request_metrics', None)
+        if metrics is None:
+            return response
+
+        total_ms = metrics.elapsed() * 1000
+        summary = metrics.summary()
+
+        if self.server_timing:
+            response.headers['Server-Timing'] = ", ".join((
+                f'mongo;dur={summary["mongo_ms"]};desc="{metrics.mongo_commands} commands"',
+                f'cache;dur={summary["cache_ms"]};desc="{metrics.cache_hits} hits, {metrics.cache_misses} misses"',
+                f'render;dur={summary["render_ms"]}',
+                f'total;dur={total_ms:.2f}'
+            ))
+
+        entry = dict(
+            method=request.method, path=request.path, endpoint=request.endpoint,
+            status=response.status_code, duration_ms=round(total_ms, 2), **summary
+        )
+        logger.info(json.dumps(entry))
+
+        if metrics.queries is not None and total_ms >= self.slow_request_ms:
+            logger.warning(json.dumps(dict(entry, slow=True, queries=metrics.queries), default=str))
+
+        return response
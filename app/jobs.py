@@ -0,0 +1,319 @@
+"""
+Background jobs for ChoosyTable
+Work that follows a write but doesn't have to finish before the response -
+copying a profile onto its reviews, erasing an account's content - is queued
+in the MongoDB ``jobs`` collection and run by workers: threads inside every
+web process (JOBS_MODE=thread, the default; started by ``start_job_workers``
+from run.py and gunicorn.conf.py, so scripts importing the app only queue
+jobs), separate ``job_worker.py`` processes (JOBS_MODE=worker), or right away
+in the request (JOBS_MODE=inline, for scripts and debugging).
+
+A queued job is unique per (type, key): enqueueing it again while it waits
+only replaces its payload, so several quick profile edits run one fan-out
+with the latest values, and two jobs with the same type and key never run
+at the same time. Workers claim jobs atomically under a lease, and a job
+whose worker died is claimed again once the lease runs out. Failed jobs
+are retried with exponential backoff up to their handler's ``max_attempts``
+and then kept as 'failed'. Handlers must therefore cope with running more
+than once; ``Job.save_progress`` keeps what a retry needs to know.
+"""
+
+import importlib
+import logging
+import os
+import random
+import socket
+import threading
+import time
+from datetime import datetime, timedelta, timezone
+from typing import Any, Callable, Dict, Iterable, List, Optional
+
+from bson import ObjectId
+from pymongo import ReturnDocument
+from pymongo.errors import DuplicateKeyError
+
+logger = logging.getLogger(__name__)
+
+# Values accepted by the JOBS_MODE config switch
+JOBS_MODES = ('thread', 'worker', 'inline')
+DEFAULT_JOBS_MODE = 'thread'
+
+# Job type -> handler(job), registered with @job_handler
+HANDLERS: Dict[str, Callable] = {}
+
+# Modules whose handlers a standalone worker must import
+HANDLER_MODULES = ('app.fanout', 'app.erasure', 'app.warming')
+
+
+def job_handler(job_type: str, max_attempts: int = 5):
+    """Register the function that runs jobs of a type"""
+    def decorator(func):
+        func.max_attempts = max_attempts
+        HANDLERS[job_type] = func
+        return func
+    return decorator
+
+
+def _now() -> datetime:
+    return datetime.now(timezone.utc)
+
+
+class Job:
+    """A claimed job, as seen by its handler"""
+
+    def __init__(self, queue: Optional['JobQueue'], document: Dict):
+        self.queue = queue
+        self.id = document.get('_id')
+        self.type = document['type']
+        self.key = document.get('key')
+        self.payload = document.get('payload') or {}
+        self.progress = document.get('progress') or {}
+        self.attempts = document.get('attempts', 1)
+        self.worker = document.get('worker')
+
+    def save_progress(self, **fields) -> None:
+        """Record progress for a retry to pick up; also renews the lease"""
+        self.progress.update(fields)
+        if self.queue is not None:
+            self.queue.renew(self, progress=self.progress)
+
+
+class JobQueue:
+    """
+    The ``jobs`` collection.
+
+    Args:
+        collection: MongoDB collection holding the jobs
+        mode: 'thread', 'worker' or 'inline' (see module docstring)
+        lease: Seconds a worker owns a claimed job before others may take it
+        retry_delay: Delay before the first retry, doubled for each further one
+        max_retry_delay: Upper bound on the retry delay
+        keep_finished: Seconds finished and failed jobs are kept
+    """
+
+    def __init__(self, collection, mode: str = DEFAULT_JOBS_MODE, lease: float = 300,
+                 retry_delay: float = 5, max_retry_delay: float = 600, keep_finished: float = 7 * 86400):
+        if mode not in JOBS_MODES:
+            raise ValueError(f"JOBS_MODE must be one of: {', '.join(JOBS_MODES)}")
+        self.collection = collection
+        self.mode = mode
+        self.lease = lease
+        self.retry_delay = retry_delay
+        self.max_retry_delay = max_retry_delay
+        self.keep_finished = keep_finished
+
+    def submit(self, job_type: str, payload: Dict, key: Any = None, delay: float = 0) -> Any:
+        """
+        Queue a job, or run it right away in inline mode.
+
+        Args:
+            job_type: Name the handler was registered under
+            payload: Arguments of the handler, BSON-encodable
+            key: Deduplication key, typically the entity the job works on;
+                None queues an independent job
+            delay: Seconds before the job may run
+
+        Returns:
+            The job's _id, or in inline mode the handler's result (None if
+            it failed; like a queued job's, the error is only logged)
+        """
+        if self.mode == 'inline':
+            try:
+                return run_job(Job(None, {'type': job_type, 'key': key, 'payload': payload}))
+            except Exception as e:
+                logger.error(f"Job {job_type} {key} failed: {e}", exc_info=True)
+                return None
+        return self.enqueue(job_type, payload, key, delay)
+
+    def enqueue(self, job_type: str, payload: Dict, key: Any = None, delay: float = 0) -> Any:
+        now = _now()
+        key = str(key) if key is not None else str(ObjectId())
+        # A concurrent enqueue may insert the same job first; the retry updates it
+        for attempt in range(2):
+            try:
+                job = self.collection.find_one_and_update(
+                    {'type': job_type, 'key': key, 'state': 'queued'},
+                    {
+                        '$set': {'payload': payload, 'updated': now},
+                        '$setOnInsert': {
+                            'created': now, 'run_at': now + timedelta(seconds=delay),
+                            'attempts': 0, 'progress': {}
+                        }
+                    },
+                    upsert=True, projection={'_id': 1}, return_document=ReturnDocument.AFTER
+                )
+                return job['_id']
+            except DuplicateKeyError:
+                if attempt:
+                    raise
+
+    def claim(self, worker: str, types: Optional[List[str]] = None) -> Optional[Job]:
+        """Take the next due job, including running ones whose lease has expired"""
+        while True:
+            now = _now()
+            query = {'state': {'$in': ['queued', 'running']}, 'run_at': {'$lte': now}}
+            if types:
+                query['type'] = {'$in': list(types)}
+            # While running, run_at holds the end of the lease
+            document = self.collection.find_one_and_update(
+                query,
+                {
+                    '$set': {'state': 'running', 'worker': worker, 'started': now,
+                             'run_at': now + timedelta(seconds=self.lease)},
+                    '$inc': {'attempts': 1}
+                },
+                sort=[('run_at', 1)], return_document=ReturnDocument.AFTER
+            )
+            if document is None:
+                return None
+            job = Job(self, document)
+            handler = HANDLERS.get(job.type)
+            # A worker that keeps dying on a job must not take it forever
+            if handler is not None and job.attempts > handler.max_attempts:
+                self._finish(job, 'failed', error=document.get('error') or "worker lost the job too often")
+                continue
+            if self._key_busy(job, now):
+                self._postpone(job)
+                continue
+            return job
+
+    def _key_busy(self, job: Job, now: datetime) -> bool:
+        return self.collection.find_one({
+            'state': 'running', 'run_at': {'$gt': now},
+            'type': job.type, 'key': job.key, '_id': {'$ne': job.id}
+        }, {'_id': 1}) is not None
+
+    def _postpone(self, job: Job) -> None:
+        # Wait for the running job with the same key; this claim doesn't count as an attempt
+        delay = self.retry_delay * random.uniform(0.5, 1.0)
+        try:
+            self.collection.update_one(self._guard(job), {
+                '$set': {'state': 'queued', 'run_at': _now() + timedelta(seconds=delay)},
+                '$inc': {'attempts': -1}
+            })
+        except DuplicateKeyError:
+            self._finish(job, 'done', superseded=True)
+
+    def _guard(self, job: Job) -> Dict:
+        # Only the current holder of the lease may update the job
+        return {'_id': job.id, 'worker': job.worker, 'attempts': job.attempts}
+
+    def renew(self, job: Job, **fields) -> bool:
+        fields['run_at'] = _now() + timedelta(seconds=self.lease)
+        return self.collection.update_one(self._guard(job), {'$set': fields}).modified_count == 1
+
+    def _finish(self, job: Job, state: str, **fields) -> None:
+        now = _now()
+        self.collection.update_one(self._guard(job), {'$set': dict(
+            fields, state=state, finished=now, expire_at=now + timedelta(seconds=self.keep_finished)
+        )})
+
+    def complete(self, job: Job, result: Any = None) -> None:
+        self._finish(job, 'done', result=result)
+
+    def fail(self, job: Job, error: Exception) -> str:
+        """Schedule a retry or give up; returns the job's new state"""
+        handler = HANDLERS.get(job.type)
+        max_attempts = handler.max_attempts if handler is not None else 1
+        if job.attempts >= max_attempts:
+            self._finish(job, 'failed', error=str(error))
+            return 'failed'
+
+        delay = min(self.retry_delay * 2 ** (job.attempts - 1), self.max_retry_delay)
+        delay *= random.uniform(0.5, 1.0)
+        try:
+            self.collection.update_one(self._guard(job), {'$set': {
+                'state': 'queued', 'run_at': _now() + timedelta(seconds=delay), 'error': str(error)
+            }})
+        except DuplicateKeyError:
+            # A newer job for the same key was queued meanwhile and supersedes this one
+            self._finish(job, 'done', error=str(error), superseded=True)
+            return 'done'
+        return 'queued'
+
+    def counts(self) -> Dict[str, int]:
+        """Jobs per state"""
+        return {
+            row['_id']: row['count']
+            for row in self.collection.aggregate([{'$group': {'_id': '$state', 'count': {'$sum': 1}}}])
+        }
+
+
+def load_handlers() -> None:
+    """Import the modules that register job handlers"""
+    for module in HANDLER_MODULES:
+        importlib.import_module(module)
+
+
+def run_job(job: Job) -> Any:
+    """Run a job's handler; exceptions propagate"""
+    handler = HANDLERS.get(job.type)
+    if handler is None:
+        raise LookupError(f"No handler registered for job type '{job.type}'")
+    return handler(job)
+
+
+class JobWorker:
+    """
+    Claims and runs jobs until stopped.
+
+    Args:
+        queue: The queue to work on
+        types: Job types this worker runs; None runs all
+        poll_interval: Seconds to wait when no job is due
+        observers: Called after every job with (job type, outcome, duration
+            in seconds); outcome is 'done', 'queued' (retry) or 'failed'
+    """
+
+    def __init__(self, queue: JobQueue, types: Optional[List[str]] = None, poll_interval: float = 1.0,
+                 observers: Iterable[Callable] = ()):
+        self.queue = queue
+        self.types = types
+        self.poll_interval = poll_interval
+        self.observers = list(observers)
+        self._stop = threading.Event()
+
+    def name(self) -> str:
+        return f"{socket.gethostname()}:{os.getpid()}:{threading.current_thread().name}"
+
+    def run_one(self) -> bool:
+        """Run the next due job; False if there was none"""
+        job = self.queue.claim(self.name(), self.types)
+        if job is None:
+            return False
+
+        started = time.perf_counter()
+        try:
+            result = run_job(job)
+        except Exception as e:
+            outcome = self.queue.fail(job, e)
+            logger.error(f"Job {job.type} {job.key} failed (attempt {job.attempts}, now {outcome}): {e}",
+                         exc_info=True)
+        else:
+            outcome = 'done'
+            self.queue.complete(job, result)
+        duration = time.perf_counter() - started
+        logger.info(f"Job {job.type} {job.key} {outcome} in {duration * 1000:.0f}ms")
+        for observer in self.observers:
+            observer(job.type, outcome, duration)
+        return True
+
+    def run(self) -> None:
+        while not self._stop.is_set():
+            try:
+                if self.run_one():
+                    continue
+            except Exception as e:
+                # MongoDB unreachable; keep polling
+                logger.warning(f"Job worker could not claim a job: {e}")
+            self._stop.wait(self.poll_interval)
+
+    def start(self, name: str = 'job-worker') -> threading.Thread:
+        """Run in a daemon thread"""
+        thread = threading.Thread(target=self.run, name=name, daemon=True)
+        thread.start()
+        return thread
+
+    def stop(self) -> None:
+        """Finish the current job, then return from run()"""
+        self._stop.set()
@@ -28,6 +28,10 @@ MAJOR OPTIMIZATIONS APPLIED:
    - Company lists cached for 5 minutes
    - Interview statistics cached for 1 hour
    - Smart cache invalidation on data changes
+   - Stampede protection: single-flight recomputation, stale-while-revalidate
+     and probabilistic early refresh via cache.fetch
+   - Every cached read goes through DatabaseCache/cached_query, so one
+     invalidation map (CacheManager.invalidate) covers every key
 
 EXPECTED PERFORMANCE GAINS:
 - 60-70% faster page loads (eliminated pandas overhead)
@@ -38,22 +42,30 @@ EXPECTED PERFORMANCE GAINS:
 
 import logging
 from datetime import datetime
-from statistics import mean
-from collections import defaultdict, Counter
 
-from flask import flash, redirect, url_for, render_template, current_app
+from flask import flash, redirect, url_for, render_template, current_app, session
 from flask_dance.contrib.google import google
 from flask_dance.consumer import oauth_error
 import os
-from pymongo import ReturnDocument
 
 from app.main import bp
 from app import (
-    ct, blueprint, client, Pagination, get_page_args, ObjectId,
+    blueprint, cache_manager, Pagination, get_page_args,
     iel, p, igl, e, request, jsonify, login_user, logout_user,
     login_required, login_manager
 )
 from app.models import User, MyPerson, MyCompany, MyInterview
+from app.stats import (
+    statistics_from_counts, rating_average_from_counters,
+    aggregate_interview_statistics, aggregate_rating_average
+)
+from app import repository
+from app.cache import DatabaseCache
+from app.fanout import submit_profile_fanout, get_progress as get_fanout_progress
+from app.erasure import submit_erasure
+from app.identity import (
+    get_current_user_info, fetch_identity, forget_identity, SESSION_KEY as IDENTITY_SESSION_KEY
+)
 
 logger = logging.getLogger(__name__)
 
@@ -64,58 +76,72 @@ CACHE_TTL = {
     'long': 3600    # 1 hour
 }
 
+# Session key remembering the signed-in user's id, so home() can batch its reads
+USER_ID_SESSION_KEY = 'user_ref'
+
+# Company search: most results shown, autocomplete suggestions, longest query kept
+SEARCH_LIMIT = 50
+AUTOCOMPLETE_LIMIT = 10
+MAX_QUERY_LENGTH = 100
+
+# Cached reads; key spaces, TTLs and invalidation are declared in app/cache.py
+db_cache = DatabaseCache(cache_manager, repository, CACHE_TTL)
+
+def _interview_statistics(company_id, positions):
+    return aggregate_interview_statistics(repository.interviews, company_id, positions)
+
+def _rating_average(company_id):
+    return aggregate_rating_average(repository.reviews, company_id)
+
+cached_interview_statistics = db_cache.cached_statistic(
+    "interview_stats", CACHE_TTL['long'], _interview_statistics
+)
+cached_rating_average = db_cache.cached_statistic(
+    "rating_avg", CACHE_TTL['long'], _rating_average
+)
+
 # =============================================================================
 # HELPER FUNCTIONS - Optimized with better caching and error handling
 # =============================================================================
 
-def get_current_user_info():
+def get_user_reviews_page(user_id, offset, per_page):
     """
-    Get current user info, works with both real OAuth and mock auth.
+    Get one page of the reviews created by a user, with caching.
+    
+    Only the requested page is read from MongoDB, so page N costs the same
+    as page 1.
     
+    Args:
+        user_id (str): User's MongoDB ObjectId as string
+        offset (int): Number of reviews to skip
+        per_page (int): Page size
+        
     Returns:
-        dict: User info dictionary with email, name, etc.
+        list: Review documents written by the user, newest first
     """
-    use_mock_auth = os.environ.get('USE_MOCK_AUTH', '').lower() == 'true'
-    
-    if use_mock_auth:
-        from app.mock_auth import get_mock_user_info
-        return get_mock_user_info()
-    else:
-        if google.authorized:
-            return google.get("/oauth2/v1/userinfo").json()
-        return {}
+    try:
+        return db_cache.find_user_reviews_page(user_id, offset, per_page)
+        
+    except Exception as e:
+        logger.error(f"Error fetching user reviews for {user_id}: {e}")
+        return []
 
-def get_user_reviews(user_id):
+def count_user_reviews(user_id):
     """
-    Get reviews created by a specific user with optimized caching.
+    Count the reviews created by a user, with caching.
     
     Args:
         user_id (str): User's MongoDB ObjectId as string
         
     Returns:
-        list: List of company documents containing user's reviews
+        int: Number of reviews
     """
-    cache_key = f"user_reviews:{user_id}"
-    
     try:
-        cached_result = client.get(cache_key)
-        if cached_result is not None:
-            return cached_result
-            
-        # Optimized query with proper projection
-        reviews = list(
-            ct.find(
-                {'reviews.user': user_id},
-                {'reviews': {'$elemMatch': {'user': user_id}}, '_id': 1, 'company': 1}
-            ).sort('last_modified', -1)
-        )
-        
-        client.set(cache_key, reviews, CACHE_TTL['medium'])
-        return reviews
+        return db_cache.count_user_reviews(user_id)
         
     except Exception as e:
-        logger.error(f"Error fetching user reviews for {user_id}: {e}")
-        return []
+        logger.error(f"Error counting user reviews for {user_id}: {e}")
+        return 0
 
 def get_user_by_email(email):
     """
@@ -130,48 +156,171 @@ def get_user_by_email(email):
     if not email:
         return None
         
-    cache_key = f"user:{email}"
-    
     try:
-        cached_user = client.get(cache_key)
-        if cached_user is not None:
-            return cached_user
-            
-        user = ct.find_one({'email': email})
-        if user:
-            client.set(cache_key, user, CACHE_TTL['medium'])
-            
-        return user
+        return db_cache.find_user_by_email(email)
         
     except Exception as e:
         logger.error(f"Error fetching user by email {email}: {e}")
         return None
 
-def get_all_companies_with_reviews():
+def get_user_and_reviews_page(email, offset, per_page):
     """
-    Get all companies that have reviews with optimized caching.
+    Get a user document together with one page of the user's reviews.
     
+    Once the user's id is known in the session the user, the review count
+    and the page are read with a single memcached get_many; misses fall
+    back to the individual helpers.
+    
+    Args:
+        email (str): User email address
+        offset (int): Number of reviews to skip
+        per_page (int): Page size
+        
     Returns:
-        list: List of company documents with reviews
+        tuple: (user document or None, reviews on the page, total reviews)
+    """
+    user = reviews_page = total = None
+    known = session.get(USER_ID_SESSION_KEY) or {}
+    
+    if known.get('email') == email:
+        try:
+            user, total, reviews_page = cache_manager.get_many([
+                ('user_by_email', {'email': email}),
+                ('user_review_count', {'user_id': known['id']}),
+                ('user_reviews_page', {'user_id': known['id'], 'offset': offset, 'limit': per_page})
+            ])
+        except Exception as e:
+            logger.error(f"Error batch-reading cache for {email}: {e}")
+        if user is not None and str(user['_id']) != known['id']:
+            total = reviews_page = None
+    
+    if user is None:
+        user = get_user_by_email(email)
+    if user is None:
+        return None, [], 0
+    
+    user_id = str(user['_id'])
+    session[USER_ID_SESSION_KEY] = {'email': email, 'id': user_id}
+    if total is None:
+        total = count_user_reviews(user_id)
+    if reviews_page is None:
+        reviews_page = get_user_reviews_page(user_id, offset, per_page) if total else []
+    return user, reviews_page, total
+
+def bump_company_listing_version():
+    """Invalidate every cached company listing page and the cached count."""
+    invalidate_company_cache(None)
+
+def count_companies_with_reviews():
     """
-    cache_key = "companies_with_reviews"
+    Count companies that have at least one review, cached per listing generation.
     
+    Returns:
+        int: Number of reviewed companies
+    """
     try:
-        cached_companies = client.get(cache_key)
-        if cached_companies is not None:
-            return cached_companies
-            
-        companies = list(
-            ct.find(
-                {'reviews': {'$exists': True, '$not': {'$size': 0}}}
-            ).sort('last_modified', -1)
-        )
+        return db_cache.count_reviewed_companies()
+        
+    except Exception as e:
+        logger.error(f"Error counting companies with reviews: {e}")
+        return 0
+
+def get_companies_page(offset, per_page):
+    """
+    Get a single page of reviewed companies for the listing.
+    
+    Only the current page is fetched from MongoDB, with a lean projection
+    (name, review count, last_modified). Each page is cached under its own key.
+    
+    Args:
+        offset (int): Number of companies to skip
+        per_page (int): Page size
+        
+    Returns:
+        list: Company listing rows ordered by most recently modified
+    """
+    try:
+        return db_cache.find_companies_page(offset, per_page)
+        
+    except Exception as e:
+        logger.error(f"Error fetching companies page at offset {offset}: {e}")
+        return []
+
+def search_companies(query):
+    """
+    Find companies by name with caching.
+    
+    Whole words go through the text index; when they match nothing the
+    query is tried as a name prefix, so partial words still find companies.
+    
+    Args:
+        query (str): Search text as typed
+        
+    Returns:
+        list: Matching companies (name and review count), best first
+    """
+    normalized = repository.normalize_company_name(query)[:MAX_QUERY_LENGTH]
+    if not normalized:
+        return []
+        
+    try:
+        results = db_cache.search_companies(normalized, SEARCH_LIMIT)
+    except Exception as e:
+        # e.g. the text index hasn't been created yet
+        logger.error(f"Error searching companies for '{normalized}': {e}")
+        results = []
+    return with_review_counts(results) if results else autocomplete_companies(normalized, SEARCH_LIMIT)
+
+def with_review_counts(companies):
+    """
+    Copy search results with each company's current review count.
+    
+    Counts come from the cached company entries, which every review write
+    clears, and in one query for the companies that aren't cached.
+    
+    Args:
+        companies (list): Cached search or autocomplete results
+        
+    Returns:
+        list: The same companies with review_count set
+    """
+    if not companies:
+        return []
+    ids = [str(company['_id']) for company in companies]
+    try:
+        entries = cache_manager.get_many([('company', {'company_id': company_id}) for company_id in ids])
+        counts = {
+            company_id: entry.get('review_count', 0)
+            for company_id, entry in zip(ids, entries) if entry is not None
+        }
+        missing = [company_id for company_id in ids if company_id not in counts]
+        if missing:
+            counts.update(repository.find_review_counts(missing))
+    except Exception as e:
+        logger.error(f"Error reading review counts of {len(ids)} companies: {e}")
+        counts = {}
+    return [dict(company, review_count=counts.get(company_id, 0)) for company_id, company in zip(ids, companies)]
+
+def autocomplete_companies(prefix, limit=AUTOCOMPLETE_LIMIT):
+    """
+    Suggest companies whose name starts with a prefix, cached per prefix.
+    
+    Args:
+        prefix (str): Beginning of a company name as typed
+        limit (int): Most suggestions
+        
+    Returns:
+        list: Companies (name and review count) ordered by name
+    """
+    normalized = repository.normalize_company_name(prefix)[:MAX_QUERY_LENGTH]
+    if not normalized:
+        return []
         
-        client.set(cache_key, companies, CACHE_TTL['short'])
-        return companies
+    try:
+        return with_review_counts(db_cache.find_companies_by_prefix(normalized, max(1, limit)))
         
     except Exception as e:
-        logger.error(f"Error fetching companies with reviews: {e}")
+        logger.error(f"Error completing company names for '{normalized}': {e}")
         return []
 
 def get_company_by_id(company_id):
@@ -182,125 +331,118 @@ def get_company_by_id(company_id):
         company_id (str): Company's MongoDB ObjectId as string
         
     Returns:
-        dict|None: Company document or None if not found
+        dict|None: Company document (header and counters) or None if not found
     """
     if not company_id:
         return None
         
-    cache_key = f"company:{company_id}"
-    
     try:
-        cached_company = client.get(cache_key)
-        if cached_company is not None:
-            return cached_company
-            
-        company = ct.find_one({'_id': ObjectId(company_id)})
-        if company:
-            client.set(cache_key, company, CACHE_TTL['medium'])
-            
-        return company
+        return db_cache.find_company(company_id)
         
     except Exception as e:
         logger.error(f"Error fetching company {company_id}: {e}")
         return None
 
+def get_company_reviews_page(company_id, offset, per_page):
+    """
+    Get one page of a company's reviews with caching.
+    
+    Args:
+        company_id (str): Company's MongoDB ObjectId as string
+        offset (int): Number of reviews to skip
+        per_page (int): Page size
+        
+    Returns:
+        list: Review documents in the order they were written
+    """
+    try:
+        return db_cache.find_company_reviews_page(company_id, offset, per_page)
+    except Exception as e:
+        logger.error(f"Error fetching reviews for company {company_id}: {e}")
+        return []
+
 def calculate_interview_statistics(positions, company_data):
     """
-    Calculate interview statistics without pandas - pure Python optimization.
+    Calculate interview win percentages from the materialized counters.
+    
+    Runs in O(positions x ethnicities) and never loads raw interviews.
     
     Args:
         positions (list): List of position tuples
-        company_data (dict): Company document with interview data
+        company_data (dict): Company document with ``interview_counts``
         
     Returns:
         list: Interview statistics by position and ethnicity
     """
-    cache_key = f"interview_stats:{company_data['_id']}"
-    
     try:
-        cached_stats = client.get(cache_key)
-        if cached_stats is not None:
-            return cached_stats
-            
-        win_statistics = []
-        
-        for position_key, position_name in positions:
-            if position_key not in company_data:
-                continue
-                
-            interviews = company_data[position_key]
-            if not interviews:
-                continue
-                
-            # Group by ethnicity using pure Python
-            ethnicity_groups = defaultdict(list)
-            for interview in interviews:
-                ethnicity = interview.get('user_ethnicity', 'Unknown')
-                ethnicity_groups[ethnicity].append(interview.get('win'))
-            
-            # Calculate win percentages
-            for ethnicity, outcomes in ethnicity_groups.items():
-                if not outcomes:
-                    continue
-                    
-                total_interviews = len(outcomes)
-                win_counts = Counter(outcomes)
-                
-                win_percentages = {
-                    'y': int((win_counts.get('y', 0) / total_interviews) * 100),
-                    'n': int((win_counts.get('n', 0) / total_interviews) * 100),
-                    'o': int((win_counts.get('o', 0) / total_interviews) * 100)
-                }
-                
-                win_statistics.append([position_name, ethnicity, win_percentages])
-        
-        client.set(cache_key, win_statistics, CACHE_TTL['long'])
-        return win_statistics
+        return statistics_from_counts(positions, company_data.get('interview_counts') or {})
         
     except Exception as e:
         logger.error(f"Error calculating interview statistics: {e}")
         return []
 
-def invalidate_user_cache(user_id=None, email=None):
+def get_aggregated_interview_statistics(positions, company_id):
+    """
+    Get interview statistics computed by a MongoDB aggregation, with caching.
+    
+    Args:
+        positions (list): List of position tuples
+        company_id (str): Company's MongoDB ObjectId as string
+        
+    Returns:
+        list: Interview statistics by position and ethnicity
+    """
+    try:
+        return cached_interview_statistics(company_id, positions)
+        
+    except Exception as e:
+        logger.error(f"Error aggregating interview statistics for {company_id}: {e}")
+        return []
+
+def get_aggregated_rating_average(company_id):
+    """
+    Get a company's mean rating computed by a MongoDB aggregation, with caching.
+    
+    Args:
+        company_id (str): Company's MongoDB ObjectId as string
+        
+    Returns:
+        float: Average rating or 0 if no reviews
+    """
+    try:
+        return cached_rating_average(company_id)
+        
+    except Exception as e:
+        logger.error(f"Error aggregating rating average for {company_id}: {e}")
+        return 0.0
+
+def invalidate_user_cache(user_id=None, email=None, deferred=False):
     """
-    Invalidate user-related cache entries.
+    Invalidate user-related cache entries when the request finishes.
     
     Args:
         user_id (str, optional): User's MongoDB ObjectId as string
         email (str, optional): User email address
+        deferred (bool): Wait until the response has been sent
     """
     try:
-        cache_keys = []
-        if user_id:
-            cache_keys.extend([
-                f"user_reviews:{user_id}",
-                f"user:{user_id}"
-            ])
-        if email:
-            cache_keys.append(f"user:{email}")
-            
-        for key in cache_keys:
-            client.delete(key)
+        cache_manager.invalidate('user', deferred=deferred, user_id=user_id, email=email)
             
     except Exception as e:
         logger.error(f"Error invalidating user cache: {e}")
 
-def invalidate_company_cache(company_id):
+def invalidate_company_cache(company_id, deferred=False):
     """
-    Invalidate company-related cache entries.
+    Invalidate company-related cache entries and the company listing when
+    the request finishes.
     
     Args:
-        company_id (str): Company's MongoDB ObjectId as string
+        company_id (str|None): Company's MongoDB ObjectId as string, or None
+            when only the listing changed
+        deferred (bool): Wait until the response has been sent
     """
     try:
-        cache_keys = [
-            f"company:{company_id}",
-            f"interview_stats:{company_id}",
-            "companies_with_reviews"
-        ]
-        
-        for key in cache_keys:
-            client.delete(key)
+        cache_manager.invalidate('company', deferred=deferred, company_id=company_id)
             
     except Exception as e:
         logger.error(f"Error invalidating company cache: {e}")
@@ -344,14 +486,12 @@ def google_logged_in(blueprint, token):
         return False
 
     try:
-        # Get user info from Google
-        resp = blueprint.session.get("/oauth2/v1/userinfo")
-        if not resp.ok:
-            logger.error(f"Failed to fetch Google user info: {resp.status_code}")
+        # Get user info from Google once; it stays in the session until the token expires
+        user_info = fetch_identity(blueprint.session, token)
+        if user_info is None:
             flash("Failed to retrieve user information.", category="error")
             return False
 
-        user_info = resp.json()
         email = user_info.get('email')
         
         if not email:
@@ -373,17 +513,13 @@ def google_logged_in(blueprint, token):
                 'verified_email': user_info.get('verified_email', False)
             }
             
-            result = ct.insert_one(user_data)
-            user = ct.find_one({'_id': result.inserted_id})
+            user = repository.create_user(user_data)
             
             # Update cache
-            client.set(f"user:{email}", user, CACHE_TTL['medium'])
+            cache_manager.set("user_by_email", user, email=email)
         else:
             # Update existing user's last login
-            ct.update_one(
-                {'_id': user['_id']},
-                {'$set': {'last_login': datetime.now()}}
-            )
+            repository.set_last_login(user['_id'])
             # Invalidate cache to force refresh
             invalidate_user_cache(email=email)
 
@@ -412,42 +548,6 @@ def google_error(blueprint, message, response):
     logger.error(f"{error_msg}. Response: {response}")
     flash("Authentication failed. Please try again.", category="error")
 
-def find_reviews():
-    z="find_reviews"
-    querykey=client.get(z)
-    if querykey == None:
-        querykey=list(ct.find({'reviews': {"$exists": True}}).sort('last_modified',-1))
-        client.set(z, querykey)
-    return querykey
-
-
-def findone_company(c):
-    querykey=client.get(c)
-    if querykey == None:
-        querykey=ct.find_one({'_id': ObjectId(c)})
-        client.set(c,querykey)
-    return querykey
-
-def pd_interviews(p,singlecompany):
-    querykey=client.get(str(singlecompany['_id'])+"_pd_interviews")
-    if querykey == None:
-        winDict=[]
-        wintype={}
-        for j in p:
-            if j[0] in singlecompany:
-                df=pd.DataFrame(singlecompany[j[0]])
-                grouped=df.groupby('user_ethnicity')
-
-                for key,value in grouped:
-                    for i in ['y','n','o']:
-                        wintype[i]=int(((value['win']==i).sum()/len(grouped.apply(lambda x: x[x['user_ethnicity']==key]).index))*100)
-
-                    winDict.append([j[1],key,wintype.copy()])
-                    wintype.clear()
-        querykey=winDict
-        client.set(str(singlecompany['_id'])+"_pd_interviews",querykey)
-    return querykey
-
 # =============================================================================
 # PAGINATION UTILITIES - Optimized and consolidated
 # =============================================================================
@@ -471,22 +571,23 @@ def get_pagination(**kwargs):
         **kwargs
     )
 
-def calculate_rating_average(reviews):
+def calculate_rating_average(company_data):
     """
-    Calculate average rating without pandas - pure Python optimization.
+    Get a company's average rating from its precomputed rating counters.
+    
+    Companies without counters fall back to the cached aggregation.
     
     Args:
-        reviews (list): List of review objects
+        company_data (dict): Company document with ``rating_sum``/``rating_count``
         
     Returns:
         float: Average rating or 0 if no reviews
     """
-    if not reviews:
-        return 0.0
-        
     try:
-        ratings = [review.get('rating', 0) for review in reviews if review.get('rating')]
-        return mean(ratings) if ratings else 0.0
+        rating_avg = rating_average_from_counters(company_data)
+        if rating_avg is None:
+            return get_aggregated_rating_average(str(company_data['_id']))
+        return rating_avg
     except Exception as e:
         logger.error(f"Error calculating rating average: {e}")
         return 0.0
@@ -508,9 +609,10 @@ def index():
             # In mock mode, show login link
             return render_template('index.html', mock_auth=True)
         else:
-            # Real OAuth mode
+            # Real OAuth mode; only resolve the identity upstream on first visit
             if google.authorized:
-                google_logged_in(blueprint, google.token)
+                if not session.get(IDENTITY_SESSION_KEY):
+                    google_logged_in(blueprint, google.token)
                 return redirect(url_for("main.home"))
             return render_template('index.html', mock_auth=False)
     except Exception as e:
@@ -536,33 +638,18 @@ def home():
             flash("Authentication error. Please log in again.", category="error")
             return redirect(url_for("google.login"))
         
-        # Get user with caching
-        user = get_user_by_email(email)
+        page, per_page, offset = get_page_args(
+            page_parameter="p", per_page_parameter="pp", pp=10)
+        per_page = per_page or 10
+        
+        # Get the user and one page of their reviews with one batched cache read
+        user, user_reviews, total_reviews = get_user_and_reviews_page(email, offset, per_page)
         
         if user is not None:
-            # Pagination setup
-            page, per_page, offset = get_page_args(
-                page_parameter="p", per_page_parameter="pp", pp=10)
-
-            # Get user's reviews with optimized caching
-            user_reviews = get_user_reviews(str(user['_id']))
-            
-            # Process reviews for display
-            review_results = []
-            for company_doc in user_reviews:
-                for review in company_doc.get('reviews', []):
-                    review_results.append((
-                        review,
-                        company_doc['_id'],
-                        company_doc['company']
-                    ))
-
-            # Apply pagination
-            if per_page:
-                total_reviews = len(review_results)
-                review_results = review_results[offset:offset + per_page]
-            else:
-                total_reviews = len(review_results)
+            review_results = [
+                (review, review['company_id'], review['company'])
+                for review in user_reviews
+            ]
 
             # Set form defaults with better fallbacks
             form.gender.default = user.get('gender', 'Unspecified')
@@ -592,9 +679,6 @@ def home():
             )
         else:
             # New user - show empty state
-            page, per_page, offset = get_page_args(
-                page_parameter="p", per_page_parameter="pp", pp=10)
-                
             pagination = get_pagination(
                 p=page,
                 pp=per_page,
@@ -615,8 +699,8 @@ def home():
                 form=form
             )
             
-    except Exception as e:
-        logger.error(f"Error in home route: {e}", exc_info=True)
+    except Exception as err:
+        logger.error(f"Error in home route: {err}", exc_info=True)
         flash("An error occurred loading your profile.", category="error")
         return redirect(url_for("main.index"))
 @bp.route('/company', methods=['GET'])
@@ -630,13 +714,9 @@ def company():
         page, per_page, offset = get_page_args(
             page_parameter="p", per_page_parameter="pp", pp=10)
         
-        # Get companies with optimized caching
-        companies = get_all_companies_with_reviews()
-        
-        # Apply pagination
-        total_companies = len(companies)
-        if per_page:
-            companies = companies[offset:offset + per_page]
+        # Fetch only the requested page; the total is cached separately
+        total_companies = count_companies_with_reviews()
+        companies = get_companies_page(offset, per_page or 10)
 
         pagination = get_pagination(
             p=page,
@@ -666,6 +746,47 @@ def company():
             form=MyCompany()
         )
 
+@bp.route('/company/search', methods=['GET'])
+@login_required
+def company_search():
+    """
+    Company search results, in place of the listing.
+    """
+    query = request.args.get('q', '').strip()
+    companies = search_companies(query)
+    pagination = get_pagination(
+        p=1,
+        pp=max(len(companies), 1),
+        total=len(companies),
+        page_parameter="p",
+        per_page_parameter="pp",
+        record_name='companies'
+    )
+    return render_template(
+        'company.html',
+        companies=companies,
+        pagination=pagination,
+        form=MyCompany(),
+        query=query
+    )
+
+@bp.route('/api/companies/autocomplete', methods=['GET'])
+@login_required
+def company_autocomplete():
+    """Company name suggestions for the search box, as JSON."""
+    try:
+        limit = int(request.args.get('limit', AUTOCOMPLETE_LIMIT))
+    except ValueError:
+        limit = AUTOCOMPLETE_LIMIT
+    suggestions = autocomplete_companies(request.args.get('q', ''), min(limit, AUTOCOMPLETE_LIMIT))
+    response = jsonify([
+        {'id': str(company['_id']), 'name': company['company'], 'review_count': company.get('review_count', 0)}
+        for company in suggestions
+    ])
+    # Lets the browser reuse suggestions while the user edits the same prefix
+    response.headers['Cache-Control'] = 'private, max-age=60'
+    return response
+
 @bp.route('/company', methods=['POST', 'PUT'])
 @login_required
 def company_post():
@@ -679,8 +800,8 @@ def company_post():
             flash('All fields are required.', category='error')
             return redirect(request.url)
         
-        # Get user info from Google OAuth
-        resp = google.get("/oauth2/v1/userinfo").json()
+        # Get user info (works with both OAuth and mock)
+        resp = get_current_user_info()
         email = resp.get('email')
         
         if not email:
@@ -712,26 +833,17 @@ def company_post():
             flash('Invalid rating value.', category='error')
             return redirect(request.url)
         
-        # Create company document
-        company_doc = {
-            'created': datetime.now(),
-            'last_modified': datetime.now(),
-            'company': company_name,
-            'reviews': [{
-                '_id': str(ObjectId()),
-                'review': review_text,
-                'rating': rating,
-                'user': str(user['_id']),
-                'created': datetime.now()
-            }]
-        }
-        
-        # Insert into database
-        result = ct.insert_one(company_doc)
+        # Create the company together with its first review
+        repository.create_company(company_name, {
+            'review': review_text,
+            'rating': rating,
+            'user': str(user['_id'])
+        })
         
         # Invalidate relevant caches
-        invalidate_user_cache(user_id=str(user['_id']))
-        client.delete("companies_with_reviews")
+        invalidate_user_cache(user_id=str(user['_id']), deferred=True)
+        bump_company_listing_version()
+        cache_manager.invalidate('company_names')
         
         logger.info(f"New company created: {company_name} by {email}")
         flash('Company review added successfully!', category='success')
@@ -767,21 +879,20 @@ def single_company(company_id):
         page, per_page, offset = get_page_args(
             page_parameter="p", per_page_parameter="pp", pp=10)
 
-        # Get reviews for pagination
-        reviews = company_data.get('reviews', [])
-        total_reviews = len(reviews)
-        
-        # Apply pagination to reviews
-        if per_page:
-            paginated_reviews = reviews[offset:offset + per_page]
+        # Only the requested page of reviews is fetched; the total comes
+        # from the company's review counter
+        per_page = per_page or 10
+        total_reviews = company_data.get('review_count', 0)
+        paginated_reviews = get_company_reviews_page(company_id, offset, per_page) if total_reviews else []
+
+        # Statistics come from MongoDB aggregations or from the company's
+        # precomputed counters, depending on the configured backend
+        if current_app.config.get('STATS_BACKEND') == 'aggregation':
+            rating_avg = get_aggregated_rating_average(company_id)
+            interview_stats = get_aggregated_interview_statistics(p, company_id)
         else:
-            paginated_reviews = reviews
-
-        # Calculate rating average without pandas
-        rating_avg = calculate_rating_average(reviews)
-        
-        # Calculate interview statistics without pandas
-        interview_stats = calculate_interview_statistics(p, company_data)
+            rating_avg = calculate_rating_average(company_data)
+            interview_stats = calculate_interview_statistics(p, company_data)
             
         pagination = get_pagination(
             p=page,
@@ -819,64 +930,42 @@ def single_company(company_id):
 def single_companypost(company_id):
     form = MyCompany()
     form1 = MyInterview()
-    resp = google.get("/oauth2/v1/userinfo").json()
-    user = find_email(resp['email'])
+    resp = get_current_user_info()
+    user = get_user_by_email(resp.get('email'))
     if form.validate_on_submit() and user:
-        ct.update_one(
-            {'_id': ObjectId(company_id)},
+        added = repository.add_review(
+            company_id,
             {
-                '$push':
-                {
-                    'reviews':
-                    {
-                        '_id': str(ObjectId()),
-                        'review': request.form.get('reviews'),
-                        'rating': int(request.form.get('rating')),
-                        'user': str(user['_id']),
-                        'gender':user['gender'],
-                        'location':user['location'],
-                        'ethnicity':user['ethnicity']
-                    },
-
-                },
-            },
-            upsert=True
+                'review': request.form.get('reviews'),
+                'rating': int(request.form.get('rating')),
+                'user': str(user['_id']),
+                'gender':user['gender'],
+                'location':user['location'],
+                'ethnicity':user['ethnicity']
+            }
         )
+        if not added:
+            return render_template('error.html', error="company not found")
 
-        updatedcompany=ct.find_one_and_update({'_id': ObjectId(company_id)},{'$set': 
-        {'last_modified': datetime.now()}},return_document=ReturnDocument.AFTER)
-        
-        userreviews=str(user['_id'])+"_reviews"
-        r = find_creatorreviews(user)
-
-        client.replace(userreviews,r)
-        client.replace(company_id,updatedcompany)
+        invalidate_user_cache(user_id=str(user['_id']), deferred=True)
+        invalidate_company_cache(company_id)
     elif form1.validate_on_submit() and user:
-        updatedcompany=ct.find_one_and_update(
-            {'_id': ObjectId(company_id)},
+        recorded = repository.record_interview(
+            company_id,
+            request.form.get('position'),
             {
-                '$push':
-                {
-                    request.form.get('position'):
-                    {
-                        '_id': str(ObjectId()),
-                        'employee': request.form.get('employee'),
-                        'user': str(user['_id']),
-                        'user_gender':user['gender'],
-                        'user_ethnicity':user['ethnicity'],
-                        'user_location':user['location'],
-                        'win': request.form.get('win')
-                    }
-                },
-                '$set': {'last_modified': datetime.now()}
-            },
-            upsert=True,return_document=ReturnDocument.AFTER
+                'employee': request.form.get('employee'),
+                'user': str(user['_id']),
+                'user_gender':user['gender'],
+                'user_ethnicity':user['ethnicity'],
+                'user_location':user['location'],
+                'win': request.form.get('win')
+            }
         )
+        if not recorded:
+            return render_template('error.html', error="company not found")
 
-        winDict=pd_interviews(p,updatedcompany)
-
-        client.replace(company_id,updatedcompany)
-        client.replace(company_id+"_pd_interviews",winDict)
+        invalidate_company_cache(company_id)
     else:
         return render_template('error.html', error="Something went wrong.  Make sure you complete your profile!")
     return redirect(request.url)
@@ -898,45 +987,39 @@ def single_person(person_id):
 def singleupdate_person(person_id):
     form = MyPerson()
     if form.validate_on_submit():
-        updateduser=ct.find_one_and_update(
-            {'_id': ObjectId(person_id)},
+        updateduser=repository.update_user_profile(
+            person_id,
             {
-                '$set': {
-                    'name': request.form.get('name'),
-                    'gender': request.form.get('gender'),
-                    'age': request.form.get('age') or '18-24',
-                    'ethnicity': request.form.get('ethnicity') or 'Unknown',
-                    'location': request.form.get('location') or 'GA',
-                    "last_modified": datetime.now()}
-            }, return_document=ReturnDocument.AFTER
-        )
-        ct.update_one(
-            {'interviews.user': person_id},
-            {
-                '$set': {
-                    'user_gender': request.form.get('gender'),
-                    'user_location': request.form.get('location'),
-                    'user_ethnicity': request.form.get('ethnicity')
-                }
-            }
-        )
-        ct.update_one(
-            {'reviews.user': person_id},
-            {
-                '$set': {
-                    'gender': request.form.get('gender'),
-                    'location': request.form.get('location'),
-                    'ethnicity': request.form.get('ethnicity')
-                }
+                'name': request.form.get('name'),
+                'gender': request.form.get('gender'),
+                'age': request.form.get('age') or '18-24',
+                'ethnicity': request.form.get('ethnicity') or 'Unknown',
+                'location': request.form.get('location') or 'GA'
             }
         )
+        if updateduser is None:
+            return render_template('error.html', error="person not found")
+        # Copy the demographics onto the user's reviews and interviews in a
+        # background job; affected company statistics are invalidated as it goes
+        submit_profile_fanout(person_id)
 
-        client.replace(updateduser['email'], updateduser)
+        invalidate_user_cache(user_id=person_id, email=updateduser['email'])
         return redirect(url_for('main.home'))
     else:
         return render_template('error.html', error="The form was not valid")
 
 
+@bp.route('/person/<person_id>/fanout', methods=['GET'])
+@login_required
+def person_fanout_progress(person_id):
+    """Progress of the background profile update, as JSON."""
+    resp = get_current_user_info()
+    user = get_user_by_email(resp.get('email'))
+    if not user or str(user['_id']) != person_id:
+        return jsonify({'error': 'not found'}), 404
+    return jsonify(get_fanout_progress(person_id) or {'state': 'idle'})
+
+
 @bp.route('/person', methods=['GET'])
 @login_required
 def person():
@@ -947,17 +1030,20 @@ def person():
 @login_required
 def person_post():
     form = MyPerson()
-    resp = google.get("/oauth2/v1/userinfo").json()
-    if form.validate_on_submit():
-        x=ct.insert_one(
-            {'created': datetime.now(),
-            '_id': ObjectId(), 
-            'name': request.form.get('name'), 
-            'email': resp['email'],
+    resp = get_current_user_info()
+    if form.validate_on_submit() and resp.get('email'):
+        # Login already created the user; emails are unique, so update it in place
+        user = repository.save_profile_by_email(
+            resp['email'],
+            {'name': request.form.get('name'),
             'ethnicity': request.form.get('ethnicity'),
             'gender': request.form.get('gender'),
             'location': request.form.get('location'),
             'age': request.form.get('age')})
+        user_id = str(user['_id'])
+        invalidate_user_cache(user_id=user_id, email=resp['email'])
+        # Reviews written before the profile was completed get the new demographics
+        submit_profile_fanout(user_id)
         return redirect(url_for('main.home'))
     else:
         return render_template('error.html', error="Form wasn't valid")
@@ -966,34 +1052,27 @@ def person_post():
 @bp.route('/forgetme/<user>')
 @login_required
 def forgetme(user):
-    resp = google.get("/oauth2/v1/userinfo").json()
-    if find_email(resp['email']):
-        ct.update(
-            {'reviews.user': user}, 
-            {'$pull': {'reviews': {'user': user}}}
-        )
-        ct.update(
-            {'interviews.user': user}, 
-            {'$pull': {'interviews': {'user': user}}}
-        )
-        ct.remove(
-            {'_id': ObjectId(user)} 
-        )
-        client.delete_multi([str(user)+"_reviews"],resp['email'])
+    resp = get_current_user_info()
+    account = get_user_by_email(resp.get('email'))
+    if account and str(account['_id']) == user:
+        # The profile goes now; reviews, interviews and company counters
+        # follow in a background job
+        submit_erasure(user)
+        invalidate_user_cache(user_id=user, email=resp['email'])
+        session.pop(USER_ID_SESSION_KEY, None)
     return redirect(url_for('main.home'))
 
 
 @bp.route('/deletereview/<id>')
 @login_required
 def deletereview(id):
-    resp = google.get("/oauth2/v1/userinfo").json()
-    user = find_email(resp['email'])
-    if user and ct.find_one({'reviews.user': str(user['_id'])}):
-        ct.update(
-            {'reviews._id': id}, 
-            {'$pull': {'reviews': {'_id': id}}}
-        )
-        client.delete_multi([str(user['_id'])+"_reviews", resp['email']])
+    resp = get_current_user_info()
+    user = get_user_by_email(resp.get('email'))
+    if user:
+        review = repository.delete_review(id, str(user['_id']))
+        if review is not None:
+            invalidate_user_cache(user_id=str(user['_id']))
+            invalidate_company_cache(str(review['company_id']), deferred=True)
     return redirect(url_for('main.home'))
 
 
@@ -1001,5 +1080,7 @@ def deletereview(id):
 @login_required
 def logout():
     logout_user()
+    forget_identity()
+    session.pop(USER_ID_SESSION_KEY, None)
     flash("You have logged out")
     return render_template('bye.html')
\ No newline at end of file
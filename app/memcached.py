@@ -0,0 +1,327 @@
+"""
+memcached client construction for ChoosyTable
+MEMCACHED_HOST takes one server or a comma-separated list. A single server
+gets a PooledClient; several are combined with pymemcache's HashClient, which
+spreads keys over the nodes by rendezvous hashing and, when a node stops
+answering, marks it dead so its keys move to the remaining nodes.
+
+A few keys are read by nearly every request (the company listing). With
+several nodes they can be replicated: each write goes to ``replicas`` copies
+under different keys, which hash independently and so usually land on
+different nodes, and each read picks one copy at random. The load of a hot key
+is spread and losing one node doesn't turn it into a miss for everybody.
+
+memcached refuses items larger than its item size limit (1MB by default), and
+with noreply writes the refusal is never even seen. Values whose encoded size
+is above CACHE_CHUNK_SIZE are split into chunks so they keep being cached.
+"""
+
+import logging
+import math
+import random
+import secrets
+import threading
+from typing import Any, Callable, Dict, Iterable, List, Optional, Tuple
+
+from pymemcache.client.base import PooledClient
+from pymemcache.client.hash import HashClient
+
+from .cache import KEY_PREFIX
+from .metrics import key_namespace
+from .serde import FLAG_CHUNK, FLAG_MANIFEST, ChunkManifest, Serialized
+
+logger = logging.getLogger(__name__)
+
+REPLICA_SEPARATOR = "~r"
+CHUNK_SEPARATOR = "~c"
+
+
+def parse_servers(value: str) -> List[Tuple[str, int]]:
+    """'host1:11211,host2' -> [('host1', 11211), ('host2', 11211)]"""
+    servers = []
+    for server in value.split(','):
+        server = server.strip()
+        if not server:
+            continue
+        host, _, port = server.rpartition(':') if ':' in server else (server, '', '11211')
+        servers.append((host, int(port)))
+    if not servers:
+        raise ValueError("MEMCACHED_HOST must name at least one server")
+    return servers
+
+
+def make_memcached_client(servers: List[Tuple[str, int]], serde, max_pool_size: int = None,
+                          pool_idle_timeout: int = 0, connect_timeout: float = None,
+                          timeout: float = None, no_delay: bool = False, dead_retry_attempts: int = 2,
+                          dead_retry_timeout: float = 1, dead_timeout: float = 60):
+    """
+    A PooledClient for one server, or a HashClient over several.
+
+    Args:
+        dead_retry_attempts: Failed calls within ``dead_retry_timeout``
+            seconds after which HashClient marks a node dead
+        dead_timeout: Seconds before a dead node is tried again
+    """
+    options = dict(
+        serde=serde, max_pool_size=max_pool_size, pool_idle_timeout=pool_idle_timeout,
+        connect_timeout=connect_timeout, timeout=timeout, no_delay=no_delay
+    )
+    if len(servers) == 1:
+        return PooledClient(servers[0], **options)
+    return HashClient(
+        servers, use_pooling=True, retry_attempts=dead_retry_attempts,
+        retry_timeout=dead_retry_timeout, dead_timeout=dead_timeout, **options
+    )
+
+
+class ReplicatingClient:
+    """
+    Stores keys of the hot key spaces ``replicas`` times and reads one copy.
+
+    Replica 0 is the key itself, so readers that bypass this wrapper still
+    find the value. Everything else is passed through to the wrapped client.
+
+    Args:
+        client: The (hashing) client to wrap
+        hot_prefixes: Full key prefixes of the replicated key spaces,
+            e.g. 'choosytable:companies_page'
+        replicas: Copies of each hot key, including the key itself
+    """
+
+    def __init__(self, client, hot_prefixes: Iterable[str], replicas: int = 2):
+        self.client = client
+        self.hot_prefixes = tuple(hot_prefixes)
+        self.replicas = replicas
+
+    def __getattr__(self, name):
+        return getattr(self.client, name)
+
+    def is_hot(self, key: str) -> bool:
+        return any(key == prefix or key.startswith(prefix + ':') for prefix in self.hot_prefixes)
+
+    def replica_keys(self, key: str) -> List[str]:
+        return [key] + [f"{key}{REPLICA_SEPARATOR}{index}" for index in range(1, self.replicas)]
+
+    def get(self, key: str, *args, **kwargs) -> Optional[Any]:
+        if not self.is_hot(key):
+            return self.client.get(key, *args, **kwargs)
+        # Start at a random copy and fall back to the others: HashClient
+        # answers misses for a node it is retrying, and errors for one that failed
+        replicas = self.replica_keys(key)
+        first = random.randrange(len(replicas))
+        error, answered = None, False
+        for replica in replicas[first:] + replicas[:first]:
+            try:
+                value = self.client.get(replica, *args, **kwargs)
+            except Exception as e:
+                error = e
+                continue
+            if value is not None:
+                return value
+            answered = True
+        if error is not None and not answered:
+            raise error
+        return None
+
+    def get_many(self, keys: List[str]) -> Dict[str, Any]:
+        replicas = {
+            key: random.choice(self.replica_keys(key)) if self.is_hot(key) else key for key in keys
+        }
+        try:
+            found = self.client.get_many(list(replicas.values()))
+        except Exception:
+            # One failed node fails the whole batch; read key by key so the
+            # other nodes and the other copies still answer
+            return self._get_each(keys)
+        values = {key: found[replica] for key, replica in replicas.items() if replica in found}
+        for key in keys:
+            if key not in values and self.is_hot(key):
+                value = self.get(key)
+                if value is not None:
+                    values[key] = value
+        return values
+
+    get_multi = get_many
+
+    def _get_each(self, keys: List[str]) -> Dict[str, Any]:
+        values, error, answered = {}, None, False
+        for key in keys:
+            try:
+                value = self.get(key)
+            except Exception as e:
+                error = e
+                continue
+            answered = True
+            if value is not None:
+                values[key] = value
+        if error is not None and not answered:
+            raise error
+        return values
+
+    def set(self, key: str, value: Any, *args, **kwargs):
+        if not self.is_hot(key):
+            return self.client.set(key, value, *args, **kwargs)
+        expire = args[0] if args else kwargs.pop('expire', 0)
+        failed = self.client.set_many({replica: value for replica in self.replica_keys(key)}, expire, **kwargs)
+        return key not in failed
+
+    def set_many(self, values: Dict[str, Any], *args, **kwargs):
+        expanded = {}
+        for key, value in values.items():
+            for replica in (self.replica_keys(key) if self.is_hot(key) else [key]):
+                expanded[replica] = value
+        failed = self.client.set_many(expanded, *args, **kwargs)
+        return [key for key in values if key in failed]
+
+    set_multi = set_many
+
+    def delete(self, key: str, *args, **kwargs):
+        if not self.is_hot(key):
+            return self.client.delete(key, *args, **kwargs)
+        return self.client.delete_many(self.replica_keys(key), *args, **kwargs)
+
+    def delete_many(self, keys: List[str], *args, **kwargs):
+        expanded = []
+        for key in keys:
+            expanded.extend(self.replica_keys(key) if self.is_hot(key) else [key])
+        return self.client.delete_many(expanded, *args, **kwargs)
+
+    delete_multi = delete_many
+
+
+class ChunkingClient:
+    """
+    Stores values too large for one memcached item as several chunks.
+
+    The value is encoded once with the serde of the wrapped client. Payloads
+    up to ``chunk_size`` bytes are stored as usual; larger ones are split into
+    raw chunks, and a small manifest is stored under the value's own key. The
+    chunk keys include a random token kept in the manifest, so a reader never
+    joins chunks of two different writes, and a value is returned only if all
+    of its chunks are still there; otherwise the read is a miss.
+
+    Chunks are written before the manifest and expire with it. Deleting a key
+    removes the manifest only; its chunks are left to expire or be evicted.
+    Only set/set_many and get/get_many know about chunks, everything else is
+    passed through to the wrapped client.
+
+    Args:
+        client: The client to wrap
+        serde: The serde the wrapped client was built with
+        chunk_size: Largest payload stored as a single item
+        warn_size: Payloads at least this large are logged and reported to
+            the observers, once chunked or not
+        observers: Called with (namespace, size in bytes, chunks) for every
+            large payload written
+    """
+
+    def __init__(self, client, serde, chunk_size: int = 1000000, warn_size: int = 524288,
+                 observers: Iterable[Callable] = (), key_prefix: str = KEY_PREFIX):
+        self.client = client
+        self.serde = serde
+        self.chunk_size = chunk_size
+        self.warn_size = warn_size
+        self.observers = list(observers)
+        self.key_prefix = key_prefix
+        self._lock = threading.Lock()
+        self._warned = set()
+
+    def __getattr__(self, name):
+        return getattr(self.client, name)
+
+    def chunk_keys(self, key: str, manifest: ChunkManifest) -> List[str]:
+        return [f"{key}{CHUNK_SEPARATOR}{manifest.token}:{index}" for index in range(manifest.chunks)]
+
+    def _report(self, key: str, size: int, chunks: int) -> None:
+        namespace = key_namespace(key, self.key_prefix)
+        for observer in self.observers:
+            observer(namespace, size, chunks)
+        # One warning per key space and process; the metrics keep counting
+        with self._lock:
+            first = (namespace, chunks > 1) not in self._warned
+            self._warned.add((namespace, chunks > 1))
+        if first:
+            stored = f"split into {chunks} chunks" if chunks > 1 else "stored as one item"
+            logger.warning(f"Large cache value in '{namespace}': {size} bytes, {stored} (e.g. {key})")
+
+    def _split(self, key: str, value: Any) -> Tuple[Serialized, Dict[str, Serialized]]:
+        """The item to store under ``key`` and the chunks it refers to"""
+        payload, flags = self.serde.serialize(key, value)
+        if isinstance(payload, str):
+            payload = payload.encode('utf-8')
+        size = len(payload)
+        chunks = max(math.ceil(size / self.chunk_size), 1)
+        if size >= self.warn_size:
+            self._report(key, size, chunks)
+        if chunks == 1:
+            return Serialized(payload, flags), {}
+
+        manifest = ChunkManifest(secrets.token_hex(4), chunks, flags, size)
+        parts = {
+            chunk_key: Serialized(payload[index * self.chunk_size:(index + 1) * self.chunk_size], FLAG_CHUNK)
+            for index, chunk_key in enumerate(self.chunk_keys(key, manifest))
+        }
+        return Serialized(manifest.encode(), FLAG_MANIFEST), parts
+
+    def _join(self, key: str, manifest: ChunkManifest, found: Dict[str, Any]) -> Optional[Any]:
+        parts = [found.get(chunk_key) for chunk_key in self.chunk_keys(key, manifest)]
+        if any(part is None for part in parts):
+            logger.debug(f"Cache value {key} lost some of its {manifest.chunks} chunks")
+            return None
+        return self.serde.deserialize(key, b''.join(parts), manifest.flags)
+
+    def get(self, key: str, *args, **kwargs) -> Optional[Any]:
+        value = self.client.get(key, *args, **kwargs)
+        if not isinstance(value, ChunkManifest):
+            return value
+        value = self._join(key, value, self.client.get_many(self.chunk_keys(key, value)))
+        if value is None:
+            return args[0] if args else kwargs.get('default')
+        return value
+
+    def get_many(self, keys: List[str]) -> Dict[str, Any]:
+        values = self.client.get_many(keys)
+        manifests = {key: value for key, value in values.items() if isinstance(value, ChunkManifest)}
+        if not manifests:
+            return values
+        # The chunks of every chunked value in one more round-trip
+        found = self.client.get_many([
+            chunk_key for key, manifest in manifests.items() for chunk_key in self.chunk_keys(key, manifest)
+        ])
+        for key, manifest in manifests.items():
+            value = self._join(key, manifest, found)
+            if value is None:
+                del values[key]
+            else:
+                values[key] = value
+        return values
+
+    get_multi = get_many
+
+    def set(self, key: str, value: Any, *args, **kwargs):
+        item, parts = self._split(key, value)
+        if parts:
+            expire = args[0] if args else kwargs.get('expire', 0)
+            # The manifest must never point at chunks that weren't stored
+            if self.client.set_many(parts, expire, noreply=False):
+                return False
+        return self.client.set(key, item, *args, **kwargs)
+
+    def set_many(self, values: Dict[str, Any], *args, **kwargs):
+        items, parts, owners = {}, {}, {}
+        for key, value in values.items():
+            items[key], value_parts = self._split(key, value)
+            parts.update(value_parts)
+            owners.update((chunk_key, key) for chunk_key in value_parts)
+
+        failed = []
+        if parts:
+            expire = args[0] if args else kwargs.get('expire', 0)
+            failed = list(dict.fromkeys(owners[chunk_key] for chunk_key in self.client.set_many(
+                parts, expire, noreply=False
+            )))
+            for key in failed:
+                del items[key]
+        return failed + list(self.client.set_many(items, *args, **kwargs))
+
+    set_multi = set_many
@@ -0,0 +1,291 @@
+"""
+Prometheus metrics for ChoosyTable
+Aggregate counterparts of the per-request instrumentation, exposed at
+``/metrics``: route latency histograms by endpoint, memcached hits and misses
+per key namespace, in-process cache tier lookups and evictions, large cache
+values per namespace, background job runs,
+Google userinfo lookups made and avoided, MongoDB command counts and
+durations, and connection pool gauges for PyMongo and the memcached
+PooledClient.
+
+With several gunicorn workers, set PROMETHEUS_MULTIPROC_DIR to a directory
+shared by the workers (see gunicorn.conf.py) so a scrape of any worker
+reports the totals of all of them.
+"""
+
+import os
+import threading
+import time
+from typing import Any, Callable, Dict, Optional
+
+from flask import Response, g, request
+from pymongo import monitoring
+
+try:
+    from prometheus_client import (
+        CONTENT_TYPE_LATEST, CollectorRegistry, Counter, Gauge, Histogram, generate_latest, multiprocess
+    )
+except ImportError:  # optional dependency, only needed for METRICS_ENABLED=true
+    Counter = None
+
+if Counter is not None:
+    REQUEST_LATENCY = Histogram(
+        'choosytable_request_duration_seconds', 'Request latency by Flask endpoint',
+        ['endpoint', 'method'],
+        buckets=(0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+    )
+    CACHE_REQUESTS = Counter(
+        'choosytable_cache_requests_total', 'memcached lookups by key namespace and result',
+        ['namespace', 'result']
+    )
+    LOCAL_CACHE_REQUESTS = Counter(
+        'choosytable_local_cache_requests_total',
+        'In-process cache tier lookups by result (hit, miss, stale version, expired)',
+        ['result']
+    )
+    LOCAL_CACHE_EVICTIONS = Counter(
+        'choosytable_local_cache_evictions_total', 'Entries evicted from the full in-process cache tier'
+    )
+    CACHE_LATENCY = Histogram(
+        'choosytable_cache_operation_duration_seconds', 'memcached call latency by operation',
+        ['operation'],
+        buckets=(0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25)
+    )
+    CACHE_LARGE_VALUES = Counter(
+        'choosytable_cache_large_values_total', 'Cache writes above CACHE_LARGE_VALUE_WARN by key namespace',
+        ['namespace', 'chunked']
+    )
+    CACHE_LARGEST_VALUE = Gauge(
+        'choosytable_cache_largest_value_bytes', 'Largest encoded cache value written by key namespace',
+        ['namespace'], multiprocess_mode='max'
+    )
+    MONGO_LATENCY = Histogram(
+        'choosytable_mongo_command_duration_seconds', 'MongoDB command latency',
+        ['command', 'collection'],
+        buckets=(0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5)
+    )
+    MONGO_FAILURES = Counter(
+        'choosytable_mongo_command_failures_total', 'MongoDB commands that returned an error',
+        ['command', 'collection']
+    )
+    # Gauges are summed over the live worker processes
+    MONGO_POOL = Gauge(
+        'choosytable_mongo_pool_connections', 'PyMongo pool connections by state',
+        ['state'], multiprocess_mode='livesum'
+    )
+    MEMCACHED_POOL = Gauge(
+        'choosytable_memcached_pool_connections', 'memcached PooledClient connections by state',
+        ['state'], multiprocess_mode='livesum'
+    )
+    JOB_RUNS = Counter(
+        'choosytable_jobs_total', 'Background jobs run, by type and outcome (done, queued for retry, failed)',
+        ['type', 'outcome']
+    )
+    JOB_DURATION = Histogram(
+        'choosytable_job_duration_seconds', 'Background job run time by type',
+        ['type'],
+        buckets=(0.01, 0.05, 0.1, 0.5, 1, 5, 10, 30, 60, 300)
+    )
+    IDENTITY_UPSTREAM_CALLS = Counter(
+        'choosytable_identity_upstream_calls_total', 'Google userinfo lookups made upstream'
+    )
+    IDENTITY_UPSTREAM_CALLS_AVOIDED = Counter(
+        'choosytable_identity_upstream_calls_avoided_total',
+        'Identity reads served from the session instead of Google userinfo'
+    )
+    MEMCACHED_CIRCUIT_OPEN = Gauge(
+        'choosytable_memcached_circuit_open', 'Worker processes whose memcached circuit breaker is open',
+        multiprocess_mode='livesum'
+    )
+
+
+def available() -> bool:
+    return Counter is not None
+
+
+def key_namespace(key: Any, key_prefix: str) -> str:
+    """The key space of a cache key: 'company' for 'choosytable:company:...'"""
+    if isinstance(key, bytes):
+        key = key.decode('utf-8', 'replace')
+    for internal in ('ver:', 'lock:'):
+        if key.startswith(internal):
+            return internal[:-1]
+    if key.startswith(key_prefix):
+        key = key[len(key_prefix):]
+    return key.split(':', 1)[0]
+
+
+def _collection(event_command: Dict, command_name: str) -> str:
+    if command_name == 'getMore':
+        return event_command.get('collection', '')
+    collection = event_command.get(command_name)
+    return collection if isinstance(collection, str) else ''
+
+
+class MongoCommandMetrics(monitoring.CommandListener):
+    """Observes the duration of every MongoDB command"""
+
+    def __init__(self):
+        self.pending: Dict[int, str] = {}
+
+    def started(self, event):
+        self.pending[event.request_id] = _collection(event.command, event.command_name)
+
+    def succeeded(self, event):
+        collection = self.pending.pop(event.request_id, '')
+        MONGO_LATENCY.labels(event.command_name, collection).observe(event.duration_micros / 1e6)
+
+    def failed(self, event):
+        collection = self.pending.pop(event.request_id, '')
+        MONGO_LATENCY.labels(event.command_name, collection).observe(event.duration_micros / 1e6)
+        MONGO_FAILURES.labels(event.command_name, collection).inc()
+
+
+class MongoPoolMetrics(monitoring.ConnectionPoolListener):
+    """Tracks open and checked-out connections of the PyMongo pool"""
+
+    def connection_created(self, event):
+        MONGO_POOL.labels('open').inc()
+
+    def connection_closed(self, event):
+        MONGO_POOL.labels('open').dec()
+
+    def connection_checked_out(self, event):
+        MONGO_POOL.labels('in_use').inc()
+
+    def connection_checked_in(self, event):
+        MONGO_POOL.labels('in_use').dec()
+
+    def pool_created(self, event):
+        pass
+
+    def pool_ready(self, event):
+        pass
+
+    def pool_cleared(self, event):
+        pass
+
+    def pool_closed(self, event):
+        pass
+
+    def connection_ready(self, event):
+        pass
+
+    def connection_check_out_started(self, event):
+        pass
+
+    def connection_check_out_failed(self, event):
+        pass
+
+
+class PrometheusMetrics:
+    """
+    Records route latency and serves ``/metrics``.
+
+    ``command_listener`` and ``pool_listener`` are passed to PyMongo,
+    ``cache_call`` observes the memcached client (see
+    app.instrumentation.InstrumentedClient), ``large_value`` observes the
+    chunking client (app.memcached.ChunkingClient), ``job_finished`` the job
+    workers (app.jobs.JobWorker), and ``memcached_client`` and
+    ``memcached_breaker`` are sampled after each request for the gauges.
+    ``local_cache`` (app.cache.LocalCache) and ``identity_stats``
+    (app.identity.get_identity_stats) are sampled too, and what their
+    tallies gained since the last sample is added to the counters.
+    """
+
+    def __init__(self, key_prefix: str = "choosytable:"):
+        if not available():
+            raise ValueError("METRICS_ENABLED=true requires the prometheus_client package")
+        self.key_prefix = key_prefix
+        self.memcached_client = None
+        self.memcached_breaker = None
+        self.local_cache = None
+        self.identity_stats: Optional[Callable[[], Dict[str, int]]] = None
+        self.command_listener = MongoCommandMetrics()
+        self.pool_listener = MongoPoolMetrics()
+        self._largest: Dict[str, int] = {}
+        # Last published value of each process-local tally, by counter
+        self._published: Dict[Any, int] = {}
+        self._published_lock = threading.Lock()
+
+    def init_app(self, app) -> None:
+        app.before_request(self._start)
+        app.after_request(self._finish)
+        app.add_url_rule('/metrics', 'metrics', self.export)
+
+    def _start(self):
+        g.metrics_started = time.perf_counter()
+
+    def _finish(self, response):
+        started = g.pop('metrics_started', None)
+        if started is not None:
+            REQUEST_LATENCY.labels(request.endpoint or 'unmatched', request.method) \
+                .observe(time.perf_counter() - started)
+        self._sample_memcached_pool()
+        if self.memcached_breaker is not None:
+            MEMCACHED_CIRCUIT_OPEN.set(self.memcached_breaker.state != 'closed')
+        if self.local_cache is not None:
+            self._publish(self.local_cache.stats(), {
+                'hits': LOCAL_CACHE_REQUESTS.labels('hit'),
+                'misses': LOCAL_CACHE_REQUESTS.labels('miss'),
+                'stale': LOCAL_CACHE_REQUESTS.labels('stale'),
+                'expired': LOCAL_CACHE_REQUESTS.labels('expired'),
+                'evictions': LOCAL_CACHE_EVICTIONS
+            })
+        if self.identity_stats is not None:
+            self._publish(self.identity_stats(), {
+                'upstream_calls': IDENTITY_UPSTREAM_CALLS,
+                'upstream_calls_avoided': IDENTITY_UPSTREAM_CALLS_AVOIDED
+            })
+        return response
+
+    def _publish(self, stats: Dict[str, int], counters: Dict[str, Any]) -> None:
+        """Add to each counter what its tally in ``stats`` gained since the last sample"""
+        with self._published_lock:
+            for stat, counter in counters.items():
+                gained = stats.get(stat, 0) - self._published.get(counter, 0)
+                if gained > 0:
+                    counter.inc(gained)
+                    self._published[counter] = stats[stat]
+
+    def _sample_memcached_pool(self) -> None:
+        # A HashClient keeps one PooledClient per server
+        clients = getattr(self.memcached_client, 'clients', None)
+        pools = [
+            getattr(client, 'client_pool', None)
+            for client in (clients.values() if clients is not None else [self.memcached_client])
+        ]
+        pools = [pool for pool in pools if pool is not None]
+        if pools:
+            MEMCACHED_POOL.labels('in_use').set(sum(len(pool.used) for pool in pools))
+            MEMCACHED_POOL.labels('idle').set(sum(len(pool.free) for pool in pools))
+
+    def cache_call(self, operation: str, args: tuple, result: Any, duration: float) -> None:
+        CACHE_LATENCY.labels(operation).observe(duration)
+        if not args:
+            return
+        if operation in ('get', 'gets'):
+            hit = (result[0] if operation == 'gets' else result) is not None
+            CACHE_REQUESTS.labels(key_namespace(args[0], self.key_prefix), 'hit' if hit else 'miss').inc()
+        elif operation in ('get_many', 'get_multi'):
+            for key in args[0]:
+                CACHE_REQUESTS.labels(
+                    key_namespace(key, self.key_prefix), 'hit' if key in result else 'miss'
+                ).inc()
+
+    def large_value(self, namespace: str, size: int, chunks: int) -> None:
+        CACHE_LARGE_VALUES.labels(namespace, 'yes' if chunks > 1 else 'no').inc()
+        if size > self._largest.get(namespace, 0):
+            self._largest[namespace] = size
+            CACHE_LARGEST_VALUE.labels(namespace).set(size)
+
+    def job_finished(self, job_type: str, outcome: str, duration: float) -> None:
+        JOB_RUNS.labels(job_type, outcome).inc()
+        JOB_DURATION.labels(job_type).observe(duration)
+
+    def export(self):
+        if os.environ.get('PROMETHEUS_MULTIPROC_DIR'):
+            registry = CollectorRegistry()
+            multiprocess.MultiProcessCollector(registry)
+            return Response(generate_latest(registry), content_type=CONTENT_TYPE_LATEST)
+        return Response(generate_latest(), content_type=CONTENT_TYPE_LATEST)
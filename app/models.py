@@ -25,22 +25,22 @@ class MongoStorage(BaseStorage):
 
     def get(self, blueprint):
         # Import here to avoid circular imports
-        from app import ct
-        u = ct.find_one({'email': self.email})
+        from app import db
+        u = db.users.find_one({'email': self.email})
         if u is None:
             return None
         else:
             return u
 
     def set(self, blueprint, token):
-        from app import ct
-        ct.update_one({'email': self.email},{'$set': {'token': token}})
+        from app import db
+        db.users.update_one({'email': self.email},{'$set': {'token': token}})
 
     def delete(self, blueprint):
-        from app import ct
-        ct.update(
+        from app import db
+        db.users.update_one(
             {'email': self.email}, 
-            {'$pull': {'email': self.email}}
+            {'$unset': {'token': ''}}
         )
 
 
@@ -0,0 +1,505 @@
+"""
+Repository layer for ChoosyTable
+All MongoDB access goes through here. Data lives in four collections:
+
+- users:      profile documents
+- companies:  company header plus denormalized counters
+              (review_count, rating_sum, rating_count, interview_counts)
+              and name_lower, the normalized name searched by prefix
+- reviews:    one document per review, keyed to its company and author
+- interviews: one document per interview, keyed to its company, position and author
+
+A review or interview and the counters it moves are written in one
+transaction when MongoDB is a replica set. A standalone server has no
+transactions, so there the counters are written right after and
+recount_counters.py, run on a schedule, repairs any a crash left behind.
+"""
+
+import logging
+import unicodedata
+from contextlib import contextmanager
+from datetime import datetime
+from typing import Dict, Iterator, List, Optional
+
+from bson import ObjectId
+from pymongo import ReturnDocument, UpdateOne
+from pymongo.errors import OperationFailure
+
+from app import db
+from app.indexes import (
+    COMPANY_HEADER_PROJECTION, COMPANY_SEARCH_PROJECTION, REVIEWED_COMPANIES_FILTER, REVIEWED_LISTING_INDEX
+)
+from app.stats import build_interview_counts, counter_ethnicity, nonzero_counts
+
+logger = logging.getLogger(__name__)
+
+users = db.users
+companies = db.companies
+reviews = db.reviews
+interviews = db.interviews
+
+# Whether the server runs multi-document transactions, asked on first use
+_transactions = None
+
+def transactions_supported() -> bool:
+    """True for a replica set or a sharded cluster, False for a standalone mongod"""
+    global _transactions
+    if _transactions is None:
+        hello = db.command('hello')
+        _transactions = bool(hello.get('setName')) or hello.get('msg') == 'isdbgrid'
+        if not _transactions:
+            logger.warning(
+                "MongoDB has no transactions (standalone server); schedule recount_counters.py "
+                "to repair company counters left short by a crash"
+            )
+    return _transactions
+
+@contextmanager
+def counter_transaction():
+    """
+    Session for a write together with the company counters it moves.
+
+    Yields None on a standalone server, where the writes stay separate.
+    """
+    if not transactions_supported():
+        yield None
+        return
+    with db.client.start_session() as session, session.start_transaction():
+        yield session
+
+# =============================================================================
+# USERS
+# =============================================================================
+
+def find_user_by_email(email: str) -> Optional[Dict]:
+    """Get a user document by email"""
+    return users.find_one({'email': email})
+
+def find_user(user_id: str) -> Optional[Dict]:
+    """Get a user document by id"""
+    return users.find_one({'_id': ObjectId(user_id)})
+
+def create_user(user_data: Dict) -> Dict:
+    """Insert a new user document and return it with its _id"""
+    result = users.insert_one(user_data)
+    return users.find_one({'_id': result.inserted_id})
+
+def save_profile_by_email(email: str, fields: Dict) -> Dict:
+    """
+    Set profile fields on the user with this email, creating the user if
+    there is none (login usually has), and return the user document.
+    """
+    return users.find_one_and_update(
+        {'email': email},
+        {'$set': fields, '$setOnInsert': {'created': datetime.now()}},
+        upsert=True, return_document=ReturnDocument.AFTER
+    )
+
+def set_last_login(user_id) -> None:
+    """Record a successful login"""
+    users.update_one({'_id': ObjectId(user_id)}, {'$set': {'last_login': datetime.now()}})
+
+def update_user_profile(user_id: str, fields: Dict) -> Optional[Dict]:
+    """Update profile fields and return the updated user document"""
+    return users.find_one_and_update(
+        {'_id': ObjectId(user_id)},
+        {'$set': dict(fields, last_modified=datetime.now())},
+        return_document=ReturnDocument.AFTER
+    )
+
+def iter_denormalized_profile_updates(user_id: str, gender: str, ethnicity: str, location: str,
+                                      batch_size: int = 500) -> Iterator[Dict]:
+    """
+    Propagate profile demographics onto the user's reviews and interviews in batches.
+    
+    Only documents whose copy is out of date are rewritten, ``batch_size``
+    at a time. Interviews whose ethnicity changes are moved between the
+    company's interview_counts buckets in the same batch, so the statistics
+    stay consistent while the fan-out is in progress.
+    
+    Yields:
+        dict: After each batch, ``collection``, ``updated`` (documents in the
+        batch) and ``company_ids`` (companies whose statistics changed)
+    """
+    review_fields = {'gender': gender, 'ethnicity': ethnicity, 'location': location}
+    interview_fields = {'user_gender': gender, 'user_ethnicity': ethnicity, 'user_location': location}
+    
+    def stale(fields):
+        return {'user': user_id, '$or': [{field: {'$ne': value}} for field, value in fields.items()]}
+    
+    batch = []
+    for review in reviews.find(stale(review_fields), {'_id': 1}).batch_size(batch_size):
+        batch.append(review['_id'])
+        if len(batch) >= batch_size:
+            reviews.update_many({'_id': {'$in': batch}}, {'$set': review_fields})
+            yield {'collection': 'reviews', 'updated': len(batch), 'company_ids': []}
+            batch = []
+    if batch:
+        reviews.update_many({'_id': {'$in': batch}}, {'$set': review_fields})
+        yield {'collection': 'reviews', 'updated': len(batch), 'company_ids': []}
+    
+    def flush_interviews(batch):
+        counter_updates = {}
+        for interview in batch:
+            if interview.get('user_ethnicity') == ethnicity:
+                continue
+            inc = counter_updates.setdefault(interview['company_id'], {})
+            position, outcome = interview['position'], interview.get('win')
+            add_counts(inc, interview_counter_fields(position, interview.get('user_ethnicity'), outcome, -1))
+            add_counts(inc, interview_counter_fields(position, ethnicity, outcome, 1))
+        apply_counter_updates(counter_updates)
+        interviews.update_many({'_id': {'$in': [i['_id'] for i in batch]}}, {'$set': interview_fields})
+        return {
+            'collection': 'interviews',
+            'updated': len(batch),
+            'company_ids': [str(company_id) for company_id in counter_updates]
+        }
+    
+    batch = []
+    for interview in interviews.find(
+        stale(interview_fields),
+        {'company_id': 1, 'position': 1, 'user_ethnicity': 1, 'win': 1}
+    ).batch_size(batch_size):
+        batch.append(interview)
+        if len(batch) >= batch_size:
+            yield flush_interviews(batch)
+            batch = []
+    if batch:
+        yield flush_interviews(batch)
+
+def update_denormalized_profile(user_id: str, gender: str, ethnicity: str, location: str) -> List[str]:
+    """
+    Propagate profile demographics onto the user's reviews and interviews.
+    
+    Returns:
+        list: Ids of the companies whose interview statistics changed
+    """
+    company_ids = set()
+    for progress in iter_denormalized_profile_updates(user_id, gender, ethnicity, location):
+        company_ids.update(progress['company_ids'])
+    return list(company_ids)
+
+def user_company_ids(user_id: str) -> List[str]:
+    """Ids of the companies a user reviewed or reported an interview for"""
+    company_ids = set(reviews.distinct('company_id', {'user': user_id}))
+    company_ids.update(interviews.distinct('company_id', {'user': user_id}))
+    return [str(company_id) for company_id in company_ids]
+
+def delete_user(user_id: str) -> bool:
+    """Delete a user's profile document; their reviews and interviews stay"""
+    return users.delete_one({'_id': ObjectId(user_id)}).deleted_count == 1
+
+def erase_user(user_id: str, company_ids: Optional[List[str]] = None) -> List[str]:
+    """
+    Delete a user together with their reviews and interviews.
+
+    The counters of the affected companies are then recomputed, so running
+    it again after a failure part-way leaves them right, as long as the same
+    ``company_ids`` (see ``user_company_ids``) are passed.
+
+    Returns:
+        list: Ids of the companies whose data changed
+    """
+    if company_ids is None:
+        company_ids = user_company_ids(user_id)
+
+    reviews.delete_many({'user': user_id})
+    interviews.delete_many({'user': user_id})
+    users.delete_one({'_id': ObjectId(user_id)})
+
+    recount_company_counters(company_ids)
+    return company_ids
+
+# =============================================================================
+# COMPANIES
+# =============================================================================
+
+def count_reviewed_companies() -> int:
+    """Count companies that have at least one review"""
+    # The planner won't pick a partial index for a bare count on its filter field
+    try:
+        return companies.count_documents(REVIEWED_COMPANIES_FILTER, hint=REVIEWED_LISTING_INDEX)
+    except OperationFailure:
+        # The index isn't there until create_indexes.py has run; slower, but still right
+        return companies.count_documents(REVIEWED_COMPANIES_FILTER)
+
+def find_companies_page(offset: int, limit: int) -> List[Dict]:
+    """Get one page of reviewed companies, most recently modified first"""
+    return list(
+        companies.find(
+            REVIEWED_COMPANIES_FILTER,
+            {'company': 1, 'last_modified': 1, 'review_count': 1}
+        ).sort([('last_modified', -1), ('_id', -1)]).skip(offset).limit(limit)
+    )
+
+# Orders for find_hot_company_ids: recently modified (the listing's order) or most reviewed
+HOT_COMPANY_ORDERS = {
+    'recent': [('last_modified', -1), ('_id', -1)],
+    'reviews': [('review_count', -1), ('_id', -1)]
+}
+
+def find_hot_company_ids(limit: int, by: str = 'recent') -> List[str]:
+    """Ids of the reviewed companies most likely to be visited"""
+    return [
+        str(company['_id'])
+        for company in companies.find(REVIEWED_COMPANIES_FILTER, {'_id': 1}).sort(HOT_COMPANY_ORDERS[by]).limit(limit)
+    ]
+
+def normalize_company_name(name: str) -> str:
+    """Lowercase, accent-free, single-spaced form of a name, as stored in name_lower"""
+    decomposed = unicodedata.normalize('NFKD', name or '')
+    return ' '.join(''.join(char for char in decomposed if not unicodedata.combining(char)).casefold().split())
+
+def text_search_terms(query: str) -> str:
+    """
+    Words of ``query`` for a ``$text`` search, without the characters the
+    search would read as operators: quotes (phrases) and leading hyphens
+    (negation). Hyphens inside a word only separate words, as in the index.
+    """
+    return ' '.join(word.lstrip('-') for word in query.replace('"', ' ').split() if word.lstrip('-'))
+
+def search_companies(query: str, limit: int) -> List[Dict]:
+    """Companies whose name contains the words of ``query``, best matches first (text index)"""
+    terms = text_search_terms(query)
+    if not terms:
+        return []
+    return list(
+        companies.find(
+            {'$text': {'$search': terms}},
+            dict(COMPANY_SEARCH_PROJECTION, score={'$meta': 'textScore'})
+        ).sort([('score', {'$meta': 'textScore'}), ('review_count', -1)]).limit(limit)
+    )
+
+def find_companies_by_prefix(prefix: str, limit: int) -> List[Dict]:
+    """Companies whose normalized name starts with ``prefix`` (normalized too), by name"""
+    if not prefix:
+        return []
+    # A range on name_lower, so the prefix index bounds the scan
+    upper = prefix[:-1] + chr(ord(prefix[-1]) + 1)
+    return list(
+        companies.find(
+            {'name_lower': {'$gte': prefix, '$lt': upper}}, COMPANY_SEARCH_PROJECTION
+        ).sort('name_lower', 1).limit(limit)
+    )
+
+def find_review_counts(company_ids: List) -> Dict[str, int]:
+    """Review count of each of some companies, by id"""
+    return {
+        str(company['_id']): company.get('review_count', 0)
+        for company in companies.find(
+            {'_id': {'$in': [ObjectId(company_id) for company_id in company_ids]}}, {'review_count': 1}
+        )
+    }
+
+def find_company(company_id: str) -> Optional[Dict]:
+    """Get a company document (header and counters) by id"""
+    return companies.find_one({'_id': ObjectId(company_id)}, COMPANY_HEADER_PROJECTION)
+
+def create_company(name: str, review: Dict) -> ObjectId:
+    """Create a company together with its first review"""
+    now = datetime.now()
+    result = companies.insert_one({
+        'created': now,
+        'last_modified': now,
+        'company': name,
+        'name_lower': normalize_company_name(name),
+        'review_count': 0,
+        'rating_sum': 0,
+        'rating_count': 0,
+        'interview_counts': {}
+    })
+    add_review(result.inserted_id, review)
+    return result.inserted_id
+
+# Materialized counters kept on every company document
+COMPANY_COUNTER_FIELDS = ('review_count', 'rating_sum', 'rating_count', 'interview_counts')
+
+def recount_company_counters(company_ids: List) -> List[str]:
+    """
+    Recompute the counters of some companies from their reviews and interviews.
+    
+    Only companies whose stored counters differ from the recomputed ones are
+    written; empty interview buckets left behind by counter moves are not a
+    difference.
+    
+    Returns:
+        list: Ids of the companies whose counters were corrected
+    """
+    ids = list({ObjectId(company_id) for company_id in company_ids})
+    if not ids:
+        return []
+    
+    recounted = {
+        company_id: {'review_count': 0, 'rating_sum': 0, 'rating_count': 0, 'interview_counts': {}}
+        for company_id in ids
+    }
+    for row in reviews.aggregate([
+        {'$match': {'company_id': {'$in': ids}}},
+        {'$group': {
+            '_id': '$company_id',
+            'review_count': {'$sum': 1},
+            'rating_sum': {'$sum': {'$cond': [{'$gt': ['$rating', 0]}, '$rating', 0]}},
+            'rating_count': {'$sum': {'$cond': [{'$gt': ['$rating', 0]}, 1, 0]}}
+        }}
+    ]):
+        recounted[row.pop('_id')].update(row)
+    
+    groups = {}
+    for row in interviews.aggregate([
+        {'$match': {'company_id': {'$in': ids}}},
+        {'$group': {
+            '_id': {
+                'company_id': '$company_id', 'position': '$position',
+                'user_ethnicity': '$user_ethnicity', 'win': '$win'
+            },
+            'count': {'$sum': 1}
+        }}
+    ]):
+        group = row['_id']
+        groups.setdefault(group.pop('company_id'), []).append(dict(group, count=row['count']))
+    for company_id, rows in groups.items():
+        recounted[company_id]['interview_counts'] = build_interview_counts(rows)
+    
+    corrected = {}
+    for company in companies.find({'_id': {'$in': ids}}, {field: 1 for field in COMPANY_COUNTER_FIELDS}):
+        counters = recounted[company['_id']]
+        stored = {field: company.get(field, 0) for field in COMPANY_COUNTER_FIELDS[:3]}
+        stored['interview_counts'] = nonzero_counts(company.get('interview_counts') or {})
+        if stored != counters:
+            corrected[company['_id']] = counters
+    if corrected:
+        companies.bulk_write(
+            [UpdateOne({'_id': company_id}, {'$set': counters}) for company_id, counters in corrected.items()],
+            ordered=False
+        )
+    return [str(company_id) for company_id in corrected]
+
+def iter_company_id_batches(batch_size: int) -> Iterator[List[ObjectId]]:
+    """Ids of every company, ``batch_size`` at a time"""
+    batch = []
+    for company in companies.find({}, {'_id': 1}).sort('_id', 1):
+        batch.append(company['_id'])
+        if len(batch) == batch_size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+# =============================================================================
+# REVIEWS
+# =============================================================================
+
+def find_company_reviews_page(company_id: str, offset: int, limit: int) -> List[Dict]:
+    """Get one page of a company's reviews in the order they were written"""
+    return list(
+        reviews.find(
+            {'company_id': ObjectId(company_id)},
+            {'review': 1, 'rating': 1, 'created': 1}
+        ).sort('created', 1).skip(offset).limit(limit)
+    )
+
+def review_counter_fields(rating, amount: int = 1) -> Dict:
+    """Build the ``$inc`` document for a company's review and rating counters"""
+    inc = {'review_count': amount}
+    if rating:
+        inc['rating_sum'] = rating * amount
+        inc['rating_count'] = amount
+    return inc
+
+def find_user_reviews_page(user_id: str, offset: int, limit: int) -> List[Dict]:
+    """Get one page of a user's reviews, newest first, walking the user_created index"""
+    return list(
+        reviews.find(
+            {'user': user_id},
+            {'review': 1, 'rating': 1, 'company_id': 1, 'company': 1, 'created': 1}
+        ).sort('created', -1).skip(offset).limit(limit)
+    )
+
+def count_user_reviews(user_id: str) -> int:
+    """Count the reviews written by a user"""
+    return reviews.count_documents({'user': user_id})
+
+def add_review(company_id, review: Dict) -> bool:
+    """
+    Add a review to a company and bump the company's review count, in one
+    transaction (see ``counter_transaction``).
+
+    Returns:
+        bool: False if the company does not exist
+    """
+    company = companies.find_one({'_id': ObjectId(company_id)}, {'company': 1})
+    if company is None:
+        return False
+
+    review = dict(review, company_id=company['_id'], company=company['company'])
+    review.setdefault('_id', str(ObjectId()))
+    review.setdefault('created', datetime.now())
+    with counter_transaction() as session:
+        reviews.insert_one(review, session=session)
+        companies.update_one(
+            {'_id': company['_id']},
+            {'$inc': review_counter_fields(review.get('rating')), '$set': {'last_modified': datetime.now()}},
+            session=session
+        )
+    return True
+
+def delete_review(review_id: str, user_id: str) -> Optional[Dict]:
+    """Delete one of a user's reviews and return it, or None if it wasn't theirs"""
+    with counter_transaction() as session:
+        review = reviews.find_one_and_delete({'_id': review_id, 'user': user_id}, session=session)
+        if review is not None:
+            companies.update_one(
+                {'_id': review['company_id']}, {'$inc': review_counter_fields(review.get('rating'), -1)},
+                session=session
+            )
+    return review
+
+# =============================================================================
+# INTERVIEWS
+# =============================================================================
+
+def interview_counter_fields(position_key: str, ethnicity: Optional[str], outcome: str, amount: int = 1) -> Dict:
+    """Build the ``$inc`` document for a company's ``interview_counts``"""
+    base = f"interview_counts.{position_key}.{counter_ethnicity(ethnicity)}"
+    return {f"{base}.{outcome}": amount, f"{base}.total": amount}
+
+def add_counts(inc: Dict, fields: Dict) -> None:
+    """Merge counter deltas into an accumulated ``$inc`` document"""
+    for field, amount in fields.items():
+        inc[field] = inc.get(field, 0) + amount
+
+def apply_counter_updates(counter_updates: Dict) -> None:
+    """Apply accumulated ``$inc`` documents keyed by company _id in one bulk write"""
+    if counter_updates:
+        companies.bulk_write(
+            [UpdateOne({'_id': company_id}, {'$inc': inc}) for company_id, inc in counter_updates.items()],
+            ordered=False
+        )
+
+def record_interview(company_id: str, position_key: str, interview: Dict) -> bool:
+    """
+    Store an interview and bump the company's materialized counters, in one
+    transaction (see ``counter_transaction``).
+
+    Returns:
+        bool: False if the company does not exist
+    """
+    if companies.count_documents({'_id': ObjectId(company_id)}, limit=1) == 0:
+        return False
+
+    interview = dict(interview, company_id=ObjectId(company_id), position=position_key)
+    interview.setdefault('_id', str(ObjectId()))
+    interview.setdefault('created', datetime.now())
+    with counter_transaction() as session:
+        interviews.insert_one(interview, session=session)
+        companies.update_one(
+            {'_id': interview['company_id']},
+            {
+                '$inc': interview_counter_fields(
+                    position_key, interview.get('user_ethnicity'), interview.get('win')
+                ),
+                '$set': {'last_modified': datetime.now()}
+            },
+            session=session
+        )
+    return True
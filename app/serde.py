@@ -0,0 +1,196 @@
+"""
+Cache serializers for ChoosyTable
+pymemcache serdes that encode cached values as raw BSON (default) or msgpack,
+with optional zlib compression above a size threshold.
+
+Values too large for one memcached item are split by
+app.memcached.ChunkingClient, which stores the raw chunks and a manifest
+under their own flags and hands the serdes already-encoded payloads.
+
+The memcached item flags identify the format of every stored value, so any
+serde here can read entries written by the others, including the legacy
+json_util entries written by JsonSerde.
+"""
+
+import zlib
+from datetime import datetime, timedelta, timezone
+from typing import Any, NamedTuple, Tuple
+
+import bson
+from bson import ObjectId, json_util
+from bson.codec_options import CodecOptions
+
+try:
+    import msgpack
+except ImportError:  # optional dependency, only needed for CACHE_SERDE=msgpack
+    msgpack = None
+
+# Format flags stored with every memcached item
+FLAG_STR = 1
+FLAG_JSON = 2
+FLAG_BSON = 3
+FLAG_MSGPACK = 4
+# One raw slice of a chunked value, and the manifest stored under its key
+FLAG_CHUNK = 5
+FLAG_MANIFEST = 6
+# Set on top of the format flag when the payload is zlib-compressed
+FLAG_COMPRESSED = 0x100
+
+# msgpack extension type codes; datetimes are naive UTC microseconds since the epoch
+EXT_OBJECTID = 1
+EXT_DATETIME = 2
+EPOCH = datetime(1970, 1, 1)
+ONE_MICROSECOND = timedelta(microseconds=1)
+
+BSON_CODEC_OPTIONS = CodecOptions(tz_aware=False)
+
+# Wrapper field so any value, not only documents, can be stored as BSON
+BSON_VALUE_FIELD = 'v'
+
+
+class Serialized(NamedTuple):
+    """A payload already encoded by a serde, stored as is"""
+    payload: bytes
+    flags: int
+
+
+class ChunkManifest(NamedTuple):
+    """Where the chunks of a large value are and how to decode them once joined"""
+    token: str
+    chunks: int
+    flags: int
+    size: int
+
+    def encode(self) -> bytes:
+        return f"{self.token}:{self.chunks}:{self.flags}:{self.size}".encode()
+
+    @classmethod
+    def decode(cls, value: bytes) -> 'ChunkManifest':
+        token, chunks, flags, size = value.decode().split(':')
+        return cls(token, int(chunks), int(flags), int(size))
+
+
+def _msgpack_default(value: Any):
+    if isinstance(value, ObjectId):
+        return msgpack.ExtType(EXT_OBJECTID, value.binary)
+    if isinstance(value, datetime):
+        if value.tzinfo is not None:
+            value = value.astimezone(timezone.utc).replace(tzinfo=None)
+        micros = (value - EPOCH) // ONE_MICROSECOND
+        return msgpack.ExtType(EXT_DATETIME, micros.to_bytes(8, 'big', signed=True))
+    raise TypeError(f"Cannot serialize {type(value).__name__} with msgpack")
+
+
+def _msgpack_ext_hook(code: int, data: bytes):
+    if code == EXT_OBJECTID:
+        return ObjectId(data)
+    if code == EXT_DATETIME:
+        return EPOCH + int.from_bytes(data, 'big', signed=True) * ONE_MICROSECOND
+    return msgpack.ExtType(code, data)
+
+
+def decode_value(value: bytes, flags: int) -> Any:
+    """Decode a memcached value written by any serde in this module"""
+    if flags == FLAG_CHUNK:
+        return bytes(value)
+    if flags == FLAG_MANIFEST:
+        return ChunkManifest.decode(value)
+    if flags & FLAG_COMPRESSED:
+        value = zlib.decompress(value)
+        flags &= ~FLAG_COMPRESSED
+
+    if flags == FLAG_STR:
+        return value.decode('utf-8') if isinstance(value, bytes) else value
+    if flags == FLAG_JSON:
+        return json_util.loads(value)
+    if flags == FLAG_BSON:
+        return bson.decode(value, codec_options=BSON_CODEC_OPTIONS)[BSON_VALUE_FIELD]
+    if flags == FLAG_MSGPACK:
+        if msgpack is None:
+            raise Exception("msgpack is required to read this cache entry")
+        return msgpack.unpackb(value, ext_hook=_msgpack_ext_hook, raw=False, strict_map_key=False)
+    raise Exception("Unknown serialization format")
+
+
+class JsonSerde(object):
+    """Legacy serde: bson json_util text. Slow and verbose, kept for compatibility"""
+
+    def serialize(self, key, value):
+        if isinstance(value, Serialized):
+            return value.payload, value.flags
+        if isinstance(value, str):
+            return value, FLAG_STR
+        return json_util.dumps(value), FLAG_JSON
+
+    def deserialize(self, key, value, flags):
+        return decode_value(value, flags)
+
+
+class BinarySerde(object):
+    """Base class for binary serdes with optional compression"""
+
+    format_flag = None
+
+    def __init__(self, compress_threshold: int = 0, compress_level: int = 1):
+        # 0 disables compression
+        self.compress_threshold = compress_threshold
+        self.compress_level = compress_level
+
+    def encode(self, value: Any) -> bytes:
+        raise NotImplementedError
+
+    def serialize(self, key, value) -> Tuple[Any, int]:
+        if isinstance(value, Serialized):
+            return value.payload, value.flags
+        if isinstance(value, str):
+            return value, FLAG_STR
+
+        payload = self.encode(value)
+        flags = self.format_flag
+        if self.compress_threshold and len(payload) >= self.compress_threshold:
+            compressed = zlib.compress(payload, self.compress_level)
+            if len(compressed) < len(payload):
+                return compressed, flags | FLAG_COMPRESSED
+        return payload, flags
+
+    def deserialize(self, key, value, flags):
+        return decode_value(value, flags)
+
+
+class BsonSerde(BinarySerde):
+    """Raw BSON: ObjectIds and datetimes keep their native 12/8-byte encodings"""
+
+    format_flag = FLAG_BSON
+
+    def encode(self, value: Any) -> bytes:
+        return bson.encode({BSON_VALUE_FIELD: value})
+
+
+class MsgpackSerde(BinarySerde):
+    """msgpack with extension types for ObjectId and datetime"""
+
+    format_flag = FLAG_MSGPACK
+
+    def __init__(self, *args, **kwargs):
+        if msgpack is None:
+            raise ValueError("CACHE_SERDE=msgpack requires the msgpack package")
+        super().__init__(*args, **kwargs)
+
+    def encode(self, value: Any) -> bytes:
+        return msgpack.packb(value, default=_msgpack_default, use_bin_type=True)
+
+
+SERDES = {
+    'json': JsonSerde,
+    'bson': BsonSerde,
+    'msgpack': MsgpackSerde,
+}
+
+
+def make_serde(name: str = 'bson', compress_threshold: int = 0):
+    """Build the serde selected by CACHE_SERDE"""
+    if name not in SERDES:
+        raise ValueError(f"CACHE_SERDE must be one of: {', '.join(SERDES)}")
+    if name == 'json':
+        return JsonSerde()
+    return SERDES[name](compress_threshold=compress_threshold)
@@ -286,6 +286,9 @@ function initModernEffects() {
     // Modern form enhancements
     initFormEnhancements();
     
+    // Company name suggestions
+    initCompanyAutocomplete();
+    
     // Micro-interactions
     initMicroInteractions();
 }
@@ -412,6 +415,40 @@ function initFormEnhancements() {
     });
 }
 
+// Company search suggestions from the autocomplete API
+function initCompanyAutocomplete() {
+    const input = document.querySelector('input[data-autocomplete-url]');
+    const datalist = input && document.getElementById(input.getAttribute('list'));
+    if (!input || !datalist) return;
+    
+    const url = input.dataset.autocompleteUrl;
+    let timer = null;
+    let lastPrefix = '';
+    
+    input.addEventListener('input', function() {
+        clearTimeout(timer);
+        const prefix = input.value.trim();
+        if (!prefix || prefix === lastPrefix) return;
+        
+        // Wait for a pause in typing; each prefix is cached server-side
+        timer = setTimeout(() => {
+            lastPrefix = prefix;
+            fetch(`${url}?q=${encodeURIComponent(prefix)}`, { credentials: 'same-origin' })
+                .then(response => response.ok ? response.json() : [])
+                .then(companies => {
+                    if (input.value.trim() !== prefix) return;
+                    datalist.innerHTML = '';
+                    companies.forEach(company => {
+                        const option = document.createElement('option');
+                        option.value = company.name;
+                        datalist.appendChild(option);
+                    });
+                })
+                .catch(() => {});
+        }, 150);
+    });
+}
+
 // Field validation functions
 function validateField(e) {
     const field = e.target;
@@ -0,0 +1,162 @@
+"""
+Company statistics for ChoosyTable
+Interview win percentages and rating averages, computed either in Python
+from materialized counters or server-side with MongoDB aggregation pipelines
+"""
+
+from statistics import mean
+from typing import Any, Dict, Iterable, List, Optional
+
+from bson import ObjectId
+
+# Values accepted by the STATS_BACKEND config switch
+STATS_BACKENDS = ('python', 'aggregation')
+DEFAULT_STATS_BACKEND = 'python'
+
+INTERVIEW_OUTCOME_KEYS = ('y', 'n', 'o')
+
+
+def counter_ethnicity(ethnicity: Optional[str]) -> str:
+    """Normalize an ethnicity for use as a counter field name"""
+    # Field names may not contain dots or start with '$'
+    return (ethnicity or 'Unknown').replace('.', '_').lstrip('$')
+
+
+def build_interview_counts(interviews: Iterable[Dict]) -> Dict:
+    """
+    Recompute interview counters from raw interview documents, or from
+    grouped rows that carry the number of interviews they stand for in ``count``
+    """
+    counts = {}
+    for interview in interviews:
+        ethnicity = counter_ethnicity(interview.get('user_ethnicity'))
+        bucket = counts.setdefault(interview['position'], {}).setdefault(ethnicity, {})
+        for outcome in (interview.get('win'), 'total'):
+            bucket[outcome] = bucket.get(outcome, 0) + interview.get('count', 1)
+    return counts
+
+
+def nonzero_counts(counts: Dict) -> Dict:
+    """Interview counters without the empty buckets left behind by counter moves"""
+    pruned = {}
+    for key, value in counts.items():
+        if isinstance(value, dict):
+            value = nonzero_counts(value)
+        if value:
+            pruned[key] = value
+    return pruned
+
+
+def win_percentages(outcomes: Dict) -> Optional[Dict[str, int]]:
+    """Turn outcome counts into truncated percentages, or None if there are none"""
+    total = outcomes.get('total', 0)
+    if not total:
+        return None
+    return {
+        outcome: int((outcomes.get(outcome, 0) / total) * 100)
+        for outcome in INTERVIEW_OUTCOME_KEYS
+    }
+
+
+def statistics_from_counts(positions: List[tuple], counts: Dict) -> List[list]:
+    """Build ``[position_name, ethnicity, {y, n, o}]`` rows from interview counters"""
+    win_statistics = []
+    for position_key, position_name in positions:
+        for ethnicity, outcomes in (counts.get(position_key) or {}).items():
+            percentages = win_percentages(outcomes)
+            if percentages is not None:
+                win_statistics.append([position_name, ethnicity, percentages])
+    return win_statistics
+
+
+def rating_average(reviews: Iterable[Dict]) -> float:
+    """Average the non-empty ratings of a list of reviews"""
+    ratings = [review.get('rating', 0) for review in reviews if review.get('rating')]
+    return mean(ratings) if ratings else 0.0
+
+
+def rating_average_from_counters(company: Dict) -> Optional[float]:
+    """Average rating from a company's rating_sum/rating_count, or None if not maintained"""
+    if 'rating_count' not in company:
+        return None
+    count = company.get('rating_count') or 0
+    return company.get('rating_sum', 0) / count if count > 0 else 0.0
+
+
+def aggregate_interview_statistics(interviews, company_id: str, positions: List[tuple]) -> List[list]:
+    """
+    Compute interview statistics server-side with ``$group``.
+
+    Only the grouped counts cross the wire; the percentages are derived with
+    the same helper as the Python backend so both produce identical numbers.
+    """
+    pipeline = [
+        {'$match': {'company_id': ObjectId(company_id)}},
+        {'$group': {
+            '_id': {
+                'position': '$position',
+                'ethnicity': {'$ifNull': ['$user_ethnicity', 'Unknown']}
+            },
+            'total': {'$sum': 1},
+            **{
+                outcome: {'$sum': {'$cond': [{'$eq': ['$win', outcome]}, 1, 0]}}
+                for outcome in INTERVIEW_OUTCOME_KEYS
+            }
+        }},
+        {'$sort': {'_id.ethnicity': 1}}
+    ]
+
+    counts = {}
+    for row in interviews.aggregate(pipeline):
+        # Grouped on the stored value; count under the counter's field name like
+        # the Python backend, merging values that name the same field
+        ethnicity = counter_ethnicity(row['_id']['ethnicity'])
+        outcomes = counts.setdefault(row['_id']['position'], {}).setdefault(ethnicity, {})
+        for key in ('total',) + INTERVIEW_OUTCOME_KEYS:
+            outcomes[key] = outcomes.get(key, 0) + row[key]
+    return statistics_from_counts(positions, counts)
+
+
+def aggregate_rating_average(reviews, company_id: str) -> float:
+    """Compute a company's mean rating server-side"""
+    pipeline = [
+        {'$match': {'company_id': ObjectId(company_id), 'rating': {'$gt': 0}}},
+        {'$group': {'_id': None, 'avg': {'$avg': '$rating'}}}
+    ]
+    result = next(iter(reviews.aggregate(pipeline)), None)
+    return result['avg'] if result and result['avg'] is not None else 0.0
+
+
+def check_parity(db, positions: List[tuple], company_ids: Optional[List[Any]] = None) -> List[Dict]:
+    """
+    Compare the Python and aggregation backends on real company documents.
+
+    Returns:
+        list: One entry per company whose results differ between backends
+    """
+    query = {'_id': {'$in': [ObjectId(c) for c in company_ids]}} if company_ids else {}
+    mismatches = []
+
+    for company in db.companies.find(query):
+        company_id = str(company['_id'])
+
+        # The live Python backend serves the materialized counters when present
+        counts = company.get('interview_counts')
+        if counts is None:
+            counts = build_interview_counts(db.interviews.find({'company_id': company['_id']}))
+        python_stats = statistics_from_counts(positions, counts)
+        aggregated_stats = aggregate_interview_statistics(db.interviews, company_id, positions)
+        python_rating = rating_average_from_counters(company)
+        if python_rating is None:
+            python_rating = rating_average(db.reviews.find({'company_id': company['_id']}, {'rating': 1}))
+        aggregated_rating = aggregate_rating_average(db.reviews, company_id)
+
+        if sorted(map(repr, python_stats)) != sorted(map(repr, aggregated_stats)) \
+                or abs(python_rating - aggregated_rating) > 1e-9:
+            mismatches.append({
+                'company_id': company_id,
+                'python': {'interview_stats': python_stats, 'rating_avg': python_rating},
+                'aggregation': {'interview_stats': aggregated_stats, 'rating_avg': aggregated_rating}
+            })
+
+    return mismatches
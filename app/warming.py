@@ -0,0 +1,203 @@
+"""
+Cache warming for ChoosyTable
+Fills the cache entries of the pages most visitors land on - the company
+listing and its count, and the page of each hot company - so the first
+visitors after a deploy or a memcached restart don't all pay for a miss.
+
+``warm_cache`` fills whatever is missing, a bounded number of companies at a
+time so MongoDB isn't flooded; ``warm_cache.py`` runs it once, or every few
+seconds as a worker. After a write, the flushed invalidations (see
+``CacheManager.subscribe``) queue a rebuild of the listing and of any hot
+company they cleared, so the next reader finds the entries already there.
+
+Hot companies are the CACHE_WARM_TOP_N reviewed companies that were modified
+most recently (CACHE_WARM_BY=recent, the listing's own order) or that have
+the most reviews (CACHE_WARM_BY=reviews).
+"""
+
+import logging
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, Dict, Iterable, List, Optional, Tuple
+
+from app import cache_manager, job_queue
+from app import repository
+from app.cache import DatabaseCache, cached_query
+from app.constants import POSITION_OPTIONS
+from app.jobs import job_handler
+from app.stats import DEFAULT_STATS_BACKEND
+
+logger = logging.getLogger(__name__)
+
+# Page size the listing and company pages use unless the visitor picks one
+PER_PAGE = 10
+
+# Seconds the list of hot companies is reused by the write hook
+HOT_LIST_TTL = 300
+
+COMPANY_ENTITY_PREFIX = 'company:'
+
+Entry = Tuple[str, Dict, Callable]
+
+
+def _setting(name: str, default):
+    return type(default)(os.environ.get(name, default))
+
+
+def settings() -> Dict:
+    return {
+        'top': _setting('CACHE_WARM_TOP_N', 100),
+        'by': _setting('CACHE_WARM_BY', 'recent').lower(),
+        'concurrency': _setting('CACHE_WARM_CONCURRENCY', 4),
+        'pages': _setting('CACHE_WARM_LISTING_PAGES', 3),
+        'delay': _setting('CACHE_WARM_DELAY', 1.0)
+    }
+
+
+hot_company_ids = cached_query(
+    cache_manager, "hot_companies", HOT_LIST_TTL, ('limit', 'by')
+)(repository.find_hot_company_ids)
+
+
+def _fill(entries: List[Entry], force: bool) -> int:
+    """Compute and store the entries that aren't cached; returns how many were stored"""
+    if not force:
+        cached = cache_manager.get_many([(name, params) for name, params, _ in entries])
+        entries = [entry for entry, value in zip(entries, cached) if value is None]
+    stored = 0
+    for name, params, loader in entries:
+        value = loader()
+        if value is not None and cache_manager.set(name, value, **params):
+            stored += 1
+    return stored
+
+
+def warm_listing(pages: Optional[int] = None, force: bool = False) -> int:
+    """Fill the company count and the first listing pages"""
+    pages = settings()['pages'] if pages is None else pages
+    entries = [('companies_count', {}, repository.count_reviewed_companies)]
+    for page in range(pages):
+        offset = page * PER_PAGE
+        entries.append((
+            'companies_page', {'offset': offset, 'limit': PER_PAGE},
+            lambda offset=offset: repository.find_companies_page(offset, PER_PAGE)
+        ))
+    return _fill(entries, force)
+
+
+def warm_company(company_id: str, force: bool = False) -> int:
+    """Fill what the first page of a company reads"""
+    company = repository.find_company(company_id)
+    if company is None:
+        return 0
+
+    ids = {'company_id': company_id}
+    entries = [('company', ids, lambda: company)]
+    if company.get('review_count'):
+        entries.append((
+            'company_reviews_page', dict(ids, offset=0, limit=PER_PAGE),
+            lambda: repository.find_company_reviews_page(company_id, 0, PER_PAGE)
+        ))
+    # With the default backend the statistics are computed from the company entry
+    if os.environ.get('STATS_BACKEND', DEFAULT_STATS_BACKEND).lower() == 'aggregation':
+        from app.main.routes import cached_interview_statistics, cached_rating_average
+        entries.append((
+            'interview_stats', ids, lambda: cached_interview_statistics.uncached(company_id, POSITION_OPTIONS)
+        ))
+        entries.append(('rating_avg', ids, lambda: cached_rating_average.uncached(company_id)))
+    return _fill(entries, force)
+
+
+def warm_cache(top: Optional[int] = None, by: Optional[str] = None, concurrency: Optional[int] = None,
+               pages: Optional[int] = None, force: bool = False) -> Dict:
+    """
+    Fill the listing and the pages of the hot companies.
+
+    Args:
+        top: Number of hot companies
+        by: 'recent' or 'reviews' (see module docstring)
+        concurrency: Companies filled at once
+        pages: Listing pages to fill
+        force: Recompute entries that are already cached
+
+    Returns:
+        dict: companies, entries stored, failed companies and seconds taken
+    """
+    config = settings()
+    top = config['top'] if top is None else top
+    by = by or config['by']
+    concurrency = concurrency or config['concurrency']
+    if by not in repository.HOT_COMPANY_ORDERS:
+        raise ValueError(f"CACHE_WARM_BY must be one of: {', '.join(repository.HOT_COMPANY_ORDERS)}")
+
+    started = time.perf_counter()
+    stored = warm_listing(pages, force)
+    company_ids = repository.find_hot_company_ids(top, by) if top > 0 else []
+
+    def fill(company_id):
+        try:
+            return warm_company(company_id, force)
+        except Exception as e:
+            logger.warning(f"Could not warm the cache of company {company_id}: {e}")
+            return None
+
+    with ThreadPoolExecutor(max_workers=max(concurrency, 1), thread_name_prefix='cache-warmer') as pool:
+        results = list(pool.map(fill, company_ids))
+
+    result = {
+        'companies': len(company_ids),
+        'entries': stored + sum(count for count in results if count),
+        'failed': sum(1 for count in results if count is None),
+        'seconds': round(time.perf_counter() - started, 3)
+    }
+    logger.info(
+        f"Cache warmed: {result['entries']} entries for the listing and {result['companies']} companies "
+        f"in {result['seconds']}s"
+    )
+    return result
+
+
+@job_handler('warm_cache', max_attempts=1)
+def warm_cache_job(job) -> Dict:
+    return warm_cache(force=job.payload.get('force', False))
+
+
+@job_handler('warm_listing', max_attempts=2)
+def warm_listing_job(job) -> Dict:
+    return {'entries': warm_listing(force=True)}
+
+
+@job_handler('warm_company', max_attempts=2)
+def warm_company_job(job) -> Dict:
+    return {'entries': warm_company(job.payload['company_id'], force=True)}
+
+
+def rebuild_invalidated(entities: Iterable[str]) -> None:
+    """
+    Queue rebuilds for the listing and the hot companies whose entries were
+    just invalidated. Subscribed to the cache manager's flushes, so a
+    rebuild never runs before the entries it replaces are gone; a burst of
+    writes to one company queues a single rebuild.
+    """
+    # Inline, the rebuild would hold up the response; readers refill the entries
+    if job_queue.mode == 'inline':
+        return
+    entities = set(entities)
+    company_ids = {
+        entity[len(COMPANY_ENTITY_PREFIX):] for entity in entities if entity.startswith(COMPANY_ENTITY_PREFIX)
+    }
+    if not company_ids and DatabaseCache.LISTING_ENTITY not in entities:
+        return
+
+    config = settings()
+    if DatabaseCache.LISTING_ENTITY in entities:
+        job_queue.submit('warm_listing', {}, key='listing', delay=config['delay'])
+    if company_ids and config['top'] > 0:
+        hot = set(hot_company_ids(config['top'], config['by']))
+        for company_id in company_ids & hot:
+            job_queue.submit('warm_company', {'company_id': company_id}, key=company_id, delay=config['delay'])
+
+
+if os.environ.get('CACHE_WARM_ON_WRITE', 'true').lower() == 'true':
+    cache_manager.subscribe(rebuild_invalidated)
@@ -0,0 +1,246 @@
+"""
+Synthetic dataset for ChoosyTable benchmarks
+
+Seeds deterministic data in one of two layouts:
+
+- normalized: the users, companies, reviews and interviews collections read
+  by app/repository.py, with company counters (review_count,
+  rating_sum/rating_count, interview_counts) filled in
+- legacy:     the single `choosytable` collection, with `reviews` and
+  per-position interview arrays embedded in each company document, as
+  production data looked before migrate_collections.py
+
+Reviews and interviews can be spread over companies with a Zipf-like skew so
+that a few companies hold most of them. Documents are generated one company
+at a time and written with insert_many in batches, so memory stays flat
+regardless of the dataset size; only the per-company allocation and a small
+tuple per user profile are kept.
+"""
+
+import random
+from datetime import datetime, timedelta
+
+from bson import ObjectId
+
+from app.constants import ETHNICITY_OPTIONS, GENDER_OPTIONS, LOCATION_OPTIONS, POSITION_OPTIONS
+from app.repository import normalize_company_name
+from app.stats import counter_ethnicity
+
+# The user signed in by /mock/login
+MOCK_USER_EMAIL = 'test@example.com'
+
+LAYOUTS = ('normalized', 'legacy')
+
+# Keeps an embedded company document well below MongoDB's 16MB limit
+MAX_EMBEDDED_ITEMS = 15000
+
+WORDS = (
+    "great team culture inclusive interview process slow feedback management support growth "
+    "mentorship remote salary benefits onboarding diverse leadership transparent stressful fair"
+).split()
+
+# Company names combine these, so search and autocomplete see shared words and prefixes
+NAME_WORDS = (
+    "acme apex atlas beacon blue bright cedar cobalt crest delta ember fern global granite harbor "
+    "horizon iron lumen maple meridian nova orbit pine quantum river sierra summit terra vertex zenith"
+).split()
+NAME_SUFFIXES = ("Labs", "Systems", "Health", "Bank", "Media", "Logistics", "Energy", "Foods")
+
+START = datetime(2022, 1, 1)
+
+
+class BatchWriter:
+    """Buffers documents per collection and flushes them with insert_many"""
+
+    def __init__(self, db, batch_size):
+        self.db = db
+        self.batch_size = batch_size
+        self.pending = {}
+        self.totals = {}
+
+    def add(self, collection, document):
+        batch = self.pending.setdefault(collection, [])
+        batch.append(document)
+        if len(batch) >= self.batch_size:
+            self.flush(collection)
+
+    def flush(self, collection=None):
+        for name in ([collection] if collection else list(self.pending)):
+            batch = self.pending.get(name)
+            if batch:
+                self.db[name].insert_many(batch, ordered=False)
+                self.totals[name] = self.totals.get(name, 0) + len(batch)
+                self.pending[name] = []
+
+
+def allocate(rng, companies, total, skew):
+    """
+    Split ``total`` items over companies with Zipf weights 1/rank**skew.
+
+    skew=0 gives every company the same share. Ranks are shuffled so the
+    popular companies are spread through the insertion order.
+    """
+    if companies <= 0:
+        return []
+    weights = [1.0 / rank ** skew for rank in range(1, companies + 1)]
+    scale = total / sum(weights)
+    counts = [int(weight * scale) for weight in weights]
+    for rank in range(total - sum(counts)):
+        counts[rank % companies] += 1
+    rng.shuffle(counts)
+    return counts
+
+
+def make_users(rng, count):
+    """User profiles; the first one is the mock-auth user"""
+    for index in range(count):
+        yield {
+            '_id': ObjectId(),
+            'email': MOCK_USER_EMAIL if index == 0 else f"user{index}@example.com",
+            'name': f"User {index}",
+            'gender': rng.choice(GENDER_OPTIONS),
+            'ethnicity': rng.choice(ETHNICITY_OPTIONS),
+            'location': rng.choice(LOCATION_OPTIONS),
+            'age': '25-34',
+            'created': START
+        }
+
+
+def random_time(rng):
+    return START + timedelta(seconds=rng.randint(0, 3 * 365 * 24 * 3600))
+
+
+def make_reviews(rng, count, profiles):
+    """Review items as embedded in a legacy company document"""
+    for _ in range(count):
+        user_id, gender, ethnicity, location = rng.choice(profiles)
+        yield {
+            '_id': str(ObjectId()),
+            'review': " ".join(rng.choice(WORDS) for _ in range(rng.randint(10, 60))),
+            'rating': rng.randint(1, 5),
+            'user': user_id,
+            'gender': gender,
+            'ethnicity': ethnicity,
+            'location': location,
+            'created': random_time(rng)
+        }
+
+
+def make_interviews(rng, count, profiles):
+    """Interview items as embedded in a legacy company's position array"""
+    for _ in range(count):
+        user_id, gender, ethnicity, location = rng.choice(profiles)
+        yield {
+            '_id': str(ObjectId()),
+            'employee': rng.choice(('y', 'n')),
+            'user': user_id,
+            'user_gender': gender,
+            'user_ethnicity': ethnicity,
+            'user_location': location,
+            'win': rng.choice(('y', 'n', 'o')),
+            'created': random_time(rng)
+        }
+
+
+def company_name(index):
+    """Deterministic company name; doesn't draw from the seeded random stream"""
+    word = NAME_WORDS[index % len(NAME_WORDS)].capitalize()
+    suffix = NAME_SUFFIXES[(index // len(NAME_WORDS)) % len(NAME_SUFFIXES)]
+    return f"{word} {suffix} {index:06d}"
+
+
+def _write_normalized(writer, company_id, name, reviews, interviews):
+    counters = {'review_count': 0, 'rating_sum': 0, 'rating_count': 0, 'interview_counts': {}}
+    last_modified = START
+
+    for review in reviews:
+        writer.add('reviews', dict(review, company_id=company_id, company=name))
+        counters['review_count'] += 1
+        counters['rating_sum'] += review['rating']
+        counters['rating_count'] += 1
+        last_modified = max(last_modified, review['created'])
+
+    for position_key, items in interviews:
+        for interview in items:
+            writer.add('interviews', dict(interview, company_id=company_id, position=position_key))
+            bucket = counters['interview_counts'].setdefault(position_key, {}) \
+                .setdefault(counter_ethnicity(interview['user_ethnicity']), {})
+            for field in (interview['win'], 'total'):
+                bucket[field] = bucket.get(field, 0) + 1
+
+    writer.add('companies', dict(
+        counters, _id=company_id, company=name, name_lower=normalize_company_name(name),
+        created=START, last_modified=last_modified
+    ))
+
+
+def _write_legacy(writer, company_id, name, reviews, interviews):
+    document = {'_id': company_id, 'company': name, 'created': START, 'reviews': list(reviews)}
+    for position_key, items in interviews:
+        document[position_key] = list(items)
+    document['last_modified'] = max((review['created'] for review in document['reviews']), default=START)
+    writer.add('choosytable', document)
+
+
+def seed(db, companies, reviews_per_company, interviews_per_position, users, seed=42, batch_size=1000,
+         skew=0.0, layout='normalized', progress=None):
+    """
+    Seed the benchmark database.
+
+    Args:
+        db: pymongo Database (the collections of the chosen layout are dropped first)
+        companies (int): Number of companies
+        reviews_per_company (int): Average reviews per company
+        interviews_per_position (int): Average interviews per position per company
+        users (int): Number of user profiles, including the mock-auth user
+        skew (float): Zipf exponent for spreading reviews and interviews over
+            companies; 0 gives every company the same number
+        layout (str): 'normalized' or 'legacy'
+        progress (callable): Called with the number of companies written so far
+
+    Returns:
+        dict: Documents written per collection, the ids of the companies and
+        the mock user, and the largest number of reviews any company got
+    """
+    if layout not in LAYOUTS:
+        raise ValueError(f"Unknown layout {layout!r}, expected one of {LAYOUTS}")
+
+    rng = random.Random(seed)
+    collections = ('choosytable',) if layout == 'legacy' else ('users', 'companies', 'reviews', 'interviews')
+    for name in collections:
+        db[name].drop()
+
+    writer = BatchWriter(db, batch_size)
+    profiles = []
+    for user in make_users(rng, max(users, 1)):
+        writer.add('choosytable' if layout == 'legacy' else 'users', user)
+        profiles.append((str(user['_id']), user['gender'], user['ethnicity'], user['location']))
+
+    review_counts = allocate(rng, companies, companies * reviews_per_company, skew)
+    interview_counts = allocate(rng, companies, companies * interviews_per_position, skew)
+    if layout == 'legacy':
+        review_counts = [min(count, MAX_EMBEDDED_ITEMS) for count in review_counts]
+        interview_counts = [min(count, MAX_EMBEDDED_ITEMS // len(POSITION_OPTIONS)) for count in interview_counts]
+    write_company = _write_legacy if layout == 'legacy' else _write_normalized
+
+    company_ids = []
+    for index in range(companies):
+        company_id = ObjectId()
+        reviews = make_reviews(rng, review_counts[index], profiles)
+        interviews = (
+            (position_key, make_interviews(rng, interview_counts[index], profiles))
+            for position_key, _ in POSITION_OPTIONS
+        )
+        write_company(writer, company_id, company_name(index), reviews, interviews)
+        company_ids.append(str(company_id))
+
+        if progress and (index + 1) % 1000 == 0:
+            progress(index + 1)
+
+    writer.flush()
+    return {
+        'totals': writer.totals,
+        'company_ids': company_ids,
+        'mock_user_id': profiles[0][0],
+        'max_reviews': max(review_counts, default=0)
+    }
@@ -0,0 +1,94 @@
+#!/usr/bin/env python3
+"""
+Synthetic Dataset Generator for ChoosyTable
+
+Streams a deterministic, production-shaped dataset into MongoDB (see
+dataset.py). With --skew above 0 a few companies hold most of the reviews
+and interviews, as in production. --layout legacy writes the embedded
+`choosytable` documents instead, to exercise migrate_collections.py at scale.
+
+The target database is dropped and reseeded, so only databases with "bench"
+in their name are accepted unless --force is given.
+
+Usage:
+  python3 benchmarks/generate_dataset.py [--companies N] [--reviews M] [--interviews K]
+      [--users U] [--skew S] [--layout normalized|legacy] [--seed SEED] [--batch-size B]
+      [--uri MONGO_URI] [--force]
+"""
+
+import argparse
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+from pymongo import MongoClient
+
+from dataset import LAYOUTS, seed
+
+BENCH_MONGO_URI = 'mongodb://localhost:27017/choosytable_bench'
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Generate a synthetic ChoosyTable dataset")
+    parser.add_argument('--companies', type=int, default=10000)
+    parser.add_argument('--reviews', type=int, default=100, help="average reviews per company")
+    parser.add_argument('--interviews', type=int, default=5, help="average interviews per position per company")
+    parser.add_argument('--users', type=int, default=50000)
+    parser.add_argument('--skew', type=float, default=1.0,
+                        help="Zipf exponent of reviews per company (0 = uniform)")
+    parser.add_argument('--layout', choices=LAYOUTS, default='normalized')
+    parser.add_argument('--seed', type=int, default=42)
+    parser.add_argument('--batch-size', type=int, default=1000, help="documents per insert_many")
+    parser.add_argument('--uri', default=os.environ.get('MONGO_URI', BENCH_MONGO_URI))
+    parser.add_argument('--force', action='store_true', help="allow seeding a database not named *bench*")
+    args = parser.parse_args()
+
+    client = MongoClient(args.uri)
+    db = client.get_default_database('choosytable_bench')
+    if 'bench' not in db.name and not args.force:
+        print(f"❌ Refusing to reseed '{db.name}'; use a *_bench database or pass --force")
+        sys.exit(1)
+
+    print(f"🌱 Seeding {db.name} ({args.layout} layout, skew {args.skew}, seed {args.seed})")
+    print(f"   {args.companies} companies, ~{args.reviews} reviews each, "
+          f"~{args.interviews} interviews per position, {args.users} users")
+
+    started = time.perf_counter()
+
+    def report(companies_written):
+        elapsed = time.perf_counter() - started
+        print(f"   ⏳ {companies_written}/{args.companies} companies ({elapsed:.0f}s)")
+
+    try:
+        result = seed(
+            db, args.companies, args.reviews, args.interviews, args.users,
+            seed=args.seed, batch_size=args.batch_size, skew=args.skew, layout=args.layout,
+            progress=report
+        )
+    except Exception as e:
+        print(f"❌ Generation failed: {e}")
+        sys.exit(1)
+    finally:
+        client.close()
+
+    elapsed = time.perf_counter() - started
+    written = sum(result['totals'].values())
+    print("=" * 60)
+    print(f"📊 Summary ({elapsed:.1f}s, {written / max(elapsed, 0.001):.0f} documents/s):")
+    for name, count in sorted(result['totals'].items()):
+        print(f"   ✅ {name}: {count} documents")
+    print(f"   🔥 Busiest company: {result['max_reviews']} reviews")
+
+    if args.layout == 'legacy':
+        print("\n💡 Next: python3 migrate_collections.py to split it into the normalized collections")
+    else:
+        print("\n💡 Next: python3 create_indexes.py, then benchmarks/route_benchmark.py --skip-seed")
+
+
+if __name__ == "__main__":
+    print("🏭 ChoosyTable Dataset Generator")
+    print("=" * 60)
+
+    main()
@@ -0,0 +1,354 @@
+#!/usr/bin/env python3
+"""
+Route Benchmark for ChoosyTable
+
+Seeds a local MongoDB with a synthetic dataset (see dataset.py, or seed a
+larger one with generate_dataset.py and pass --skip-seed), then drives
+the main routes, company search and autocomplete with mock authentication
+and reports per-route latency percentiles, throughput, MongoDB operations
+and cache hit ratios.
+
+Two drivers are available:
+- client: the Flask test client, in-process (no web server needed)
+- http:   real HTTP requests against a running server, e.g.
+          USE_MOCK_AUTH=true MONGO_URI=mongodb://localhost:27017/choosytable_bench python3 run.py
+
+Results can be stored as a JSON baseline and later runs compared against it;
+the script exits non-zero when a route's p95 regresses beyond the tolerance.
+
+Usage:
+  python3 benchmarks/route_benchmark.py [--companies N] [--reviews M] [--interviews K]
+      [--users U] [--skew S] [--requests R] [--concurrency C] [--driver client|http] [--url URL]
+      [--skip-seed] [--save FILE] [--compare FILE] [--tolerance PCT]
+"""
+
+import argparse
+import json
+import os
+import random
+import re
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+BENCH_MONGO_URI = 'mongodb://localhost:27017/choosytable_bench'
+
+CSRF_PATTERN = re.compile(r'name="csrf_token"[^>]*value="([^"]+)"')
+
+
+def configure_environment():
+    """Point the app at the benchmark database with mock auth, before it is imported"""
+    os.environ.setdefault('MONGO_URI', BENCH_MONGO_URI)
+    os.environ['USE_MOCK_AUTH'] = 'true'
+    os.environ.setdefault('SECRET_KEY', 'benchmark-only-secret-key-not-for-production')
+
+
+def percentile(sorted_values, pct):
+    if not sorted_values:
+        return 0.0
+    index = min(len(sorted_values) - 1, max(0, int(round(pct / 100.0 * len(sorted_values))) - 1))
+    return sorted_values[index]
+
+
+class ClientDriver:
+    """Flask test client, one signed-in client per worker thread"""
+
+    def __init__(self, app):
+        self.app = app
+        self.app.config['WTF_CSRF_ENABLED'] = False
+        self.local = threading.local()
+
+    def _client(self):
+        if not hasattr(self.local, 'client'):
+            self.local.client = self.app.test_client()
+            self.local.client.get('/mock/login').close()
+        return self.local.client
+
+    def request(self, method, path, data=None):
+        response = self._client().open(path, method=method, data=data)
+        status = response.status_code
+        # Runs deferred cache invalidations, as a WSGI server would
+        response.close()
+        return status
+
+
+class HttpDriver:
+    """HTTP requests against a running server, one session per worker thread"""
+
+    def __init__(self, base_url):
+        import requests
+        self.requests = requests
+        self.base_url = base_url.rstrip('/')
+        self.local = threading.local()
+
+    def _session(self):
+        if not hasattr(self.local, 'session'):
+            session = self.requests.Session()
+            session.get(self.base_url + '/mock/login')
+            match = CSRF_PATTERN.search(session.get(self.base_url + '/company').text)
+            self.local.csrf_token = match.group(1) if match else None
+            self.local.session = session
+        return self.local.session
+
+    def request(self, method, path, data=None):
+        session = self._session()
+        if data is not None and self.local.csrf_token:
+            data = dict(data, csrf_token=self.local.csrf_token)
+        response = session.request(method, self.base_url + path, data=data, allow_redirects=False)
+        return response.status_code
+
+
+def build_scenarios(company_ids, company_names, rng):
+    """(name, expected status, request factory) covering the main read and write routes"""
+    from urllib.parse import quote
+
+    from app.constants import ETHNICITY_OPTIONS, POSITION_OPTIONS
+
+    listing_pages = max(1, len(company_ids) // 10)
+    words = sorted({word for name in company_names for word in name.split() if not word.isdigit()}) or ['company']
+
+    def company_listing():
+        return 'GET', f"/company?p={rng.randint(1, listing_pages)}", None
+
+    def single_company():
+        return 'GET', f"/company/{rng.choice(company_ids)}?p={rng.randint(1, 3)}", None
+
+    def home():
+        return 'GET', "/home", None
+
+    def search():
+        return 'GET', f"/company/search?q={quote(rng.choice(words))}", None
+
+    def autocomplete():
+        # What a user has typed so far: the first 1-6 characters of a name
+        name = rng.choice(company_names) if company_names else rng.choice(words)
+        return 'GET', f"/api/companies/autocomplete?q={quote(name[:rng.randint(1, 6)])}", None
+
+    def post_review():
+        return 'POST', f"/company/{rng.choice(company_ids)}", {
+            'company': 'benchmark', 'reviews': 'benchmark review', 'rating': str(rng.randint(1, 5))
+        }
+
+    def post_interview():
+        return 'POST', f"/company/{rng.choice(company_ids)}", {
+            'ie': rng.choice(ETHNICITY_OPTIONS),
+            'position': rng.choice(POSITION_OPTIONS)[0],
+            'employee': 'n',
+            'win': rng.choice(('y', 'n', 'o'))
+        }
+
+    return [
+        ('GET /company', 200, company_listing),
+        ('GET /company/<id>', 200, single_company),
+        ('GET /home', 200, home),
+        ('GET /company/search', 200, search),
+        ('GET /api/companies/autocomplete', 200, autocomplete),
+        # Successful posts redirect back to the company page
+        ('POST /company/<id> review', 302, post_review),
+        ('POST /company/<id> interview', 302, post_interview),
+    ]
+
+
+def mongo_opcounters(db):
+    try:
+        return dict(db.command('serverStatus')['opcounters'])
+    except Exception:
+        return {}
+
+
+def memcached_counters(host):
+    try:
+        from pymemcache.client.base import Client
+        client = Client(host)
+        stats = client.stats()
+        client.close()
+        return {'hits': int(stats.get(b'get_hits', 0)), 'misses': int(stats.get(b'get_misses', 0))}
+    except Exception:
+        return {}
+
+
+def hit_ratio(before, after):
+    if not before or not after:
+        return None
+    hits = after['hits'] - before['hits']
+    misses = after['misses'] - before['misses']
+    return round(hits / (hits + misses), 4) if hits + misses else None
+
+
+def run_scenario(driver, factory, expected_status, total, concurrency):
+    latencies, errors = [], 0
+    lock = threading.Lock()
+
+    def one(_):
+        nonlocal errors
+        method, path, data = factory()
+        started = time.perf_counter()
+        try:
+            status = driver.request(method, path, data)
+        except Exception:
+            status = 599
+        elapsed = time.perf_counter() - started
+        with lock:
+            latencies.append(elapsed)
+            if status != expected_status:
+                errors += 1
+
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        list(pool.map(one, range(total)))
+    return latencies, errors, time.perf_counter() - started
+
+
+def benchmark(args):
+    configure_environment()
+
+    import app as app_module
+    from dataset import seed
+
+    db = app_module.db
+    memcached_host = os.environ.get('MEMCACHED_HOST', 'localhost')
+
+    if not args.skip_seed:
+        if 'bench' not in db.name and not args.force:
+            print(f"❌ Refusing to reseed '{db.name}'; use a *_bench database or pass --force")
+            sys.exit(1)
+        print(f"🌱 Seeding {db.name}: {args.companies} companies, ~{args.reviews} reviews each "
+              f"(skew {args.skew}), ~{args.interviews} interviews per position, {args.users} users")
+        started = time.perf_counter()
+        seeded = seed(db, args.companies, args.reviews, args.interviews, args.users,
+                      seed=args.seed, skew=args.skew)
+        print(f"   ✅ {seeded['totals']} in {time.perf_counter() - started:.1f}s")
+        company_ids = seeded['company_ids']
+    else:
+        company_ids = [str(doc['_id']) for doc in db.companies.find({}, {'_id': 1})]
+
+    if not company_ids:
+        print("❌ No companies to benchmark")
+        sys.exit(1)
+
+    company_names = [doc['company'] for doc in db.companies.find({}, {'company': 1}).limit(1000)]
+
+    if args.driver == 'http':
+        driver = HttpDriver(args.url)
+    else:
+        driver = ClientDriver(app_module.app)
+
+    rng = random.Random(args.seed)
+    results = {}
+    print(f"\n🚀 {args.requests} requests per route, concurrency {args.concurrency}, driver {args.driver}")
+    print("=" * 96)
+    print(f"{'route':<32}{'p50 ms':>9}{'p95 ms':>9}{'p99 ms':>9}{'req/s':>9}{'errors':>8}"
+          f"{'mongo ops/req':>15}{'mc hit':>8}")
+
+    for name, expected_status, factory in build_scenarios(company_ids, company_names, rng):
+        run_scenario(driver, factory, expected_status, args.warmup, args.concurrency)
+
+        ops_before, mc_before = mongo_opcounters(db), memcached_counters(memcached_host)
+        local_before = app_module.cache.stats()['local'] if args.driver == 'client' else None
+        latencies, errors, elapsed = run_scenario(driver, factory, expected_status, args.requests, args.concurrency)
+        ops_after, mc_after = mongo_opcounters(db), memcached_counters(memcached_host)
+
+        latencies.sort()
+        mongo_ops = {op: ops_after[op] - ops_before.get(op, 0) for op in ops_after}
+        result = {
+            'count': len(latencies),
+            'errors': errors,
+            'p50_ms': round(percentile(latencies, 50) * 1000, 3),
+            'p95_ms': round(percentile(latencies, 95) * 1000, 3),
+            'p99_ms': round(percentile(latencies, 99) * 1000, 3),
+            'mean_ms': round(sum(latencies) / len(latencies) * 1000, 3),
+            'throughput_rps': round(len(latencies) / elapsed, 1),
+            'mongo_ops': mongo_ops,
+            'mongo_ops_per_request': round(sum(mongo_ops.values()) / len(latencies), 2) if mongo_ops else None,
+            'memcached_hit_ratio': hit_ratio(mc_before, mc_after)
+        }
+        if local_before is not None:
+            local_after = app_module.cache.stats()['local']
+            result['local_hit_ratio'] = hit_ratio(local_before, local_after)
+        results[name] = result
+
+        print(f"{name:<32}{result['p50_ms']:>9.2f}{result['p95_ms']:>9.2f}{result['p99_ms']:>9.2f}"
+              f"{result['throughput_rps']:>9.1f}{errors:>8}"
+              f"{str(result['mongo_ops_per_request']):>15}{str(result['memcached_hit_ratio']):>8}")
+
+    return {
+        'meta': {
+            'timestamp': datetime.now().isoformat(timespec='seconds'),
+            'driver': args.driver,
+            'requests': args.requests,
+            'concurrency': args.concurrency,
+            'dataset': {
+                'companies': len(company_ids), 'reviews_per_company': args.reviews,
+                'interviews_per_position': args.interviews, 'users': args.users, 'seed': args.seed,
+                'skew': args.skew
+            }
+        },
+        'routes': results
+    }
+
+
+def compare(baseline, current, tolerance):
+    """Print p95 changes against a baseline and return the regressed routes"""
+    regressions = []
+    print(f"\n📈 Comparison with baseline from {baseline['meta']['timestamp']} (tolerance {tolerance}%)")
+    for setting in ('driver', 'requests', 'concurrency', 'dataset'):
+        if baseline['meta'].get(setting) != current['meta'][setting]:
+            print(f"   ⚠️  {setting} differs from the baseline: {baseline['meta'].get(setting)} → {current['meta'][setting]}")
+    for name, result in current['routes'].items():
+        before = baseline['routes'].get(name)
+        if not before or not before['p95_ms']:
+            print(f"   ⏭️  {name}: no baseline")
+            continue
+        change = (result['p95_ms'] - before['p95_ms']) / before['p95_ms'] * 100
+        regressed = change > tolerance
+        if regressed:
+            regressions.append(name)
+        print(f"   {'❌' if regressed else '✅'} {name}: p95 {before['p95_ms']:.2f} → {result['p95_ms']:.2f} ms "
+              f"({change:+.1f}%)")
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark ChoosyTable routes")
+    parser.add_argument('--companies', type=int, default=200)
+    parser.add_argument('--reviews', type=int, default=20, help="average reviews per company")
+    parser.add_argument('--interviews', type=int, default=2, help="average interviews per position per company")
+    parser.add_argument('--users', type=int, default=500)
+    parser.add_argument('--seed', type=int, default=42)
+    parser.add_argument('--skew', type=float, default=1.0,
+                        help="Zipf exponent of reviews per company (0 = uniform)")
+    parser.add_argument('--skip-seed', action='store_true', help="reuse the data already in the database")
+    parser.add_argument('--force', action='store_true', help="allow seeding a database not named *bench*")
+    parser.add_argument('--requests', type=int, default=500, help="measured requests per route")
+    parser.add_argument('--warmup', type=int, default=20, help="unmeasured requests per route")
+    parser.add_argument('--concurrency', type=int, default=4)
+    parser.add_argument('--driver', choices=('client', 'http'), default='client')
+    parser.add_argument('--url', default='http://localhost:5000', help="server for the http driver")
+    parser.add_argument('--save', help="write the results as a JSON baseline")
+    parser.add_argument('--compare', help="compare against a JSON baseline")
+    parser.add_argument('--tolerance', type=float, default=20.0, help="allowed p95 regression in percent")
+    args = parser.parse_args()
+
+    results = benchmark(args)
+
+    if args.save:
+        with open(args.save, 'w') as f:
+            json.dump(results, f, indent=2)
+        print(f"\n💾 Baseline written to {args.save}")
+
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)
+        if compare(baseline, results, args.tolerance):
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    print("⏱️  ChoosyTable Route Benchmark")
+    print("=" * 60)
+
+    main()
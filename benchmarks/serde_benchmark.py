@@ -0,0 +1,100 @@
+#!/usr/bin/env python3
+"""
+Cache Serializer Micro-benchmark for ChoosyTable
+
+Compares encode/decode time and payload size of the cache serdes in
+app/serde.py on realistic cached values: a company document, a company
+listing page and a user's review list.
+
+Usage: python3 benchmarks/serde_benchmark.py [--iterations N]
+"""
+
+import argparse
+import os
+import random
+import sys
+import timeit
+from datetime import datetime, timedelta
+
+from bson import ObjectId
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+from app.constants import ETHNICITY_OPTIONS, GENDER_OPTIONS, LOCATION_OPTIONS, POSITION_OPTIONS
+from app.serde import JsonSerde, BsonSerde, MsgpackSerde, msgpack
+
+WORDS = "great team culture inclusive interview process slow feedback management support growth".split()
+
+def make_review(rng, company_id, company_name):
+    return {
+        '_id': str(ObjectId()),
+        'company_id': company_id,
+        'company': company_name,
+        'review': " ".join(rng.choice(WORDS) for _ in range(rng.randint(20, 80))),
+        'rating': rng.randint(1, 5),
+        'user': str(ObjectId()),
+        'gender': rng.choice(GENDER_OPTIONS),
+        'ethnicity': rng.choice(ETHNICITY_OPTIONS),
+        'location': rng.choice(LOCATION_OPTIONS),
+        'created': datetime(2024, 1, 1) + timedelta(minutes=rng.randint(0, 500000))
+    }
+
+def make_company(rng):
+    interview_counts = {}
+    for position_key, _ in rng.sample(POSITION_OPTIONS, 8):
+        interview_counts[position_key] = {
+            ethnicity: {'y': rng.randint(0, 20), 'n': rng.randint(0, 20), 'o': rng.randint(0, 5), 'total': 45}
+            for ethnicity in rng.sample(ETHNICITY_OPTIONS, 5)
+        }
+    return {
+        '_id': ObjectId(),
+        'company': f"Company {rng.randint(1, 10**6)}",
+        'created': datetime(2023, 6, 1),
+        'last_modified': datetime(2024, 6, 1),
+        'review_count': rng.randint(1, 500),
+        'interview_counts': interview_counts
+    }
+
+def make_samples(rng):
+    company = make_company(rng)
+    listing_page = [
+        {'_id': ObjectId(), 'company': f"Company {i}", 'last_modified': datetime(2024, 6, 1), 'review_count': i}
+        for i in range(10)
+    ]
+    user_reviews = [make_review(rng, ObjectId(), f"Company {i}") for i in range(50)]
+    return {'company document': company, 'listing page': listing_page, 'user reviews (50)': user_reviews}
+
+def bench(serde, value, iterations):
+    payload, flags = serde.serialize('key', value)
+    encoded = payload.encode() if isinstance(payload, str) else payload
+    encode_time = timeit.timeit(lambda: serde.serialize('key', value), number=iterations) / iterations
+    decode_time = timeit.timeit(lambda: serde.deserialize('key', encoded, flags), number=iterations) / iterations
+    return encode_time, decode_time, len(encoded)
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark ChoosyTable cache serdes")
+    parser.add_argument('--iterations', type=int, default=2000)
+    args = parser.parse_args()
+
+    serdes = [
+        ('json_util', JsonSerde()),
+        ('bson', BsonSerde()),
+        ('bson+zlib', BsonSerde(compress_threshold=1)),
+    ]
+    if msgpack is not None:
+        serdes += [('msgpack', MsgpackSerde()), ('msgpack+zlib', MsgpackSerde(compress_threshold=1))]
+    else:
+        print("⚠️  msgpack not installed - skipping msgpack serdes")
+
+    for sample_name, value in make_samples(random.Random(42)).items():
+        print(f"\n📦 {sample_name}")
+        print(f"   {'serde':<14}{'encode µs':>12}{'decode µs':>12}{'bytes':>10}")
+        for serde_name, serde in serdes:
+            encode_time, decode_time, size = bench(serde, value, args.iterations)
+            print(f"   {serde_name:<14}{encode_time * 1e6:>12.1f}{decode_time * 1e6:>12.1f}{size:>10}")
+
+if __name__ == "__main__":
+    print("⏱️  Cache Serializer Benchmark")
+    print("=" * 60)
+
+    main()
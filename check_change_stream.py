@@ -0,0 +1,138 @@
+#!/usr/bin/env python3
+"""
+Change Stream Invalidation Check for ChoosyTable
+
+Runs the cache invalidation worker (app/change_stream.py) against a local
+single-node replica set and memcached. It writes around the app, directly
+with pymongo, and checks that:
+
+- a review inserted outside the app clears the company's cache entry and
+  corrects the company's counters
+- changes made while the worker is stopped are applied when it resumes
+  from its stored token
+- a profile edit clears the user's entry, a login timestamp alone doesn't
+- with --pre-images, a deleted review is traced back to its company
+
+Start a replica set with:
+    mongod --replSet rs0 --dbpath /tmp/rs0 && mongosh --eval 'rs.initiate()'
+
+Usage: MONGO_URI=mongodb://localhost:27017/choosytable_check?replicaSet=rs0 \\
+       python3 check_change_stream.py [--pre-images]
+"""
+
+import argparse
+import sys
+import uuid
+from datetime import datetime
+
+from bson import ObjectId
+
+from app import cache_manager, db
+from app import repository
+from app.change_stream import InvalidationWorker
+
+WORKER_NAME = 'change_stream_check'
+
+def check(ok, message, failures):
+    print(f"   {'✅' if ok else '❌'} {message}")
+    if not ok:
+        failures.append(message)
+
+def cached(name, **params):
+    key = cache_manager.key(name, **params)
+    return key is not None and cache_manager.cache.client.get(key) is not None
+
+def run(args, failures):
+    marker = uuid.uuid4().hex[:8]
+    worker = InvalidationWorker(name=WORKER_NAME, batch_wait=0.2, pre_images=args.pre_images)
+    worker.reset()
+    worker.run(stop_when_idle=True)
+
+    company_id = str(repository.create_company(f"Change stream check {marker}", {
+        'review': 'written by the app', 'rating': 5, 'user': f"check-{marker}"
+    }))
+    user_id = db.users.insert_one({'email': f"check-{marker}@example.com", 'gender': 'x'}).inserted_id
+    worker.run(stop_when_idle=True)
+
+    print("📝 Review inserted outside the app")
+    cache_manager.set('company', repository.find_company(company_id), company_id=company_id)
+    check(cached('company', company_id=company_id), "company entry is cached", failures)
+    external_review = db.reviews.insert_one({
+        '_id': str(ObjectId()), 'company_id': ObjectId(company_id), 'company': 'Change stream check',
+        'review': 'written outside the app', 'rating': 3, 'user': f"check-{marker}", 'created': datetime.now()
+    }).inserted_id
+    worker.run(stop_when_idle=True)
+    company = repository.find_company(company_id)
+    check(not cached('company', company_id=company_id), "company entry was cleared", failures)
+    check(company['review_count'] == 2 and company['rating_sum'] == 8, "company counters were corrected", failures)
+
+    print("\n⏸️  Changes while the worker is stopped")
+    cache_manager.set('company', repository.find_company(company_id), company_id=company_id)
+    db.companies.update_one({'_id': ObjectId(company_id)}, {'$set': {'company': f"Renamed {marker}"}})
+    resumed = InvalidationWorker(name=WORKER_NAME, batch_wait=0.2, pre_images=args.pre_images)
+    stats = resumed.run(stop_when_idle=True)
+    check(stats['changes'] >= 1, "a new worker resumed from the stored token", failures)
+    check(not cached('company', company_id=company_id), "the rename cleared the company entry", failures)
+
+    print("\n👤 Profile edits")
+    email = f"check-{marker}@example.com"
+    cache_manager.set('user_by_email', db.users.find_one({'_id': user_id}), email=email)
+    db.users.update_one({'_id': user_id}, {'$set': {'last_login': datetime.now()}})
+    resumed.run(stop_when_idle=True)
+    check(cached('user_by_email', email=email), "a login timestamp keeps the user entry", failures)
+    db.users.update_one({'_id': user_id}, {'$set': {'gender': 'y'}})
+    resumed.run(stop_when_idle=True)
+    check(not cached('user_by_email', email=email), "a profile edit cleared the user entry", failures)
+
+    print("\n🗑️  Review deleted outside the app")
+    db.reviews.delete_one({'_id': external_review})
+    resumed.run(stop_when_idle=True)
+    if args.pre_images:
+        company = repository.find_company(company_id)
+        check(company['review_count'] == 1 and company['rating_sum'] == 5,
+              "counters were corrected from the pre-image", failures)
+    else:
+        print(f"   ⚠️  {resumed.stats['unresolved']} deletes without a pre-image (rerun with --pre-images)")
+
+    db.reviews.delete_many({'company_id': ObjectId(company_id)})
+    db.companies.delete_one({'_id': ObjectId(company_id)})
+    db.users.delete_one({'_id': user_id})
+    resumed.run(stop_when_idle=True)
+    resumed.reset()
+
+def main():
+    parser = argparse.ArgumentParser(description="Check change-stream cache invalidation")
+    parser.add_argument('--pre-images', action='store_true', help="enable and use pre-images (MongoDB 6.0+)")
+    args = parser.parse_args()
+
+    try:
+        hello = db.command('hello')
+    except Exception as e:
+        print(f"❌ Failed to connect to MongoDB: {e}")
+        sys.exit(1)
+    if 'setName' not in hello:
+        print("❌ Change streams need a replica set; start mongod with --replSet (see --help)")
+        sys.exit(1)
+    print(f"🔗 Connected to replica set {hello['setName']}, database {db.name}")
+    print()
+
+    failures = []
+    try:
+        if args.pre_images:
+            InvalidationWorker.enable_pre_images()
+        run(args, failures)
+    except Exception as e:
+        print(f"❌ Change stream check failed: {e}")
+        failures.append(str(e))
+
+    print("=" * 60)
+    if failures:
+        print(f"❌ {len(failures)} checks failed")
+        sys.exit(1)
+    print("✅ Changes made outside the app reach the cache")
+
+if __name__ == "__main__":
+    print("🔄 Change Stream Invalidation Check")
+    print("=" * 60)
+
+    main()
@@ -0,0 +1,153 @@
+#!/usr/bin/env python3
+"""
+Memcached Failover Check for ChoosyTable
+
+Starts several local memcached processes and spreads keys over them with the
+client the app builds for a comma-separated MEMCACHED_HOST. Then it stops
+one node and checks that:
+
+- keys on the surviving nodes stay where they were and are still served
+- once the client marks the stopped node dead, only its keys move, and they
+  move to the surviving nodes
+- a replicated hot key stays readable throughout
+
+Usage: python3 check_memcached_failover.py [--nodes N] [--keys K] [--base-port P]
+       [--replicas R] [--memcached CMD]
+"""
+
+import argparse
+import shlex
+import socket
+import subprocess
+import sys
+import time
+from collections import Counter
+
+from app.cache import KEY_PREFIX
+from app.memcached import ReplicatingClient, make_memcached_client
+from app.serde import make_serde
+
+def start_node(command, port):
+    """Start one memcached process and wait until it accepts connections."""
+    process = subprocess.Popen(
+        shlex.split(command) + ['-p', str(port), '-l', '127.0.0.1', '-U', '0'],
+        stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL
+    )
+    deadline = time.monotonic() + 5
+    while time.monotonic() < deadline:
+        try:
+            socket.create_connection(('127.0.0.1', port), timeout=0.2).close()
+            return process
+        except OSError:
+            time.sleep(0.05)
+    process.kill()
+    raise RuntimeError(f"memcached did not start on port {port}")
+
+def check(ok, message, failures):
+    print(f"   {'✅' if ok else '❌'} {message}")
+    if not ok:
+        failures.append(message)
+
+def run(args, failures):
+    servers = [('127.0.0.1', args.base_port + index) for index in range(args.nodes)]
+    client = make_memcached_client(
+        servers, make_serde('bson'), connect_timeout=0.25, timeout=0.5,
+        dead_retry_attempts=1, dead_retry_timeout=0, dead_timeout=600
+    )
+    hot_client = ReplicatingClient(client, [KEY_PREFIX + 'companies_page'], replicas=args.replicas)
+    nodes = list(client.clients)
+
+    keys = [f"{KEY_PREFIX}failover:{index}" for index in range(args.keys)]
+    client.set_many({key: {'index': index} for index, key in enumerate(keys)}, 600, noreply=False)
+    # A listing page whose copies landed on different nodes, so the check
+    # below exercises the fallback between copies
+    for page in range(1000):
+        hot_key = f"{KEY_PREFIX}companies_page:1:{page * 10}:10"
+        hot_nodes = {client.hasher.get_node(key) for key in hot_client.replica_keys(hot_key)}
+        if len(hot_nodes) > 1:
+            break
+    hot_client.set(hot_key, {'companies': ['hot']}, 600, noreply=False)
+
+    before = {key: client.hasher.get_node(key) for key in keys}
+    print("📊 Keys per node:")
+    for node, count in sorted(Counter(before.values()).items()):
+        print(f"   • {node}: {count}")
+    print(f"   🔥 {hot_key} stored on {len(hot_nodes)} nodes")
+    check(len(client.get_many(keys)) == len(keys), "every key is readable with all nodes up", failures)
+
+    # Stop the node holding the hot key itself
+    victim = client.hasher.get_node(hot_key)
+    process = args.processes[nodes.index(victim)]
+    print(f"\n🔌 Stopping {victim}")
+    process.terminate()
+    process.wait()
+
+    # Reads while the client discovers the failure and marks the node dead
+    survivors_missing, errors = 0, 0
+    for key in keys:
+        try:
+            value = client.get(key)
+        except Exception:
+            errors += 1
+            continue
+        if value is None and before[key] != victim:
+            survivors_missing += 1
+    print(f"   ⚠️  {errors} errors while the client noticed the failure")
+    check(survivors_missing == 0, "keys on surviving nodes are still served", failures)
+
+    hot_reads = [hot_client.get(hot_key) for _ in range(20)]
+    check(all(value is not None for value in hot_reads), "the replicated hot key stays readable", failures)
+
+    after = {key: client.hasher.get_node(key) for key in keys}
+    moved = [key for key in keys if before[key] != after[key]]
+    check(all(before[key] == victim for key in moved), "only the stopped node's keys moved", failures)
+    check(all(after[key] != victim for key in keys), "no key hashes to the stopped node any more", failures)
+    print("📊 Keys per node after failover:")
+    for node, count in sorted(Counter(after.values()).items()):
+        print(f"   • {node}: {count}")
+
+    # The app recomputes what was lost; afterwards everything is served again
+    client.set_many({key: {'index': index} for index, key in enumerate(keys) if key in moved}, 600, noreply=False)
+    check(len(client.get_many(keys)) == len(keys), "every key is readable after rewriting the lost ones", failures)
+
+def main():
+    parser = argparse.ArgumentParser(description="Check memcached redistribution when a node drops")
+    parser.add_argument('--nodes', type=int, default=3)
+    parser.add_argument('--keys', type=int, default=3000)
+    parser.add_argument('--base-port', type=int, default=21211)
+    parser.add_argument('--replicas', type=int, default=2, help="copies of the hot key")
+    parser.add_argument('--memcached', default='memcached', help="command that starts a memcached server")
+    args = parser.parse_args()
+
+    if args.nodes < 2:
+        print("❌ Failover needs at least 2 nodes")
+        sys.exit(1)
+
+    args.processes = []
+    failures = []
+    try:
+        for index in range(args.nodes):
+            args.processes.append(start_node(args.memcached, args.base_port + index))
+        print(f"🚀 Started {args.nodes} memcached nodes on ports {args.base_port}-{args.base_port + args.nodes - 1}")
+        print()
+        run(args, failures)
+    except Exception as e:
+        print(f"❌ Failover check failed: {e}")
+        failures.append(str(e))
+    finally:
+        for process in args.processes:
+            if process.poll() is None:
+                process.terminate()
+                process.wait()
+
+    print("=" * 60)
+    if failures:
+        print(f"❌ {len(failures)} checks failed")
+        sys.exit(1)
+    print("✅ Keys redistribute cleanly when a node drops")
+
+if __name__ == "__main__":
+    print("🧪 Memcached Failover Check")
+    print("=" * 60)
+
+    main()
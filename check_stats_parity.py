@@ -0,0 +1,49 @@
+#!/usr/bin/env python3
+"""
+Statistics Backend Parity Check for ChoosyTable
+
+Runs the Python and MongoDB aggregation statistics backends side by side
+against a local mongod and reports any company where they disagree.
+
+Usage: python3 check_stats_parity.py [company_id ...]
+"""
+
+import os
+import sys
+from pymongo import MongoClient
+
+from app.constants import POSITION_OPTIONS
+from app.stats import check_parity
+
+def main(company_ids):
+    """Run the parity check and exit non-zero on any mismatch."""
+    
+    try:
+        mongo_uri = os.environ.get('MONGO_URI', 'mongodb://localhost:27017/choosytable')
+        client = MongoClient(mongo_uri)
+        db = client.choosytable
+        print("🔗 Connected to MongoDB")
+    except Exception as e:
+        print(f"❌ Failed to connect to MongoDB: {e}")
+        sys.exit(1)
+    
+    mismatches = check_parity(db, POSITION_OPTIONS, company_ids or None)
+    
+    for mismatch in mismatches:
+        print(f"❌ {mismatch['company_id']}")
+        print(f"   🐍 python:      {mismatch['python']}")
+        print(f"   🗄️  aggregation: {mismatch['aggregation']}")
+    
+    client.close()
+    
+    print("=" * 60)
+    if mismatches:
+        print(f"❌ {len(mismatches)} companies differ between backends")
+        sys.exit(1)
+    print("✅ Python and aggregation backends agree")
+
+if __name__ == "__main__":
+    print("🧮 Statistics Backend Parity Check")
+    print("=" * 60)
+    
+    main(sys.argv[1:])
@@ -2,121 +2,96 @@
 """
 MongoDB Index Creation Script for ChoosyTable
 
-This script creates the necessary indexes to optimize database performance.
-Run this script after setting up your MongoDB database.
+Converges the database on the index spec in app/indexes.py: missing indexes
+are created, indexes whose definition changed are rebuilt and, with
+--drop-extra, indexes no query needs are dropped. --verify explains every
+canonical app query and exits non-zero if any of them scans a collection.
 
-Usage: python3 create_indexes.py
+Usage: python3 create_indexes.py [--dry-run] [--drop-extra] [--verify]
 """
 
+import argparse
 import os
-from pymongo import MongoClient, ASCENDING, DESCENDING
+from pymongo import MongoClient
 import sys
 
-def create_indexes():
-    """Create all necessary indexes for optimal query performance."""
-    
-    # MongoDB connection
+from app.indexes import plan_index_changes, apply_index_changes, verify_query_plans
+
+def connect():
+    """Connect to MongoDB or exit."""
     try:
         mongo_uri = os.environ.get('MONGO_URI', 'mongodb://localhost:27017/choosytable')
         client = MongoClient(mongo_uri)
         db = client.choosytable
-        collection = db.choosytable
         
         print("🔗 Connected to MongoDB")
         print(f"📊 Database: {db.name}")
-        print(f"📋 Collection: {collection.name}")
         print()
+        return client, db
         
     except Exception as e:
         print(f"❌ Failed to connect to MongoDB: {e}")
         sys.exit(1)
+
+def create_indexes(db, dry_run=False, drop_extra=False):
+    """Diff the index spec against the database and apply the changes."""
     
-    indexes_to_create = [
-        {
-            'name': 'email_index',
-            'keys': [('email', ASCENDING)],
-            'description': 'Fast user lookup by email for authentication'
-        },
-        {
-            'name': 'reviews_user_index', 
-            'keys': [('reviews.user', ASCENDING)],
-            'description': 'Fast lookup of reviews by user ID'
-        },
-        {
-            'name': 'last_modified_index',
-            'keys': [('last_modified', DESCENDING)],
-            'description': 'Efficient sorting by modification date'
-        },
-        {
-            'name': 'reviews_exists_last_modified',
-            'keys': [('reviews', ASCENDING), ('last_modified', DESCENDING)],
-            'description': 'Compound index for companies with reviews, sorted by date'
-        },
-        {
-            'name': 'company_name_index',
-            'keys': [('company', ASCENDING)],
-            'description': 'Fast company lookup by name'
-        },
-        {
-            'name': 'reviews_id_index',
-            'keys': [('reviews._id', ASCENDING)],
-            'description': 'Fast review lookup by review ID'
-        },
-        {
-            'name': 'user_id_index',
-            'keys': [('_id', ASCENDING)],
-            'description': 'Ensure _id index exists (usually automatic)'
-        }
-    ]
+    plan = plan_index_changes(db)
     
-    print("🚀 Creating indexes...")
+    print("🚀 Synchronizing indexes" + (" (dry run)" if dry_run else ""))
     print("=" * 60)
     
-    created_count = 0
-    skipped_count = 0
+    for spec in plan['unchanged']:
+        print(f"⏭️  {spec['collection']}.{spec['name']}: Up to date - skipped")
+    for spec in plan['create']:
+        print(f"✅ {spec['collection']}.{spec['name']}: Create")
+        print(f"   📝 {spec['description']}")
+    for spec in plan['rebuild']:
+        print(f"🔁 {spec['collection']}.{spec['name']}: Definition changed - rebuild")
+        print(f"   📝 {spec['description']}")
+    for index in plan['extra']:
+        action = "drop" if drop_extra else "not in spec (use --drop-extra to drop)"
+        print(f"🗑️  {index['collection']}.{index['name']} {dict(index['keys'])}: {action}")
     
-    for index_info in indexes_to_create:
+    if not dry_run:
         try:
-            # Check if index already exists
-            existing_indexes = collection.list_indexes()
-            index_exists = any(
-                idx.get('name') == index_info['name'] 
-                for idx in existing_indexes
-            )
-            
-            if index_exists:
-                print(f"⏭️  {index_info['name']}: Already exists - skipped")
-                skipped_count += 1
-                continue
-            
-            # Create the index
-            collection.create_index(
-                index_info['keys'], 
-                name=index_info['name'],
-                background=True  # Create in background to avoid blocking
-            )
-            
-            print(f"✅ {index_info['name']}: Created successfully")
-            print(f"   📝 {index_info['description']}")
-            created_count += 1
-            
+            apply_index_changes(db, plan, drop_extra=drop_extra)
         except Exception as e:
-            print(f"❌ {index_info['name']}: Failed to create - {e}")
+            print(f"❌ Failed to apply index changes: {e}")
+            sys.exit(1)
     
     print("=" * 60)
     print(f"📊 Summary:")
-    print(f"   ✅ Created: {created_count} indexes")
-    print(f"   ⏭️  Skipped: {skipped_count} indexes (already existed)")
+    print(f"   ✅ Created: {len(plan['create'])} indexes")
+    print(f"   🔁 Rebuilt: {len(plan['rebuild'])} indexes")
+    print(f"   ⏭️  Skipped: {len(plan['unchanged'])} indexes (already existed)")
+    print(f"   🗑️  Extra: {len(plan['extra'])} indexes" + (" dropped" if drop_extra and not dry_run else ""))
     
     # Display all current indexes
-    print(f"\n📋 Current indexes in {collection.name}:")
-    for idx in collection.list_indexes():
-        index_name = idx.get('name', 'unnamed')
-        key_info = idx.get('key', {})
-        print(f"   • {index_name}: {dict(key_info)}")
+    for collection_name in ('users', 'companies', 'reviews', 'interviews'):
+        print(f"\n📋 Current indexes in {collection_name}:")
+        for idx in db[collection_name].list_indexes():
+            index_name = idx.get('name', 'unnamed')
+            key_info = idx.get('key', {})
+            print(f"   • {index_name}: {dict(key_info)}")
+
+def verify_indexes(db):
+    """Explain every canonical query; return False if any does a COLLSCAN."""
     
-    print("\n🎉 Index creation completed!")
-    client.close()
+    print("\n🔬 Verifying query plans...")
+    print("=" * 60)
+    
+    ok = True
+    for result in verify_query_plans(db):
+        if result['collscan']:
+            ok = False
+            print(f"❌ {result['name']}: COLLSCAN ({' > '.join(result['stages'])})")
+        else:
+            print(f"✅ {result['name']}: {', '.join(result['indexes']) or result['stages'][-1]}")
+    
+    print("=" * 60)
+    print("🎉 Every query is index-backed" if ok else "⚠️  Some queries scan whole collections")
+    return ok
 
 def check_index_usage():
     """Check if indexes are being used effectively (optional diagnostic)."""
@@ -125,17 +100,17 @@ def check_index_usage():
         mongo_uri = os.environ.get('MONGO_URI', 'mongodb://localhost:27017/choosytable')
         client = MongoClient(mongo_uri)
         db = client.choosytable
-        collection = db.choosytable
         
         print("\n🔍 Checking index usage statistics...")
         
-        # Get index stats
-        stats = db.command("collStats", "choosytable", indexDetails=True)
-        
-        if 'indexSizes' in stats:
-            print("\n📊 Index sizes:")
-            for index_name, size in stats['indexSizes'].items():
-                print(f"   • {index_name}: {size} bytes")
+        for collection_name in ('users', 'companies', 'reviews', 'interviews'):
+            # Get index stats
+            stats = db.command("collStats", collection_name, indexDetails=True)
+            
+            if 'indexSizes' in stats:
+                print(f"\n📊 Index sizes ({collection_name}):")
+                for index_name, size in stats['indexSizes'].items():
+                    print(f"   • {index_name}: {size} bytes")
         
         client.close()
         
@@ -146,12 +121,24 @@ if __name__ == "__main__":
     print("🗄️  MongoDB Index Creation Script")
     print("=" * 60)
     
-    create_indexes()
+    parser = argparse.ArgumentParser(description="Synchronize and verify ChoosyTable indexes")
+    parser.add_argument('--dry-run', action='store_true', help="show the changes without applying them")
+    parser.add_argument('--drop-extra', action='store_true', help="drop indexes that are not in the spec")
+    parser.add_argument('--verify', action='store_true', help="fail if any app query does a COLLSCAN")
+    args = parser.parse_args()
+    
+    client, db = connect()
+    create_indexes(db, dry_run=args.dry_run, drop_extra=args.drop_extra)
+    verified = verify_indexes(db) if args.verify else True
+    client.close()
     
     # Optionally check usage stats
     check_index_usage()
     
+    if not verified:
+        sys.exit(1)
+    
     print("\n💡 Next steps:")
     print("   1. Monitor query performance in your application")
-    print("   2. Use db.collection.explain() to verify index usage")
-    print("   3. Consider adding more specific indexes based on query patterns")
\ No newline at end of file
+    print("   2. Run with --verify after changing queries in app/repository.py")
+    print("   3. Add new query shapes to app/indexes.py together with their indexes")
@@ -0,0 +1,31 @@
+"""
+Gunicorn settings for ChoosyTable
+Run with: PROMETHEUS_MULTIPROC_DIR=/tmp/choosytable-metrics gunicorn -c gunicorn.conf.py run:app
+
+With PROMETHEUS_MULTIPROC_DIR set, every worker writes its metrics to that
+directory and /metrics reports the totals of all workers. The directory is
+emptied when the server starts and a worker's gauges are dropped when it exits.
+
+With JOBS_MODE=thread (the default) every worker also runs job threads.
+"""
+
+import os
+import shutil
+
+bind = os.environ.get('GUNICORN_BIND', '0.0.0.0:8080')
+workers = int(os.environ.get('GUNICORN_WORKERS', 4))
+
+def on_starting(server):
+    metrics_dir = os.environ.get('PROMETHEUS_MULTIPROC_DIR')
+    if metrics_dir:
+        shutil.rmtree(metrics_dir, ignore_errors=True)
+        os.makedirs(metrics_dir)
+
+def post_worker_init(worker):
+    from app import start_job_workers
+    start_job_workers()
+
+def child_exit(server, worker):
+    if os.environ.get('PROMETHEUS_MULTIPROC_DIR'):
+        from prometheus_client import multiprocess
+        multiprocess.mark_process_dead(worker.pid)
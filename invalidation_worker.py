@@ -0,0 +1,87 @@
+#!/usr/bin/env python3
+"""
+Cache Invalidation Worker for ChoosyTable
+
+Tails the MongoDB change stream of the users, companies, reviews and
+interviews collections and clears the affected cache entries, so writes that
+bypass the web app are never served stale. The counters of every company a
+change touched are recomputed along the way. The worker resumes from the
+token it stored in MongoDB after each batch; see app/change_stream.py.
+
+Needs MONGO_URI to point at a replica set (a single node is enough) and the
+same memcached settings as the app.
+
+Usage: python3 invalidation_worker.py [--batch-size N] [--batch-wait S] [--no-recount]
+       [--pre-images] [--enable-pre-images] [--reset] [--once] [--name NAME]
+"""
+
+import argparse
+import logging
+import sys
+import time
+
+from pymongo.errors import PyMongoError
+
+from app.change_stream import InvalidationWorker
+
+# Seconds before reconnecting after MongoDB dropped the stream
+RECONNECT_DELAY = 5
+
+def main():
+    parser = argparse.ArgumentParser(description="Invalidate the cache from the MongoDB change stream")
+    parser.add_argument('--batch-size', type=int, default=500, help="most changes applied at once")
+    parser.add_argument('--batch-wait', type=float, default=1.0, help="seconds a batch collects changes")
+    parser.add_argument('--no-recount', action='store_true', help="don't recompute company counters")
+    parser.add_argument('--pre-images', action='store_true', help="read deleted documents from pre-images")
+    parser.add_argument('--enable-pre-images', action='store_true',
+                        help="turn on pre-images for the watched collections (MongoDB 6.0+) and exit")
+    parser.add_argument('--reset', action='store_true', help="forget the stored token and start with new changes")
+    parser.add_argument('--once', action='store_true', help="apply the changes so far and exit")
+    parser.add_argument('--name', default='cache_invalidation', help="key of the stored resume token")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s %(levelname)s %(name)s: %(message)s')
+
+    if args.enable_pre_images:
+        try:
+            InvalidationWorker.enable_pre_images()
+        except PyMongoError as e:
+            print(f"❌ Could not enable pre-images: {e}")
+            sys.exit(1)
+        print("✅ Pre-images enabled; run the worker with --pre-images")
+        return
+
+    worker = InvalidationWorker(
+        name=args.name, batch_size=args.batch_size, batch_wait=args.batch_wait,
+        recount=not args.no_recount, pre_images=args.pre_images
+    )
+    if args.reset:
+        worker.reset()
+        print(f"🧹 Forgot the stored position of '{args.name}'")
+
+    print(f"👀 Watching for changes ({'resuming' if worker.resume_token() else 'starting with new changes'})")
+    try:
+        while True:
+            try:
+                stats = worker.run(stop_when_idle=args.once)
+                break
+            except PyMongoError as e:
+                if args.once:
+                    print(f"❌ Change stream failed: {e}")
+                    sys.exit(1)
+                print(f"⚠️  Change stream failed, resuming in {RECONNECT_DELAY}s: {e}")
+                time.sleep(RECONNECT_DELAY)
+    except KeyboardInterrupt:
+        stats = worker.stats
+
+    print("=" * 60)
+    print(f"📊 {stats['changes']} changes in {stats['batches']} batches: {stats['keys']} keys deleted, "
+          f"{stats['versions']} versions bumped, {stats['recounted']} companies recounted")
+    if stats['unresolved']:
+        print(f"⚠️  {stats['unresolved']} deletes without a pre-image; consider --enable-pre-images")
+
+if __name__ == "__main__":
+    print("🔄 Cache Invalidation Worker")
+    print("=" * 60)
+
+    main()
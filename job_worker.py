@@ -0,0 +1,109 @@
+#!/usr/bin/env python3
+"""
+Background Job Worker for ChoosyTable
+
+Runs the jobs queued in MongoDB (profile fan-out, account erasure, cache
+warming; see app/jobs.py) in separate processes, for deployments that set
+JOBS_MODE=worker so web processes only serve requests. Every process runs
+--threads workers and finishes its current job on SIGTERM or Ctrl-C.
+
+Usage: python3 job_worker.py [--processes N] [--threads N] [--types a,b]
+       [--poll-interval S] [--status]
+"""
+
+import argparse
+import logging
+import multiprocessing
+import signal
+import sys
+
+def work(threads, types, poll_interval):
+    """Body of one worker process; the app is imported here, after the fork"""
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s %(levelname)s %(name)s: %(message)s')
+
+    import app
+    from app.jobs import JobWorker
+
+    workers = [
+        JobWorker(
+            app.job_queue, types=types, poll_interval=poll_interval,
+            observers=[app.metrics.job_finished] if app.metrics else []
+        )
+        for _ in range(threads)
+    ]
+
+    def stop(signum, frame):
+        for worker in workers:
+            worker.stop()
+
+    signal.signal(signal.SIGTERM, stop)
+    signal.signal(signal.SIGINT, stop)
+
+    running = [worker.start(f"job-worker-{index}") for index, worker in enumerate(workers)]
+    for thread in running:
+        # join with a timeout so the signal handler gets to run
+        while thread.is_alive():
+            thread.join(0.5)
+
+def show_status():
+    import app
+
+    counts = app.job_queue.counts()
+    for state in ('queued', 'running', 'done', 'failed'):
+        print(f"   • {state}: {counts.get(state, 0)}")
+    for job in app.job_queue.collection.find({'state': 'failed'}).sort('finished', -1).limit(5):
+        print(f"   ❌ {job['type']} {job['key']}: {job.get('error')}")
+
+def main():
+    parser = argparse.ArgumentParser(description="Run queued background jobs")
+    parser.add_argument('--processes', type=int, default=1)
+    parser.add_argument('--threads', type=int, default=2, help="workers per process")
+    parser.add_argument('--types', default='', help="comma-separated job types to run (default: all)")
+    parser.add_argument('--poll-interval', type=float, default=1.0, help="seconds between polls when idle")
+    parser.add_argument('--status', action='store_true', help="show the jobs per state and exit")
+    args = parser.parse_args()
+
+    if args.status:
+        print("📊 Jobs per state:")
+        show_status()
+        return
+
+    types = [job_type.strip() for job_type in args.types.split(',') if job_type.strip()] or None
+    print(f"🚀 Starting {args.processes} processes with {args.threads} workers each"
+          + (f" for {', '.join(types)}" if types else ""))
+
+    # spawn: every process opens its own MongoDB and memcached connections
+    context = multiprocessing.get_context('spawn')
+    processes = [
+        context.Process(target=work, args=(args.threads, types, args.poll_interval), name=f"job-worker-{index}")
+        for index in range(args.processes)
+    ]
+    for process in processes:
+        process.start()
+
+    def stop(signum, frame):
+        for process in processes:
+            if process.is_alive():
+                process.terminate()
+
+    signal.signal(signal.SIGTERM, stop)
+    try:
+        for process in processes:
+            process.join()
+    except KeyboardInterrupt:
+        # Ctrl-C reached the workers too; wait for their current jobs
+        for process in processes:
+            process.join()
+
+    print("=" * 60)
+    failed = [process for process in processes if process.exitcode not in (0, -signal.SIGTERM)]
+    if failed:
+        print(f"❌ {len(failed)} worker processes exited with an error")
+        sys.exit(1)
+    print("👋 Workers stopped")
+
+if __name__ == "__main__":
+    print("⚙️  Background Job Worker")
+    print("=" * 60)
+
+    main()
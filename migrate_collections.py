@@ -0,0 +1,223 @@
+#!/usr/bin/env python3
+"""
+Collection Migration Script for ChoosyTable
+
+Streams the legacy single `choosytable` collection into the normalized layout
+used by app/repository.py:
+
+- users:      user profile documents (same _id)
+- companies:  company header plus review_count, rating_sum, rating_count,
+              interview_counts and name_lower (same _id)
+- reviews:    one document per embedded review, with company_id and company name
+- interviews: one document per entry in the per-position arrays, with
+              company_id and position
+
+Documents are read with a cursor and written in bulk batches of upserts keyed
+by _id, so the script never holds the dataset in memory and can be re-run
+safely. The legacy collection is left untouched.
+
+With --recount the review counters of already-migrated companies are
+recomputed from the reviews collection instead, e.g. to backfill rating_sum
+and rating_count on companies created before those counters existed. With
+--names the normalized name_lower read by company search is backfilled.
+
+Usage: python3 migrate_collections.py [--batch-size N] [--dry-run] [--recount] [--names]
+"""
+
+import argparse
+import os
+import sys
+from datetime import datetime
+
+from bson import ObjectId
+from bson.errors import InvalidId
+from pymongo import MongoClient, ReplaceOne, UpdateOne
+
+from app.constants import POSITION_OPTIONS
+from app.repository import normalize_company_name
+from app.stats import build_interview_counts
+
+POSITION_KEYS = [key for key, _ in POSITION_OPTIONS]
+
+def created_at(item, fallback):
+    """Best-effort creation time for an embedded review or interview."""
+    if item.get('created'):
+        return item['created']
+    try:
+        return ObjectId(item['_id']).generation_time.replace(tzinfo=None)
+    except (KeyError, TypeError, InvalidId):
+        return fallback
+
+def split_company(doc):
+    """Split a legacy company document into header, reviews and interviews."""
+    fallback = doc.get('created') or doc.get('last_modified') or datetime.now()
+
+    # Embedded items without an _id get a deterministic one so re-runs upsert
+    # the same documents instead of duplicating them
+    reviews = []
+    for index, review in enumerate(doc.get('reviews') or []):
+        review = dict(review, company_id=doc['_id'], company=doc['company'])
+        review.setdefault('_id', f"{doc['_id']}:reviews:{index}")
+        review['created'] = created_at(review, fallback)
+        reviews.append(review)
+
+    interviews = []
+    for position_key in POSITION_KEYS:
+        for index, interview in enumerate(doc.get(position_key) or []):
+            interview = dict(interview, company_id=doc['_id'], position=position_key)
+            interview.setdefault('_id', f"{doc['_id']}:{position_key}:{index}")
+            interview['created'] = created_at(interview, fallback)
+            interviews.append(interview)
+
+    header = {
+        key: value for key, value in doc.items()
+        if key not in POSITION_KEYS and key not in ('reviews', 'interviews', 'interview_counts')
+    }
+    ratings = [review['rating'] for review in reviews if review.get('rating')]
+    header['review_count'] = len(reviews)
+    header['rating_sum'] = sum(ratings)
+    header['rating_count'] = len(ratings)
+    header['interview_counts'] = build_interview_counts(interviews)
+    header.setdefault('last_modified', fallback)
+    header['name_lower'] = normalize_company_name(doc['company'])
+
+    return header, reviews, interviews
+
+def migrate(db, batch_size, dry_run=False):
+    """Stream the legacy collection into the normalized collections."""
+
+    pending = {'users': [], 'companies': [], 'reviews': [], 'interviews': []}
+    totals = {name: 0 for name in pending}
+    skipped = 0
+
+    def flush(name):
+        operations = pending[name]
+        if operations and not dry_run:
+            db[name].bulk_write(operations, ordered=False)
+        totals[name] += len(operations)
+        pending[name] = []
+
+    def queue(name, document):
+        pending[name].append(ReplaceOne({'_id': document['_id']}, document, upsert=True))
+        if len(pending[name]) >= batch_size:
+            flush(name)
+
+    for scanned, doc in enumerate(db.choosytable.find().batch_size(batch_size), start=1):
+        if 'company' in doc:
+            header, reviews, interviews = split_company(doc)
+            queue('companies', header)
+            for review in reviews:
+                queue('reviews', review)
+            for interview in interviews:
+                queue('interviews', interview)
+        elif 'email' in doc:
+            queue('users', doc)
+        else:
+            skipped += 1
+
+        if scanned % (batch_size * 10) == 0:
+            print(f"   ⏳ {scanned} legacy documents scanned")
+
+    for name in pending:
+        flush(name)
+
+    return totals, skipped
+
+def recount_review_counters(db, batch_size, dry_run=False):
+    """Recompute review_count, rating_sum and rating_count from the reviews collection."""
+    pipeline = [
+        {'$group': {
+            '_id': '$company_id',
+            'review_count': {'$sum': 1},
+            'rating_sum': {'$sum': {'$cond': [{'$gt': ['$rating', 0]}, '$rating', 0]}},
+            'rating_count': {'$sum': {'$cond': [{'$gt': ['$rating', 0]}, 1, 0]}}
+        }}
+    ]
+    counters = {row.pop('_id'): row for row in db.reviews.aggregate(pipeline, allowDiskUse=True)}
+    empty = {'review_count': 0, 'rating_sum': 0, 'rating_count': 0}
+
+    operations, updated = [], 0
+    for company in db.companies.find({}, {'_id': 1}).batch_size(batch_size):
+        operations.append(UpdateOne({'_id': company['_id']}, {'$set': counters.get(company['_id'], empty)}))
+        if len(operations) >= batch_size:
+            if not dry_run:
+                db.companies.bulk_write(operations, ordered=False)
+            updated += len(operations)
+            operations = []
+    if operations and not dry_run:
+        db.companies.bulk_write(operations, ordered=False)
+    return updated + len(operations)
+
+def backfill_company_names(db, batch_size, dry_run=False):
+    """Set name_lower on companies whose normalized name is missing or outdated."""
+    operations, updated = [], 0
+    for company in db.companies.find({}, {'company': 1, 'name_lower': 1}).batch_size(batch_size):
+        name_lower = normalize_company_name(company.get('company'))
+        if company.get('name_lower') == name_lower:
+            continue
+        operations.append(UpdateOne({'_id': company['_id']}, {'$set': {'name_lower': name_lower}}))
+        if len(operations) >= batch_size:
+            if not dry_run:
+                db.companies.bulk_write(operations, ordered=False)
+            updated += len(operations)
+            operations = []
+    if operations and not dry_run:
+        db.companies.bulk_write(operations, ordered=False)
+    return updated + len(operations)
+
+def main():
+    parser = argparse.ArgumentParser(description="Migrate ChoosyTable to normalized collections")
+    parser.add_argument('--batch-size', type=int, default=500, help="documents per bulk write")
+    parser.add_argument('--dry-run', action='store_true', help="scan and count without writing")
+    parser.add_argument('--recount', action='store_true', help="only recompute company review counters")
+    parser.add_argument('--names', action='store_true', help="only backfill the normalized company names")
+    args = parser.parse_args()
+
+    try:
+        mongo_uri = os.environ.get('MONGO_URI', 'mongodb://localhost:27017/choosytable')
+        client = MongoClient(mongo_uri)
+        db = client.choosytable
+        print("🔗 Connected to MongoDB")
+        print(f"📊 Database: {db.name}")
+        print()
+    except Exception as e:
+        print(f"❌ Failed to connect to MongoDB: {e}")
+        sys.exit(1)
+
+    if args.recount:
+        print("🔢 Recomputing company review counters" + (" (dry run)" if args.dry_run else ""))
+        updated = recount_review_counters(db, args.batch_size, args.dry_run)
+        print(f"   ✅ companies: {updated} documents")
+        client.close()
+        return
+
+    if args.names:
+        print("🔤 Backfilling normalized company names" + (" (dry run)" if args.dry_run else ""))
+        updated = backfill_company_names(db, args.batch_size, args.dry_run)
+        print(f"   ✅ companies: {updated} documents")
+        client.close()
+        return
+
+    print("🚚 Migrating legacy documents" + (" (dry run)" if args.dry_run else ""))
+    print("=" * 60)
+
+    totals, skipped = migrate(db, args.batch_size, args.dry_run)
+
+    print("=" * 60)
+    print("📊 Summary:")
+    for name, count in totals.items():
+        print(f"   ✅ {name}: {count} documents")
+    print(f"   ⏭️  Skipped: {skipped} unrecognized documents")
+
+    client.close()
+
+    print("\n💡 Next steps:")
+    print("   1. Run python3 create_indexes.py to index the new collections")
+    print("   2. Run python3 check_stats_parity.py to verify the statistics")
+    print("   3. Drop the legacy choosytable collection once the app is verified")
+
+if __name__ == "__main__":
+    print("🗄️  ChoosyTable Collection Migration")
+    print("=" * 60)
+
+    main()
@@ -0,0 +1,74 @@
+#!/usr/bin/env python3
+"""
+Company Counter Recount for ChoosyTable
+
+Recomputes review_count, rating_sum, rating_count and interview_counts of
+every company from its reviews and interviews, rewrites the ones that
+differ and clears their cached pages.
+
+On a replica set reviews and interviews are written in one transaction with
+their counters, so this only finds drift from writes made around the app.
+A standalone MongoDB has no transactions: a crash between a write and its
+counter update leaves the counters short, and this script is what repairs
+them. Schedule it there, e.g. hourly from cron, or run it with --every as a
+worker:
+
+    0 * * * *  cd /srv/choosytable && python3 recount_counters.py
+
+Usage: python3 recount_counters.py [--batch-size N] [--every S]
+"""
+
+import argparse
+import logging
+import sys
+import time
+
+from app import cache_manager
+from app import repository
+
+def recount(batch_size):
+    """Recount every company; returns the ids of the corrected ones"""
+    corrected = []
+    for company_ids in repository.iter_company_id_batches(batch_size):
+        fixed = repository.recount_company_counters(company_ids)
+        if fixed:
+            cache_manager.invalidate_many([('company', {'company_id': company_id}) for company_id in fixed])
+            corrected.extend(fixed)
+    return corrected
+
+def main():
+    parser = argparse.ArgumentParser(description="Recompute company counters from reviews and interviews")
+    parser.add_argument('--batch-size', type=int, default=500, help="companies recounted at once")
+    parser.add_argument('--every', type=float, help="keep running, recounting every S seconds")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s %(levelname)s %(name)s: %(message)s')
+
+    try:
+        while True:
+            started = time.perf_counter()
+            try:
+                corrected = recount(args.batch_size)
+            except Exception as e:
+                if not args.every:
+                    print(f"❌ Recount failed: {e}")
+                    sys.exit(1)
+                print(f"⚠️  Recount failed, retrying in {args.every}s: {e}")
+            else:
+                print(f"🔢 Recounted all companies in {time.perf_counter() - started:.3f}s")
+                if corrected:
+                    print(f"⚠️  Corrected the counters of {len(corrected)} companies: {', '.join(corrected)}")
+            if not args.every:
+                break
+            time.sleep(args.every)
+    except KeyboardInterrupt:
+        pass
+
+    print("=" * 60)
+    print("✅ Counters consistent")
+
+if __name__ == "__main__":
+    print("🔢 Company Counter Recount")
+    print("=" * 60)
+
+    main()
@@ -4,7 +4,13 @@ Simple entry point for the Flask application.
 Run with: python3 run.py
 """
 
-from app import app
+import os
+
+from app import app, start_job_workers
 
 if __name__ == '__main__':
-    app.run(debug=True)
\ No newline at end of file
+    # The reloader's watcher process re-runs this file; only the child that
+    # serves requests runs jobs
+    if os.environ.get('WERKZEUG_RUN_MAIN') == 'true':
+        start_job_workers()
+    app.run(debug=True)
@@ -0,0 +1,70 @@
+"""
+Test setup for ChoosyTable
+Importing anything under ``app`` builds the Flask app, so MongoDB and
+memcached are replaced by in-memory fakes - mongomock and pymemcache's
+MockMemcacheClient - before the first import.
+"""
+
+import os
+import sys
+
+import flask_pymongo
+import mongomock
+import mongomock.collection
+import pytest
+from pymemcache.client import base as memcache_base
+from pymemcache.test.utils import MockMemcacheClient
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+os.environ.update({
+    'SECRET_KEY': 'test',
+    'USE_MOCK_AUTH': 'true',
+    'JOBS_MODE': 'inline',
+    'METRICS_ENABLED': 'false',
+    'INSTRUMENTATION_ENABLED': 'false',
+    'CACHE_WARM_ON_WRITE': 'false',
+})
+
+
+class FakeMongoClient(mongomock.MongoClient):
+    """mongomock client that accepts (and ignores) the app's pool options"""
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **{key: value for key, value in kwargs.items() if key == 'tz_aware'})
+
+
+class FakeMemcacheClient(MockMemcacheClient):
+    """In-memory memcached that accepts (and ignores) the pooled client's options"""
+
+    def __init__(self, server=None, max_pool_size=None, pool_idle_timeout=0, **kwargs):
+        super().__init__(server, **kwargs)
+
+
+def _without_sort(add):
+    # mongomock predates the 'sort' argument pymongo 4.11+ passes for bulk updates
+    def wrapper(*args, sort=None, **kwargs):
+        return add(*args, **kwargs)
+    return wrapper
+
+
+flask_pymongo.MongoClient = FakeMongoClient
+memcache_base.PooledClient = FakeMemcacheClient
+mongomock.collection.BulkOperationBuilder.add_update = _without_sort(
+    mongomock.collection.BulkOperationBuilder.add_update
+)
+mongomock.collection.BulkOperationBuilder.add_replace = _without_sort(
+    mongomock.collection.BulkOperationBuilder.add_replace
+)
+
+
+@pytest.fixture
+def db(monkeypatch):
+    """The app's database, emptied after each test; mongomock has no transactions"""
+    import app
+    from app import repository
+
+    monkeypatch.setattr(repository, 'transactions_supported', lambda: False)
+    yield app.db
+    for name in app.db.list_collection_names():
+        app.db.drop_collection(name)
@@ -0,0 +1,126 @@
+"""
+Counter recounts and change-stream invalidation (app/change_stream.py), with
+change events built by hand; check_change_stream.py runs the worker against
+a real replica set.
+"""
+
+from bson import ObjectId
+
+import recount_counters
+from app import cache_manager, repository
+from app.change_stream import InvalidationWorker, invalidations_for
+
+POSITION = 'software_engineer'
+
+
+def company_with_content():
+    company_id = repository.create_company('Acme', {'review': 'great', 'rating': 5, 'user': 'u1'})
+    repository.add_review(company_id, {'review': 'meh', 'rating': 2, 'user': 'u2'})
+    repository.record_interview(str(company_id), POSITION, {'user': 'u1', 'user_ethnicity': 'Asian', 'win': 'y'})
+    return company_id
+
+
+def change(operation, collection, document, **fields):
+    event = {
+        'operationType': operation,
+        'ns': {'db': 'choosytable', 'coll': collection},
+        'documentKey': {'_id': document['_id']},
+        'fullDocument': document,
+    }
+    if fields:
+        event['updateDescription'] = {'updatedFields': fields, 'removedFields': []}
+    return event
+
+
+def counters(db, company_id):
+    return db.companies.find_one(
+        {'_id': company_id}, {'_id': 0, 'review_count': 1, 'rating_sum': 1, 'rating_count': 1, 'interview_counts': 1}
+    )
+
+
+def test_recount_corrects_only_drifted_companies(db):
+    drifted, intact = company_with_content(), company_with_content()
+    expected = counters(db, drifted)
+    db.companies.update_one({'_id': drifted}, {'$inc': {'review_count': 3, 'rating_sum': -2}})
+    db.companies.update_one(
+        {'_id': intact}, {'$set': {f'interview_counts.{POSITION}.Black': {'y': 0, 'n': 0, 'o': 0, 'total': 0}}}
+    )
+
+    # Empty buckets left behind by counter moves aren't drift
+    assert repository.recount_company_counters([drifted, str(intact)]) == [str(drifted)]
+    assert counters(db, drifted) == expected
+    assert repository.recount_company_counters([drifted, intact]) == []
+
+
+def test_recount_of_a_company_without_content(db):
+    company_id = company_with_content()
+    db.reviews.delete_many({})
+    db.interviews.delete_many({})
+
+    assert repository.recount_company_counters([company_id]) == [str(company_id)]
+    assert counters(db, company_id) == {'review_count': 0, 'rating_sum': 0, 'rating_count': 0, 'interview_counts': {}}
+
+
+def test_recount_script_covers_every_company_in_batches(db):
+    company_ids = [company_with_content() for _ in range(5)]
+    for company_id in company_ids[1::2]:
+        db.companies.update_one({'_id': company_id}, {'$set': {'review_count': 0}})
+
+    assert sorted(recount_counters.recount(batch_size=2)) == sorted(str(c) for c in company_ids[1::2])
+    assert all(db.companies.find_one({'_id': c})['review_count'] == 2 for c in company_ids)
+
+
+def test_invalidations_for_changes():
+    company_id, review_id = ObjectId(), str(ObjectId())
+    review = {'_id': review_id, 'company_id': company_id, 'user': 'u1'}
+    assert invalidations_for(change('insert', 'reviews', review)) == (
+        [('user', {'user_id': 'u1'}), ('company', {'company_id': str(company_id)})], [str(company_id)]
+    )
+    interview = {'_id': 'i1', 'company_id': company_id, 'user': 'u1'}
+    assert invalidations_for(change('insert', 'interviews', interview)) == (
+        [('company_stats', {'company_id': str(company_id)})], [str(company_id)]
+    )
+    # The profile fan-out's demographic copies change nothing cached
+    assert invalidations_for(change('update', 'reviews', review, ethnicity='Asian')) == ([], [])
+    user = {'_id': ObjectId(), 'email': 'a@example.com'}
+    assert invalidations_for(change('update', 'users', user, last_login=1)) == ([], [])
+
+
+def test_worker_recounts_and_clears_the_touched_companies(db):
+    company_id = company_with_content()
+    expected = counters(db, company_id)
+    # A review inserted around the app: the counters never moved
+    review = {'_id': str(ObjectId()), 'company_id': company_id, 'company': 'Acme', 'review': 'ok',
+              'rating': 5, 'user': 'u3'}
+    db.reviews.insert_one(review)
+    cache_manager.fetch('company', lambda: {'review_count': 2}, company_id=str(company_id))
+    assert cache_manager.get_many([('company', {'company_id': str(company_id)})]) == [{'review_count': 2}]
+
+    worker = InvalidationWorker(name='test')
+    result = worker.apply([change('insert', 'reviews', review)])
+
+    assert result['changes'] == 1 and result['recounted'] == 1
+    assert counters(db, company_id) == dict(expected, review_count=3, rating_sum=12, rating_count=3)
+    assert cache_manager.get_many([('company', {'company_id': str(company_id)})]) == [None]
+
+
+def test_worker_without_recount_leaves_counters(db):
+    company_id = company_with_content()
+    db.companies.update_one({'_id': company_id}, {'$set': {'review_count': 9}})
+    document = db.companies.find_one({'_id': company_id})
+
+    worker = InvalidationWorker(name='test', recount=False)
+    assert worker.apply([change('update', 'companies', document, review_count=9)])['recounted'] == 0
+    assert db.companies.find_one({'_id': company_id})['review_count'] == 9
+
+
+def test_worker_resume_token_is_kept_per_name(db):
+    worker = InvalidationWorker(name='test')
+    assert worker.resume_token() is None
+    worker.save_token({'_data': 'token-1'})
+    worker.save_token(None)
+    assert InvalidationWorker(name='test').resume_token() == {'_data': 'token-1'}
+    assert InvalidationWorker(name='other').resume_token() is None
+
+    worker.reset()
+    assert worker.resume_token() is None
@@ -0,0 +1,223 @@
+"""
+Failover of the multi-node memcached client (app/memcached.py) and the
+circuit breaker (app/circuit_breaker.py), against in-memory nodes that can
+be stopped. check_memcached_failover.py runs the same checks on real
+memcached processes.
+"""
+
+import time
+
+import pymemcache.client.hash
+import pytest
+from pymemcache.test.utils import MockMemcacheClient
+
+from app.cache import KEY_PREFIX, LocalCache, TieredCache
+from app.circuit_breaker import CircuitBreakerClient, CircuitOpenError
+from app.memcached import ReplicatingClient, make_memcached_client
+from app.serde import make_serde
+
+SERVERS = [('127.0.0.1', 11311 + index) for index in range(3)]
+HOT_PREFIX = KEY_PREFIX + 'companies_page'
+
+
+class FakeNode(MockMemcacheClient):
+    """One memcached server; calls to a stopped server fail like a refused connection"""
+
+    stopped = set()
+
+    def __init__(self, server, serde=None, **options):
+        # The socket and pool options HashClient passes mean nothing here
+        super().__init__(server, serde=serde)
+        self.server = server
+
+    def _check(self):
+        if self.server in self.stopped:
+            raise ConnectionRefusedError(f"memcached {self.server} is stopped")
+
+    def get(self, *args, **kwargs):
+        self._check()
+        return super().get(*args, **kwargs)
+
+    def get_many(self, *args, **kwargs):
+        self._check()
+        return super().get_many(*args, **kwargs)
+
+    def set(self, *args, **kwargs):
+        self._check()
+        return super().set(*args, **kwargs)
+
+    def set_many(self, *args, **kwargs):
+        self._check()
+        return super().set_many(*args, **kwargs)
+
+    def delete_many(self, *args, **kwargs):
+        self._check()
+        return super().delete_many(*args, **kwargs)
+
+
+@pytest.fixture
+def client(monkeypatch):
+    FakeNode.stopped = set()
+    monkeypatch.setattr(pymemcache.client.hash, 'PooledClient', FakeNode)
+    # As in check_memcached_failover.py: one failed retry marks a node dead
+    return make_memcached_client(
+        SERVERS, make_serde('bson'), dead_retry_attempts=1, dead_retry_timeout=0, dead_timeout=600
+    )
+
+
+def node_of(client, key):
+    return client.hasher.get_node(key)
+
+
+def stop(client, node):
+    server = client.clients[node].server
+    FakeNode.stopped.add(server)
+
+
+def read_until_dead(client, key):
+    """Read a key of a stopped node until the client gives up on the node"""
+    for _ in range(3):
+        try:
+            client.get(key)
+        except OSError:
+            continue
+        return
+
+
+def test_only_the_stopped_nodes_keys_move(client):
+    keys = [f"{KEY_PREFIX}failover:{index}" for index in range(200)]
+    client.set_many({key: {'index': index} for index, key in enumerate(keys)}, 600, noreply=False)
+    before = {key: node_of(client, key) for key in keys}
+    assert len(set(before.values())) == len(SERVERS)
+    assert len(client.get_many(keys)) == len(keys)
+
+    victim = before[keys[0]]
+    stop(client, victim)
+    read_until_dead(client, keys[0])
+    assert victim not in client.hasher.nodes
+
+    after = {key: node_of(client, key) for key in keys}
+    survivors = [key for key in keys if before[key] != victim]
+    assert all(after[key] == before[key] for key in survivors)
+    assert all(after[key] != victim for key in keys)
+    # Keys on the surviving nodes are still served; the moved ones are misses
+    assert {key: value['index'] for key, value in client.get_many(survivors).items()} == {
+        key: keys.index(key) for key in survivors
+    }
+
+
+def test_replicated_hot_key_stays_readable_when_its_node_stops(client):
+    hot_client = ReplicatingClient(client, [HOT_PREFIX], replicas=len(SERVERS))
+    hot_key = f"{HOT_PREFIX}:1:0:10"
+    assert hot_client.set(hot_key, {'companies': ['hot']}, 600, noreply=False)
+    assert len({node_of(client, key) for key in hot_client.replica_keys(hot_key)}) > 1
+
+    stop(client, node_of(client, hot_key))
+    for _ in range(5):
+        assert hot_client.get(hot_key) == {'companies': ['hot']}
+        assert hot_client.get_many([hot_key]) == {hot_key: {'companies': ['hot']}}
+
+
+def test_replicated_key_raises_when_every_copy_fails(client):
+    hot_client = ReplicatingClient(client, [HOT_PREFIX], replicas=2)
+    hot_key = f"{HOT_PREFIX}:1:0:10"
+    hot_client.set(hot_key, {'companies': ['hot']}, 600, noreply=False)
+
+    FakeNode.stopped.update(server for server in SERVERS)
+    with pytest.raises(OSError):
+        hot_client.get(hot_key)
+
+
+def test_cold_keys_are_not_replicated(client):
+    hot_client = ReplicatingClient(client, [HOT_PREFIX], replicas=3)
+    key = KEY_PREFIX + 'company:1'
+    hot_client.set(key, {'company': 'Acme'}, 600, noreply=False)
+    assert client.get(key) == {'company': 'Acme'}
+    assert client.get(hot_client.replica_keys(key)[1]) is None
+
+
+class FlakyClient:
+    """memcached stand-in whose calls fail while ``down`` is set"""
+
+    def __init__(self):
+        self.down = False
+        self.calls = 0
+
+    def get(self, key):
+        self.calls += 1
+        if self.down:
+            raise ConnectionRefusedError("memcached is down")
+        return None
+
+    def set(self, key, value, expire=0, noreply=None):
+        self.calls += 1
+        if self.down:
+            raise ConnectionRefusedError("memcached is down")
+        return True
+
+    def add(self, key, value, expire=0, noreply=None):
+        return self.set(key, value, expire, noreply)
+
+    def delete(self, key, noreply=None):
+        self.calls += 1
+        if self.down:
+            raise ConnectionRefusedError("memcached is down")
+        return True
+
+
+def test_breaker_opens_after_consecutive_failures():
+    flaky = FlakyClient()
+    breaker = CircuitBreakerClient(flaky, failure_threshold=3, reset_timeout=60)
+    flaky.down = True
+    for _ in range(3):
+        with pytest.raises(ConnectionRefusedError):
+            breaker.get('k')
+    assert breaker.state == 'open'
+
+    calls = flaky.calls
+    with pytest.raises(CircuitOpenError):
+        breaker.get('k')
+    assert flaky.calls == calls
+
+
+def test_breaker_trial_call_closes_or_reopens_it():
+    flaky = FlakyClient()
+    breaker = CircuitBreakerClient(flaky, failure_threshold=1, reset_timeout=0.05)
+    flaky.down = True
+    with pytest.raises(ConnectionRefusedError):
+        breaker.get('k')
+    time.sleep(0.06)
+    assert breaker.state == 'half-open'
+
+    # A failed trial reopens the breaker for another period
+    with pytest.raises(ConnectionRefusedError):
+        breaker.get('k')
+    assert breaker.state == 'open'
+
+    time.sleep(0.06)
+    flaky.down = False
+    assert breaker.get('k') is None
+    assert breaker.state == 'closed'
+
+
+def test_breaker_ignores_caller_errors():
+    class BadKeyClient:
+        def get(self, key):
+            raise ValueError("illegal key")
+
+    breaker = CircuitBreakerClient(BadKeyClient(), failure_threshold=1, reset_timeout=60)
+    for _ in range(3):
+        with pytest.raises(ValueError):
+            breaker.get('bad key')
+    assert breaker.state == 'closed'
+
+
+def test_cache_reads_fall_through_while_memcached_is_down():
+    flaky = FlakyClient()
+    cache = TieredCache(CircuitBreakerClient(flaky, failure_threshold=1, reset_timeout=60), LocalCache())
+    flaky.down = True
+    loads = []
+    for index in range(3):
+        assert cache.fetch(f'k{index}', lambda: loads.append(1) or 'value', 60) == 'value'
+    assert len(loads) == 3
+    assert cache.stats()['memcached']['errors'] >= 1
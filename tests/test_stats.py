@@ -0,0 +1,81 @@
+"""Parity of the Python and aggregation statistics backends (app/stats.py)"""
+
+import pytest
+
+from app import repository
+from app.constants import POSITION_OPTIONS
+from app.stats import (
+    aggregate_interview_statistics, aggregate_rating_average, check_parity, counter_ethnicity,
+    rating_average_from_counters, statistics_from_counts
+)
+
+POSITION = POSITION_OPTIONS[0][0]
+POSITION_NAME = POSITION_OPTIONS[0][1]
+
+
+@pytest.mark.parametrize('ethnicity, field', [
+    ('Asian', 'Asian'),
+    ('Mixed.Other', 'Mixed_Other'),
+    ('$where', 'where'),
+    ('', 'Unknown'),
+    (None, 'Unknown'),
+])
+def test_counter_ethnicity(ethnicity, field):
+    assert counter_ethnicity(ethnicity) == field
+
+
+def test_statistics_from_counts_truncates_percentages():
+    counts = {POSITION: {'Asian': {'y': 2, 'n': 1, 'o': 0, 'total': 3}, 'Black': {'total': 0}}}
+    assert statistics_from_counts(POSITION_OPTIONS, counts) == [
+        [POSITION_NAME, 'Asian', {'y': 66, 'n': 33, 'o': 0}]
+    ]
+
+
+def record(company_id, ethnicity, win, position=POSITION):
+    interview = {'user': 'u', 'win': win}
+    if ethnicity is not None:
+        interview['user_ethnicity'] = ethnicity
+    assert repository.record_interview(str(company_id), position, interview)
+
+
+def python_and_aggregated(db, company_id):
+    company = db.companies.find_one({'_id': company_id})
+    python_stats = statistics_from_counts(POSITION_OPTIONS, company['interview_counts'])
+    aggregated_stats = aggregate_interview_statistics(db.interviews, str(company_id), POSITION_OPTIONS)
+    return sorted(map(repr, python_stats)), sorted(map(repr, aggregated_stats))
+
+
+def test_backends_agree_on_interview_statistics(db):
+    company_id = repository.create_company('Acme', {'review': 'ok', 'rating': 4, 'user': 'u'})
+    for ethnicity, win in [('Asian', 'y'), ('Asian', 'n'), ('Asian', 'y'), ('Black', 'o'),
+                           (None, 'y'), ('', 'n')]:
+        record(company_id, ethnicity, win)
+    record(company_id, 'Asian', 'y', position=POSITION_OPTIONS[1][0])
+
+    python_stats, aggregated_stats = python_and_aggregated(db, company_id)
+    assert python_stats == aggregated_stats
+    assert repr([POSITION_NAME, 'Unknown', {'y': 50, 'n': 50, 'o': 0}]) in python_stats
+
+
+def test_backends_agree_on_rewritten_ethnicities(db):
+    # Counters store 'Mixed.Other' as 'Mixed_Other' (no dots in field names),
+    # and both spellings share that counter; the aggregation must match
+    company_id = repository.create_company('Acme', {'review': 'ok', 'rating': 4, 'user': 'u'})
+    for ethnicity, win in [('Mixed.Other', 'y'), ('Mixed_Other', 'n'), ('$Other', 'y')]:
+        record(company_id, ethnicity, win)
+
+    python_stats, aggregated_stats = python_and_aggregated(db, company_id)
+    assert python_stats == aggregated_stats
+    assert repr([POSITION_NAME, 'Mixed_Other', {'y': 50, 'n': 50, 'o': 0}]) in aggregated_stats
+    assert check_parity(db, POSITION_OPTIONS) == []
+
+
+def test_backends_agree_on_rating_average(db):
+    company_id = repository.create_company('Acme', {'review': 'great', 'rating': 5, 'user': 'u1'})
+    repository.add_review(company_id, {'review': 'fine', 'rating': 2, 'user': 'u2'})
+    repository.add_review(company_id, {'review': 'no rating', 'user': 'u3'})
+
+    company = db.companies.find_one({'_id': company_id})
+    assert company['review_count'] == 3
+    assert rating_average_from_counters(company) == 3.5
+    assert aggregate_rating_average(db.reviews, str(company_id)) == 3.5
@@ -0,0 +1,70 @@
+#!/usr/bin/env python3
+"""
+Cache Warmer for ChoosyTable
+
+Fills the cached company listing and the pages of the hot companies (see
+app/warming.py), so visitors after a deploy or a memcached restart don't
+start on a cold cache. Run it once from the deploy, or with --every as a
+worker that keeps refilling whatever memcached lost or let expire.
+
+Usage: python3 warm_cache.py [--top N] [--by recent|reviews] [--concurrency N]
+       [--pages N] [--force] [--every S] [--queue]
+"""
+
+import argparse
+import logging
+import sys
+import time
+
+from app import job_queue
+from app.warming import warm_cache
+
+def main():
+    parser = argparse.ArgumentParser(description="Pre-populate the cache with the hot pages")
+    parser.add_argument('--top', type=int, help="number of hot companies (default: CACHE_WARM_TOP_N)")
+    parser.add_argument('--by', choices=['recent', 'reviews'],
+                        help="pick hot companies by last modification or review count (default: CACHE_WARM_BY)")
+    parser.add_argument('--concurrency', type=int, help="companies filled at once (default: CACHE_WARM_CONCURRENCY)")
+    parser.add_argument('--pages', type=int, help="listing pages to fill (default: CACHE_WARM_LISTING_PAGES)")
+    parser.add_argument('--force', action='store_true', help="recompute entries that are already cached")
+    parser.add_argument('--every', type=float, help="keep running, filling missing entries every S seconds")
+    parser.add_argument('--queue', action='store_true', help="queue a warming job for the job workers and exit")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s %(levelname)s %(name)s: %(message)s')
+
+    if args.queue:
+        job_id = job_queue.submit('warm_cache', {'force': args.force}, key='all')
+        print(f"📬 Queued cache warming job {job_id}")
+        return
+
+    try:
+        while True:
+            try:
+                result = warm_cache(args.top, args.by, args.concurrency, args.pages, args.force)
+            except Exception as e:
+                if not args.every:
+                    print(f"❌ Cache warming failed: {e}")
+                    sys.exit(1)
+                print(f"⚠️  Cache warming failed, retrying in {args.every}s: {e}")
+            else:
+                print(f"🔥 {result['entries']} entries stored for the listing and {result['companies']} companies "
+                      f"in {result['seconds']}s")
+                if result['failed']:
+                    print(f"⚠️  {result['failed']} companies could not be warmed")
+            if not args.every:
+                break
+            time.sleep(args.every)
+            # Later rounds only fill what went missing
+            args.force = False
+    except KeyboardInterrupt:
+        pass
+
+    print("=" * 60)
+    print("✅ Cache warm")
+
+if __name__ == "__main__":
+    print("🔥 Cache Warmer")
+    print("=" * 60)
+
+    main()